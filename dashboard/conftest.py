@@ -0,0 +1,50 @@
+"""Conftest file with fixtures for the dashboard tests"""
+
+from pytest import fixture
+import pandas as pd
+
+
+def get_readings(rows: list[tuple]) -> pd.DataFrame:
+    """Returns archived readings from (plant_name, continent, recording_taken,
+    soil_moisture, temperature, error) rows"""
+
+    readings = pd.DataFrame(rows, columns=["plant_name", "continent", "recording_taken",
+                                           "soil_moisture", "temperature", "error"])
+    return readings.astype({"recording_taken": "datetime64[us]", "soil_moisture": "float32",
+                            "temperature": "float32"})
+
+
+@fixture
+def archive_paths(tmp_path) -> tuple[str]:
+    """Returns the paths of two archive objects over 2023-09-01 to 2023-09-03. The
+    first was written before result_id was added, so does not have the column"""
+
+    old_readings = get_readings([
+        ("Plant A", "Europe", "2023-09-01 10:00", 20, 10, "No Error"),
+        ("Plant B", "Asia", "2023-09-01 11:00", 40, 20, "No Error"),
+        ("Plant A", "Europe", "2023-09-01 12:00", None, 99, "Soil moisture missing")])
+    new_readings = get_readings([
+        ("Plant A", "Europe", "2023-09-02 10:00", 30, 14, "No Error"),
+        ("Plant C", "Europe", "2023-09-02 11:00", 50, 18, "No Error"),
+        ("Plant B", "Asia", "2023-09-03 00:00", 90, 40, "No Error")]).assign(
+            result_id=pd.array([1, 2, 3], dtype="Int64"))
+
+    paths = (str(tmp_path / "old.parquet"), str(tmp_path / "new.parquet"))
+    old_readings.to_parquet(paths[0], index=False)
+    new_readings.to_parquet(paths[1], index=False)
+    return paths
+
+
+@fixture
+def manifest() -> pd.DataFrame:
+    """Returns a manifest of three archive objects, over two days and three plants"""
+
+    return pd.DataFrame({
+        "key": ["readings/date=2023-09-01/part-a.parquet", "readings/date=2023-09-02/part-b.parquet",
+                "readings/date=2023-09-02/part-c.parquet"],
+        "min_recording_taken": pd.to_datetime(["2023-09-01 10:00", "2023-09-02 10:00",
+                                               "2023-09-02 12:00"]),
+        "max_recording_taken": pd.to_datetime(["2023-09-01 12:00", "2023-09-02 11:00",
+                                               "2023-09-02 23:59"]),
+        "plant_names": [["Plant A", "Plant B"], ["Plant A", "Plant C"], ["Plant B"]],
+        "etag": ['"a"', '"b"', None]})
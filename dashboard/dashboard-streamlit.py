@@ -1,37 +1,260 @@
 """Dashboard to display data from long term storage on S3"""
 
-from os import environ, path, remove
-from datetime import datetime, timedelta
+from os import environ, makedirs, path, remove, scandir, utime
+from datetime import date, datetime, timedelta
+from glob import glob
+from hashlib import sha1
+from io import BytesIO
+import sys
+from threading import RLock
+import time
 
 from boto3 import client
 from botocore.client import BaseClient
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
-import matplotlib.pyplot as plt
+import duckdb
+from matplotlib.figure import Figure
 import pandas as pd
 import seaborn as sns
 import streamlit as st
 
+# The readings and rollups are typed and summarised with the modules of the long term load,
+# which writes them. The dashboard image copies them alongside this file, and running from
+# the repository finds them in long_term_data
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), "..", "long_term_data"))
+# pylint: disable=wrong-import-position
+from reading_schema import apply_reading_schema
+from rollups import merge_sketches, summarise_rollup
+
+
+ARCHIVE_PREFIX = "readings/"
+MANIFEST_KEY = "manifest/readings.parquet"
+CACHE_FOLDER = environ.get("ARCHIVE_CACHE_FOLDER", "archive_cache")
+CACHE_MAX_BYTES = int(environ.get("ARCHIVE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+# How long the paths of fetched objects are cached for, during which they are not evicted
+PATHS_TTL_SECONDS = 30
+
+# Archive objects written before result_id was added are read alongside newer ones by name
+READINGS = "read_parquet($paths, union_by_name = true)"
+
+# Rendered charts are cached by the archive objects they were drawn from, which identify
+# the version of the data, and by only the selection they depend on
+FIGURE_CACHE_SIZE = 64
+
+# Time series are reduced to about one minimum and maximum per pixel of the chart width
+CHART_WIDTH_PIXELS = 640
+ROLLUP_PREFIX = "rollups/"
+RESOLUTIONS = ["Auto", "Readings", "Hourly", "Daily"]
+
+
+class ArchiveCache:
+    """
+    Read-through cache of archive objects keyed on their ETag.
+    Objects are kept in a folder on disk, evicting the least recently read once it
+    is full, and any parsed into data-frames are kept in memory between reruns.
+    The cache is shared by every session, so it is only changed while holding its lock
+    """
+
+    def __init__(self, folder: str = CACHE_FOLDER, max_bytes: int = CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.frames = {}
+        # paths handed out to cached results, with the time until which they are kept
+        self.pinned = {}
+        self.lock = RLock()
+        makedirs(folder, exist_ok=True)
+
+    def get_path(self, key: str, etag: str = "*") -> str:
+        """Returns the path an object is cached at on disk, or a pattern for any version of it"""
+
+        key_hash = sha1(key.encode()).hexdigest()
+        file_etag = etag.strip('"')
+        return path.join(self.folder, f"{key_hash}-{file_etag}.parquet")
+
+    def get_cached_etag(self, key: str) -> str | None:
+        """Returns the ETag of the cached copy of an object, if there is one"""
+
+        for cached_path in glob(self.get_path(key)):
+            return '"' + path.basename(cached_path).split("-", 1)[1].removesuffix(".parquet") + '"'
+        return None
+
+    def fetch(self, s_three: BaseClient, bucket_name: str, key: str, etag: str | None = None) -> str:
+        """
+        Returns the path of an up to date copy of an object on disk. When its current ETag is
+        already known from the manifest a cached copy is used without asking S3, otherwise
+        the cached copy is revalidated with a single conditional GET
+        """
+
+        with self.lock:
+            cached_etag = self.get_cached_etag(key)
+            if cached_etag is None or cached_etag != etag:
+                try:
+                    response = s_three.get_object(Bucket=bucket_name, Key=key,
+                                                  **({"IfNoneMatch": cached_etag} if cached_etag else {}))
+                except ClientError as error:
+                    if error.response["Error"]["Code"] not in ("304", "NotModified"):
+                        raise
+                else:
+                    for stale_path in glob(self.get_path(key)):
+                        remove(stale_path)
+                    cached_etag = response["ETag"]
+                    with open(self.get_path(key, cached_etag), "wb") as cached_file:
+                        cached_file.write(response["Body"].read())
+
+            cached_path = self.get_path(key, cached_etag)
+            utime(cached_path)
+            return cached_path
+
+    def fetch_all(self, s_three: BaseClient, bucket_name: str, archive_etags: dict[str, str | None],
+                  pin_seconds: float = PATHS_TTL_SECONDS) -> list[str]:
+        """Returns the paths of up to date copies of the objects. They are kept on disk for
+        pin_seconds, while results cached with their paths may still read them, even if
+        the cache is full"""
+
+        with self.lock:
+            paths = [self.fetch(s_three, bucket_name, key, etag) for key, etag in archive_etags.items()]
+            pinned_until = time.monotonic() + pin_seconds
+            for cached_path in paths:
+                self.pinned[cached_path] = max(self.pinned.get(cached_path, 0), pinned_until)
+            self.evict(keep=set(paths))
+            return paths
+
+    def read(self, s_three: BaseClient, bucket_name: str, key: str, etag: str | None = None) -> pd.DataFrame:
+        """Returns an object as a data-frame, parsing it only when it has changed"""
+
+        with self.lock:
+            cached_path = self.fetch(s_three, bucket_name, key, etag)
+            if key not in self.frames or self.frames[key][0] != cached_path:
+                self.frames[key] = (cached_path, pd.read_parquet(cached_path))
+            self.evict(keep={cached_path})
+            return self.frames[key][1]
+
+    def evict(self, keep: set[str] = frozenset()) -> None:
+        """Removes the least recently read objects that are not pinned until the cache fits on disk"""
+
+        with self.lock:
+            now = time.monotonic()
+            self.pinned = {cached_path: pinned_until for cached_path, pinned_until
+                           in self.pinned.items() if pinned_until > now}
+            keep = set(keep) | set(self.pinned)
+
+            cached_files = sorted((entry for entry in scandir(self.folder) if entry.is_file()),
+                                  key=lambda entry: entry.stat().st_mtime)
+            total_bytes = sum(entry.stat().st_size for entry in cached_files)
+
+            for entry in cached_files:
+                if total_bytes <= self.max_bytes:
+                    break
+                if entry.path in keep:
+                    continue
+                total_bytes -= entry.stat().st_size
+                remove(entry.path)
+                self.frames = {key: cached for key, cached in self.frames.items()
+                               if cached[0] != entry.path}
+
+
+@st.cache_resource
+def get_archive_cache() -> ArchiveCache:
+    """Returns the archive cache shared by every rerun and session"""
+
+    return ArchiveCache()
+
 
 @st.cache_data(ttl="30s")
-def fetch_data():
-    """Streamlit Cache"""
+def fetch_manifest() -> pd.DataFrame | None:
+    """Streamlit Cache of the archive manifest"""
+
+    return read_manifest(get_bucket_connection(), environ.get("BUCKET_NAME"), get_archive_cache())
+
+
+@st.cache_data(ttl=PATHS_TTL_SECONDS)
+def fetch_archive_paths(start: pd.Timestamp | None = None, end: pd.Timestamp | None = None,
+                        plants: tuple[str] | None = None) -> tuple[str]:
+    """Streamlit Cache of the local paths of the archive objects that could hold readings
+    from start up to end for the given plants, downloading only those that have changed"""
 
     s3_client = get_bucket_connection()
     bucket = environ.get("BUCKET_NAME")
-    items_in_bucket = get_items_in_buckets(s3_client, bucket)
+    manifest = fetch_manifest()
+    if manifest is None:
+        archive_etags = {key: etag for key, etag in get_items_in_buckets(s3_client, bucket).items()
+                         if key.endswith(".parquet")}
+    else:
+        archive_etags = prune_archive_keys(manifest, start, end, plants)
 
-    if "full_s3_data.csv" in items_in_bucket:
-        download_new_version(s3_client, bucket)
     st.session_state['last_fetch_time'] = datetime.now()
-    data = pd.read_csv("combined.csv")
-    return data
+    return tuple(get_archive_cache().fetch_all(s3_client, bucket, archive_etags))
+
+
+@st.cache_data(ttl=PATHS_TTL_SECONDS)
+def fetch_rollup_paths(resolution: str, start: pd.Timestamp, end: pd.Timestamp,
+                       level: str = "plant") -> tuple[str]:
+    """Streamlit Cache of the local paths of the rollups at a resolution (hourly or daily)
+    and level (plant or continent) for the days from start up to end"""
+
+    s3_client = get_bucket_connection()
+    bucket = environ.get("BUCKET_NAME")
+    prefix = f"{ROLLUP_PREFIX}{resolution}/{level}/"
+    # keys are listed in order, so the listing starts at the first day and its ETags
+    # let unchanged rollups be read from the cache without a request each
+    rollup_keys = get_items_in_buckets(s3_client, bucket, prefix,
+                                       start_after=f"{prefix}date={start.strftime('%Y-%m-%d')}")
+    rollup_etags = {key: etag for key, etag in rollup_keys.items()
+                    if get_key_date(key) < end.strftime("%Y-%m-%d")}
+    return tuple(get_archive_cache().fetch_all(s3_client, bucket, rollup_etags))
+
+
+def fetch_existing_paths(fetch_paths, *args) -> tuple[str]:
+    """Returns the paths cached by fetch_paths, fetching them again if any of the
+    files has been removed from disk since they were cached"""
+
+    paths = fetch_paths(*args)
+    if not all(path.exists(cached_path) for cached_path in paths):
+        fetch_paths.clear()
+        paths = fetch_paths(*args)
+    return paths
 
 
-def remove_duplicate_plants(plant_data: pd.DataFrame) -> pd.DataFrame:
-    """Returns data-frame without duplicate plants - taken from transform.py"""
+def get_key_date(key: str) -> str:
+    """Returns the date partition an object is stored under"""
 
-    plant_data.drop_duplicates(subset="plant_name", keep="first", inplace=True)
-    return plant_data
+    return key.split("date=")[1].split("/")[0]
+
+
+def read_manifest(s_three: BaseClient, bucket_name: str, cache: ArchiveCache) -> pd.DataFrame | None:
+    """Returns the manifest of the archive objects, or None if the archive has no manifest"""
+
+    try:
+        return cache.read(s_three, bucket_name, MANIFEST_KEY)
+    except s_three.exceptions.NoSuchKey:
+        return None
+
+
+def prune_archive_keys(manifest: pd.DataFrame, start: pd.Timestamp | None = None,
+                       end: pd.Timestamp | None = None, plants: tuple[str] | None = None) -> dict[str, str | None]:
+    """Returns the keys and ETags of the archive objects that could hold readings
+    from start up to end for any of the given plants"""
+
+    keep = pd.Series(True, index=manifest.index)
+    if start is not None:
+        keep &= manifest["max_recording_taken"] >= start
+    if end is not None:
+        keep &= manifest["min_recording_taken"] < end
+    if plants is not None:
+        keep &= manifest["plant_names"].map(lambda names: not set(plants).isdisjoint(names))
+    etags = manifest["etag"] if "etag" in manifest else pd.Series(None, index=manifest.index)
+    return {key: etag if pd.notna(etag) else None
+            for key, etag in zip(manifest.loc[keep, "key"], etags[keep])}
+
+
+def get_archive_date_range(manifest: pd.DataFrame | None) -> tuple[date, date]:
+    """Returns the first and last recording dates in the archive"""
+
+    if manifest is None or manifest.empty:
+        return date.today(), date.today()
+    return (manifest["min_recording_taken"].min().date(),
+            manifest["max_recording_taken"].max().date())
 
 
 def dashboard_title() -> None:
@@ -41,21 +264,163 @@ def dashboard_title() -> None:
     st.markdown("_Data Visualisation of LMNH plants over time._")
 
 
-def get_items_in_buckets(s_three: BaseClient, bucket_name: str) -> list[tuple[str]]:
-    """Function that finds the list of all items in the bucket"""
+def get_items_in_buckets(s_three: BaseClient, bucket_name: str, prefix: str = ARCHIVE_PREFIX,
+                         start_after: str = "") -> dict[str, str]:
+    """Function that finds the keys and ETags of the items in the bucket under the prefix,
+    listing only the keys that sort after start_after"""
+
+    etags = {}
+    paginator = s_three.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, StartAfter=start_after):
+        etags.update((obj["Key"], obj["ETag"]) for obj in page.get("Contents", []))
+    return etags
+
 
-    if "Contents" in list(s_three.list_objects(Bucket=bucket_name).keys()):
-        return [obj["Key"] for obj in s_three.list_objects(Bucket=bucket_name)["Contents"]]
-    return []
+def query_archive(archive_paths: tuple[str], query: str, parameters: dict) -> pd.DataFrame:
+    """Runs a query over the archive objects in DuckDB, which reads only the columns
+    and row groups the query needs, and returns just its result"""
 
+    with duckdb.connect() as connection:
+        return connection.execute(query.format(readings=READINGS),
+                                  {"paths": list(archive_paths), **parameters}).df()
 
-def download_new_version(s_three: BaseClient, bucket_name: str) -> None:
-    """Downloading relevant data from the S3 bucket"""
 
-    filepath = "combined.csv"
-    if path.exists(filepath):
-        remove(filepath)
-    s_three.download_file(bucket_name, "full_s3_data.csv", filepath)
+@st.cache_data
+def get_plant_names(archive_paths: tuple[str], start: pd.Timestamp, end: pd.Timestamp) -> list[str]:
+    """Returns the names of the plants with readings from start up to end"""
+
+    return query_archive(archive_paths, """SELECT DISTINCT plant_name FROM {readings}
+        WHERE error = 'No Error' AND recording_taken >= $start AND recording_taken < $end
+        ORDER BY plant_name""", {"start": start, "end": end})["plant_name"].to_list()
+
+
+@st.cache_data
+def get_average_soil_moisture(archive_paths: tuple[str], start: pd.Timestamp, end: pd.Timestamp,
+                              plants: tuple[str]) -> pd.DataFrame:
+    """Returns the mean soil moisture of each of the plants from start up to end"""
+
+    return query_archive(archive_paths, """SELECT plant_name, avg(soil_moisture) AS soil_moisture
+        FROM {readings}
+        WHERE error = 'No Error' AND recording_taken >= $start AND recording_taken < $end
+            AND list_contains($plants, plant_name)
+        GROUP BY plant_name ORDER BY plant_name""",
+                         {"start": start, "end": end, "plants": list(plants)})
+
+
+@st.cache_data
+def get_plant_errors(archive_paths: tuple[str], start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+    """Returns the number of errors recorded for each plant from start up to end"""
+
+    return query_archive(archive_paths, """SELECT api_id, count(error) AS error FROM {readings}
+        WHERE error != 'No Error' AND recording_taken >= $start AND recording_taken < $end
+        GROUP BY api_id ORDER BY api_id""", {"start": start, "end": end})
+
+
+@st.cache_data
+def get_plants_by_continent(archive_paths: tuple[str], start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+    """Returns the number of plants from each continent"""
+
+    return query_archive(archive_paths, """SELECT continent, count(DISTINCT plant_name) AS plants
+        FROM {readings}
+        WHERE error = 'No Error' AND recording_taken >= $start AND recording_taken < $end
+        GROUP BY continent ORDER BY continent""", {"start": start, "end": end})
+
+
+@st.cache_data
+def get_temperature_statistics(archive_paths: tuple[str], start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+    """Returns the mean, median and standard deviation of the temperature readings
+    for each continent, computed together in one pass"""
+
+    return query_archive(archive_paths, """SELECT continent,
+            avg(temperature) AS mean, median(temperature) AS median,
+            stddev_samp(temperature) AS std
+        FROM {readings}
+        WHERE error = 'No Error' AND recording_taken >= $start AND recording_taken < $end
+        GROUP BY continent ORDER BY continent""", {"start": start, "end": end})
+
+
+@st.cache_data
+def get_rollup_temperature_statistics(rollup_paths: tuple[str], start: pd.Timestamp,
+                                      end: pd.Timestamp) -> pd.DataFrame:
+    """Returns the mean, median and standard deviation of the temperature readings for
+    each continent, merged from their daily rollups instead of read from every reading"""
+
+    rollups = query_archive(rollup_paths, """SELECT continent, temperature_count,
+            temperature_sum, temperature_sumsq, temperature_histogram
+        FROM {readings}
+        WHERE period_start >= $start AND period_start < $end""", {"start": start, "end": end})
+
+    merged = rollups.groupby("continent", as_index=False, sort=True, observed=True).agg(
+        temperature_count=("temperature_count", "sum"), temperature_sum=("temperature_sum", "sum"),
+        temperature_sumsq=("temperature_sumsq", "sum"),
+        temperature_histogram=("temperature_histogram", merge_sketches))
+    return summarise_rollup(merged, "temperature").rename(columns={
+        "temperature_mean": "mean", "temperature_median": "median", "temperature_std": "std"})
+
+
+@st.cache_data
+def rollups_cover_range(rollup_paths: tuple[str], start: pd.Timestamp, end: pd.Timestamp) -> bool:
+    """Returns whether the daily rollups have a period for every day from start up to end,
+    as days archived before the rollups were written, or whose rollup failed, have none"""
+
+    rollup_days = query_archive(rollup_paths, """SELECT DISTINCT period_start FROM {readings}
+        WHERE period_start >= $start AND period_start < $end""", {"start": start, "end": end})
+    return set(pd.date_range(start, end, freq="D", inclusive="left")) <= set(rollup_days["period_start"])
+
+
+@st.cache_data
+def get_moisture_readings(archive_paths: tuple[str], start: pd.Timestamp, end: pd.Timestamp,
+                          plants: tuple[str]) -> pd.DataFrame:
+    """
+    Returns the soil moisture readings of the plants from start up to end, downsampled
+    by splitting the time range into one bucket per pixel of the chart and keeping only
+    the lowest and highest reading in each, so peaks and troughs are still drawn
+    """
+
+    bucket_seconds = max(60, (end - start).total_seconds() / CHART_WIDTH_PIXELS)
+    return apply_reading_schema(query_archive(archive_paths, """WITH bucketed AS (
+            SELECT plant_name, recording_taken, soil_moisture,
+                floor(epoch(recording_taken) / $bucket_seconds) AS bucket
+            FROM {readings}
+            WHERE error = 'No Error' AND recording_taken >= $start AND recording_taken < $end
+                AND list_contains($plants, plant_name) AND soil_moisture IS NOT NULL)
+        SELECT DISTINCT plant_name, recording_taken, soil_moisture FROM (
+            SELECT plant_name, arg_min(recording_taken, soil_moisture) AS recording_taken,
+                min(soil_moisture) AS soil_moisture
+            FROM bucketed GROUP BY plant_name, bucket
+            UNION ALL
+            SELECT plant_name, arg_max(recording_taken, soil_moisture) AS recording_taken,
+                max(soil_moisture) AS soil_moisture
+            FROM bucketed GROUP BY plant_name, bucket)
+        ORDER BY plant_name, recording_taken""",
+                                              {"start": start, "end": end, "plants": list(plants),
+                                               "bucket_seconds": bucket_seconds}))
+
+
+@st.cache_data
+def get_moisture_rollups(rollup_paths: tuple[str], start: pd.Timestamp, end: pd.Timestamp,
+                         plants: tuple[str]) -> pd.DataFrame:
+    """Returns the mean, lowest and highest soil moisture of the plants in each
+    period of their rollups, merging the partial rollups written by each batch"""
+
+    return query_archive(rollup_paths, """SELECT plant_name, period_start AS recording_taken,
+            sum(soil_moisture_sum) / sum(soil_moisture_count) AS soil_moisture,
+            min(soil_moisture_min) AS soil_moisture_min, max(soil_moisture_max) AS soil_moisture_max
+        FROM {readings}
+        WHERE period_start >= $start AND period_start < $end AND list_contains($plants, plant_name)
+        GROUP BY plant_name, period_start
+        ORDER BY plant_name, period_start""", {"start": start, "end": end, "plants": list(plants)})
+
+
+def choose_resolution(start: pd.Timestamp, end: pd.Timestamp) -> str:
+    """Returns the finest resolution that keeps a time series to about one point per pixel,
+    using the readings themselves for up to a week"""
+
+    if end - start <= timedelta(days=7):
+        return "Readings"
+    if end - start <= timedelta(hours=CHART_WIDTH_PIXELS):
+        return "Hourly"
+    return "Daily"
 
 
 def get_bucket_connection() -> BaseClient:
@@ -74,27 +439,44 @@ def scatter_plot_title() -> None:
         "### Displays the mean soil moisture level for a selection of plants")
 
 
-def get_moisture_changes_by_time(plant_data: pd.DataFrame, plants_to_display: list[str]) -> None:
-    """Displays data for chosen plants for moisture changes by time"""
+def render_figure(fig: Figure) -> bytes:
+    """Renders a figure to a png once, so cached charts are not redrawn on every rerun"""
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
+
 
-    plant_data["recording_taken"] = pd.to_datetime(
-        plant_data["recording_taken"])
-    plant_data_lineplot = plant_data[plant_data["plant_name"].isin(
-        plants_to_display)][["plant_name", "recording_taken", "soil_moisture"]]
-    grouped_data = plant_data_lineplot.groupby("plant_name")
+@st.cache_data(max_entries=FIGURE_CACHE_SIZE)
+def plot_moisture_changes_by_time(paths: tuple[str], start: pd.Timestamp, end: pd.Timestamp,
+                                  plants: tuple[str], resolution: str) -> bytes:
+    """Returns the line chart of moisture changes by time for the chosen plants as a png.
+    The paths are of the archive objects for readings, or of the rollups at that resolution,
+    which are drawn as their mean with a band from the lowest to the highest reading"""
 
-    fig, axis = plt.subplots()
+    if resolution == "Readings":
+        moisture_readings = get_moisture_readings(paths, start, end, plants)
+    else:
+        moisture_readings = get_moisture_rollups(paths, start, end, plants)
 
-    for plant, data in grouped_data:
-        sns.lineplot(data=data, y="soil_moisture",
-                     x="recording_taken", label=plant, ax=axis)
+    fig = Figure()
+    axis = fig.subplots()
+
+    for plant, data in moisture_readings.groupby("plant_name"):
+        # every point is drawn as it is, without seaborn's bootstrapped confidence interval
+        sns.lineplot(data=data, y="soil_moisture", x="recording_taken", label=plant,
+                     estimator=None, errorbar=None, ax=axis)
+        if resolution != "Readings":
+            axis.fill_between(data["recording_taken"], data["soil_moisture_min"],
+                              data["soil_moisture_max"], alpha=0.2,
+                              color=axis.get_lines()[-1].get_color())
 
     axis.set_title("Soil Moisture Over Time")
     axis.set_xlabel("Recording Taken")
     axis.set_ylabel("Soil Moisture")
 
     axis.legend()
-    st.pyplot(fig)
+    return render_figure(fig)
 
 
 def soil_over_time_for_each_plant_title() -> None:
@@ -104,20 +486,17 @@ def soil_over_time_for_each_plant_title() -> None:
     st.markdown("Choose the plants for this graph to display")
 
 
-def display_average_soil_moisture(plant_data: pd.DataFrame, plants_to_display: list[str]) -> None:
-    """Displays average soil moisture for selected plants"""
+@st.cache_data(max_entries=FIGURE_CACHE_SIZE)
+def plot_average_soil_moisture(archive_paths: tuple[str], start: pd.Timestamp, end: pd.Timestamp,
+                               plants: tuple[str]) -> bytes:
+    """Returns the scatter plot of average soil moisture for the chosen plants as a png"""
 
-    plant_data = plant_data.copy()
-    plt.figure(figsize=(12, 8))
+    average_soil_moisture = get_average_soil_moisture(archive_paths, start, end, plants)
 
-    chosen_plants = plant_data[plant_data["plant_name"].isin(
-        plants_to_display)]
-    each_plant_soil_moisture = chosen_plants.groupby(["plant_name"])[
-        "soil_moisture"]
-    average_soil_moisture_for_each_plant = each_plant_soil_moisture.mean()
-    scatterplot_graph = sns.scatterplot(
-        data=average_soil_moisture_for_each_plant)
-    st.write(scatterplot_graph.figure)
+    fig = Figure(figsize=(12, 8))
+    sns.scatterplot(data=average_soil_moisture.set_index("plant_name")["soil_moisture"],
+                    ax=fig.subplots())
+    return render_figure(fig)
 
 
 def bar_chart_title() -> None:
@@ -127,18 +506,15 @@ def bar_chart_title() -> None:
     st.markdown("API ID refers to the API endpoint for each plant")
 
 
-def display_which_plants_get_errors(plant_data_errors: pd.DataFrame) -> None:
-    """Displays bar-plot of errors by plant id"""
+@st.cache_data(max_entries=FIGURE_CACHE_SIZE)
+def plot_which_plants_get_errors(archive_paths: tuple[str], start: pd.Timestamp, end: pd.Timestamp) -> bytes:
+    """Returns the bar-plot of errors by plant id as a png"""
 
-    plant_data_errors = plant_data_errors.copy()
-    st.write(plant_data_errors)
-    plt.figure()
+    error_count = get_plant_errors(archive_paths, start, end)
 
-    each_plant_error = plant_data_errors.groupby(["api_id"], as_index=True)
-    st.write(each_plant_error)
-    error_count = each_plant_error.count().reset_index()
-    barplot_graph = sns.barplot(data=error_count, x="api_id", y="error")
-    st.write(barplot_graph.figure)
+    fig = Figure()
+    sns.barplot(data=error_count, x="api_id", y="error", ax=fig.subplots())
+    return render_figure(fig)
 
 
 def pie_chart_title() -> None:
@@ -147,22 +523,18 @@ def pie_chart_title() -> None:
     st.markdown("## Plants by Country")
 
 
-def display_pie_chart_continents(plant_data: pd.DataFrame) -> None:
-    """Displays the pie-chart of continents for the plant origin
-    that are displayed in the museum"""
-
-    plant_data = plant_data.copy()
-
-    plt.figure()
+@st.cache_data(max_entries=FIGURE_CACHE_SIZE)
+def plot_pie_chart_continents(archive_paths: tuple[str], start: pd.Timestamp, end: pd.Timestamp) -> bytes:
+    """Returns the pie-chart of continents for the plant origin
+    that are displayed in the museum as a png"""
 
-    keys = plant_data["continent"].unique()
-
-    unique_plants = remove_duplicate_plants(plant_data)
-    plant_continents = unique_plants[["continent"]].value_counts()
+    plant_continents = get_plants_by_continent(archive_paths, start, end)
 
+    fig = Figure()
     sns.color_palette("tab20")
-    plot = plant_continents.plot(kind="pie", y=keys, autopct="%.2f%%")
-    st.write(plot.figure)
+    plant_continents.set_index("continent")["plants"].plot(
+        kind="pie", autopct="%.2f%%", ax=fig.subplots())
+    return render_figure(fig)
 
 
 def average_temp_title() -> None:
@@ -182,21 +554,6 @@ def mean_temp_title() -> None:
         "## Mean temperature by region")
 
 
-def display_temp_mean_bar_chart(plant_data: pd.DataFrame) -> None:
-    """Constructs a bar chart of mean temperature, grouped by region"""
-
-    plant_data = plant_data.copy()
-
-    plt.figure()
-
-    mean_temps = plant_data.groupby(["continent"], as_index=False)[
-        "temperature"].mean()
-
-    temp_bars = sns.barplot(mean_temps, x="continent", y="temperature")
-    plt.ylabel('mean temperature')
-    st.write(temp_bars.figure)
-
-
 def median_temp_title() -> None:
     """Creates title text for the median temperature bar graph below"""
 
@@ -204,21 +561,6 @@ def median_temp_title() -> None:
         "## Median temperature by region")
 
 
-def display_temp_median_bar_chart(plant_data: pd.DataFrame) -> None:
-    """Constructs a bar chart of mean temperature, grouped by region"""
-
-    plant_data = plant_data.copy()
-
-    plt.figure()
-
-    mean_temps = plant_data.groupby(["continent"], as_index=False)[
-        "temperature"].median()
-
-    temp_bars = sns.barplot(mean_temps, x="continent", y="temperature")
-    plt.ylabel('median temperature')
-    st.write(temp_bars.figure)
-
-
 def std_temp_title() -> None:
     """Creates title text for the standard deviation temperature bar graph below"""
 
@@ -226,57 +568,89 @@ def std_temp_title() -> None:
         "## Standard Deviation temperature by region")
 
 
-def display_temp_std_bar_chart(plant_data: pd.DataFrame) -> None:
-    """Constructs a bar chart of standard deviation temperature, grouped by region"""
-
-    plant_data = plant_data.copy()
+@st.cache_data(max_entries=FIGURE_CACHE_SIZE)
+def plot_temp_bar_chart(archive_paths: tuple[str], rollup_paths: tuple[str], start: pd.Timestamp,
+                        end: pd.Timestamp, statistic: str, label: str) -> bytes:
+    """Returns a bar chart of one temperature statistic (mean, median or std),
+    grouped by region, as a png. The statistics are read from the daily continent
+    rollups when they cover every day, and otherwise from the archived readings"""
 
-    plt.figure()
+    if rollup_paths and rollups_cover_range(rollup_paths, start, end):
+        temperature_statistics = get_rollup_temperature_statistics(rollup_paths, start, end)
+    else:
+        temperature_statistics = get_temperature_statistics(archive_paths, start, end)
 
-    mean_temps = plant_data.groupby(["continent"], as_index=False)[
-        "temperature"].std()
-
-    temp_bars = sns.barplot(mean_temps, x="continent", y="temperature")
-    plt.ylabel('temperature standard deviation')
-    st.write(temp_bars.figure)
+    fig = Figure()
+    axis = fig.subplots()
+    sns.barplot(temperature_statistics, x="continent", y=statistic, ax=axis)
+    axis.set_ylabel(label)
+    return render_figure(fig)
 
 
 if __name__ == "__main__":
 
     load_dotenv()
     dashboard_title()
-    plant_df = fetch_data()
-    plant_error_df = plant_df[plant_df["error"] != "No Error"]
 
-    plant_df = plant_df[plant_df["error"] == "No Error"]
+    first_day, last_day = get_archive_date_range(fetch_manifest())
+    date_range = st.sidebar.date_input("Recording dates", value=(first_day, last_day),
+                                       min_value=first_day, max_value=last_day)
+    start_day, end_day = (date_range[0], date_range[-1]) if date_range else (first_day, last_day)
+    start, end = pd.Timestamp(start_day), pd.Timestamp(end_day + timedelta(days=1))
+
+    archive_paths = fetch_existing_paths(fetch_archive_paths, start, end)
+    if not archive_paths:
+        st.info("No readings have been archived for these dates.")
+        st.stop()
 
-    plants_to_display = st.sidebar.multiselect("Select Plant(s) for the graphs",
-                                               options=plant_df["plant_name"].unique(), default=plant_df["plant_name"].unique()[1])
+    plant_names = get_plant_names(archive_paths, start, end)
+    plants_to_display = tuple(st.sidebar.multiselect("Select Plant(s) for the graphs",
+                                                     options=plant_names, default=plant_names[1:2]))
+    # The per-plant charts only read the archive objects holding the chosen plants
+    plant_paths = fetch_existing_paths(fetch_archive_paths, start, end, plants_to_display)
 
     scatter_plot_title()
-    display_average_soil_moisture(plant_df, plants_to_display)
+    if plant_paths:
+        st.image(plot_average_soil_moisture(plant_paths, start, end, plants_to_display))
 
     # Breaks when we have no errors
     # bar_chart_title()
-    # display_which_plants_get_errors(plant_error_df)
+    # st.image(plot_which_plants_get_errors(archive_paths, start, end))
 
     # Title for averages section
     average_temp_title()
+    continent_paths = fetch_existing_paths(fetch_rollup_paths, "daily", start, end, "continent")
     r, l = st.columns(2)
     with r:
         pie_chart_title()
-        display_pie_chart_continents(plant_df)
+        st.image(plot_pie_chart_continents(archive_paths, start, end))
 
         mean_temp_title()
-        display_temp_mean_bar_chart(plant_df)
+        st.image(plot_temp_bar_chart(archive_paths, continent_paths, start, end,
+                                     "mean", "mean temperature"))
 
     with l:
         median_temp_title()
-        display_temp_median_bar_chart(plant_df)
+        st.image(plot_temp_bar_chart(archive_paths, continent_paths, start, end,
+                                     "median", "median temperature"))
 
         std_temp_title()
-        display_temp_std_bar_chart(plant_df)
+        st.image(plot_temp_bar_chart(archive_paths, continent_paths, start, end,
+                                     "std", "temperature standard deviation"))
 
     # Soil moisture changes over time graph
     soil_over_time_for_each_plant_title()
-    get_moisture_changes_by_time(plant_df, plants_to_display)
+    resolution = st.selectbox("Resolution", RESOLUTIONS)
+    if resolution == "Auto":
+        resolution = choose_resolution(start, end)
+
+    moisture_paths = plant_paths
+    if resolution != "Readings":
+        moisture_paths = fetch_existing_paths(fetch_rollup_paths, resolution.lower(), start, end)
+        if not moisture_paths:
+            resolution = "Readings"
+            moisture_paths = plant_paths
+
+    if moisture_paths:
+        st.image(plot_moisture_changes_by_time(moisture_paths, start, end,
+                                               plants_to_display, resolution))
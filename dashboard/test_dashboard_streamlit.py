@@ -0,0 +1,278 @@
+"""Tests for the archive cache of the dashboard-streamlit.py file"""
+
+from importlib.util import module_from_spec, spec_from_file_location
+from os import path
+
+from boto3 import client
+from moto import mock_aws
+import numpy as np
+import pandas as pd
+import pytest
+
+
+spec = spec_from_file_location("dashboard_streamlit",
+                               path.join(path.dirname(__file__), "dashboard-streamlit.py"))
+dashboard_streamlit = module_from_spec(spec)
+spec.loader.exec_module(dashboard_streamlit)
+ArchiveCache = dashboard_streamlit.ArchiveCache
+get_rollup_temperature_statistics = dashboard_streamlit.get_rollup_temperature_statistics
+rollups_cover_range = dashboard_streamlit.rollups_cover_range
+get_items_in_buckets = dashboard_streamlit.get_items_in_buckets
+get_average_soil_moisture = dashboard_streamlit.get_average_soil_moisture
+get_plants_by_continent = dashboard_streamlit.get_plants_by_continent
+get_temperature_statistics = dashboard_streamlit.get_temperature_statistics
+get_plant_names = dashboard_streamlit.get_plant_names
+prune_archive_keys = dashboard_streamlit.prune_archive_keys
+query_archive = dashboard_streamlit.query_archive
+get_moisture_readings = dashboard_streamlit.get_moisture_readings
+get_moisture_rollups = dashboard_streamlit.get_moisture_rollups
+choose_resolution = dashboard_streamlit.choose_resolution
+CHART_WIDTH_PIXELS = dashboard_streamlit.CHART_WIDTH_PIXELS
+
+START, END = pd.Timestamp("2023-09-01"), pd.Timestamp("2023-09-03")
+
+
+class FakeBody:
+    """Fake body of an S3 object"""
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def read(self) -> bytes:
+        return self.content
+
+
+class FakeS3:
+    """Fake S3 client serving objects of a fixed size"""
+
+    def __init__(self, object_bytes: int):
+        self.object_bytes = object_bytes
+        self.requested = []
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self.requested.append(Key)
+        return {"ETag": '"etag"', "Body": FakeBody(b"x" * self.object_bytes)}
+
+
+@pytest.fixture
+def cache(tmp_path) -> ArchiveCache:
+    """Archive cache with room for three objects of 10 bytes"""
+
+    return ArchiveCache(folder=str(tmp_path), max_bytes=30)
+
+
+def test_eviction_between_reads_keeps_pinned_paths(cache):
+    """Verifies fetching rollups that fill the cache does not remove the archive objects
+    whose paths are still cached for the next rerun"""
+
+    s_three = FakeS3(object_bytes=10)
+    archive_paths = cache.fetch_all(s_three, "bucket", {"readings/1": None, "readings/2": None})
+    cache.fetch_all(s_three, "bucket", {"rollups/1": None, "rollups/2": None})
+
+    assert all(path.exists(archive_path) for archive_path in archive_paths)
+    assert cache.fetch_all(s_three, "bucket", {"readings/1": '"etag"'}) == archive_paths[:1]
+    assert s_three.requested.count("readings/1") == 1
+
+
+def test_eviction_removes_paths_no_longer_pinned(cache):
+    """Verifies objects are evicted once the results holding their paths have expired"""
+
+    s_three = FakeS3(object_bytes=10)
+    cache.max_bytes = 20
+    archive_paths = cache.fetch_all(s_three, "bucket", {"readings/1": None, "readings/2": None},
+                                    pin_seconds=0)
+    cache.fetch_all(s_three, "bucket", {"rollups/1": None, "rollups/2": None}, pin_seconds=0)
+
+    assert not any(path.exists(archive_path) for archive_path in archive_paths)
+    assert cache.fetch_all(s_three, "bucket", {"readings/1": '"etag"'}) == archive_paths[:1]
+    assert s_three.requested.count("readings/1") == 2
+
+
+def get_temperature_sketch(*readings: float) -> np.ndarray:
+    """Returns the temperature histogram sketch of the readings, as rollups.py builds it"""
+
+    sketch = np.zeros(500, dtype=np.int64)
+    for reading in readings:
+        sketch[int((reading + 10) / 0.1)] += 1
+    return sketch
+
+
+def test_rollup_temperature_statistics_merge_partial_rollups(tmp_path):
+    """Verifies the continent statistics are merged from the partial daily rollups
+    written by each batch, leaving out days outside the range"""
+
+    rollups = pd.DataFrame({
+        "continent": ["Europe", "Europe", "Europe"],
+        "period_start": pd.to_datetime(["2023-09-01", "2023-09-01", "2023-09-03"]),
+        "temperature_count": [2, 1, 1], "temperature_sum": [30.0, 30.0, 100.0],
+        "temperature_sumsq": [500.0, 900.0, 10000.0],
+        "temperature_histogram": [get_temperature_sketch(10, 20), get_temperature_sketch(30),
+                                  get_temperature_sketch(35)]})
+    rollup_path = str(tmp_path / "rollup.parquet")
+    rollups.to_parquet(rollup_path, index=False)
+
+    statistics = get_rollup_temperature_statistics(
+        (rollup_path,), pd.Timestamp("2023-09-01"), pd.Timestamp("2023-09-02"))
+
+    assert statistics["continent"].to_list() == ["Europe"]
+    assert statistics["mean"][0] == 20
+    assert statistics["std"][0] == 10
+    assert abs(statistics["median"][0] - 20) < 0.1
+
+
+def test_rollups_cover_range(tmp_path):
+    """Verifies the rollups only cover a range when every day in it has a rollup"""
+
+    rollups = pd.DataFrame({"continent": ["Europe", "Asia", "Europe"],
+                            "period_start": pd.to_datetime(["2023-09-01", "2023-09-01",
+                                                            "2023-09-03"])})
+    rollup_path = str(tmp_path / "rollup.parquet")
+    rollups.to_parquet(rollup_path, index=False)
+
+    assert rollups_cover_range((rollup_path,), pd.Timestamp("2023-09-01"),
+                               pd.Timestamp("2023-09-02"))
+    assert not rollups_cover_range((rollup_path,), pd.Timestamp("2023-09-01"),
+                                   pd.Timestamp("2023-09-04"))
+
+
+def test_get_items_in_buckets_lists_etags_after_start():
+    """Verifies rollups are listed from the first day on, with the ETags that let the
+    cache skip a request for each unchanged rollup"""
+
+    with mock_aws():
+        s_three = client("s3", region_name="eu-west-2")
+        s_three.create_bucket(Bucket="bucket", CreateBucketConfiguration={
+                              "LocationConstraint": "eu-west-2"})
+        for day in ["2023-08-31", "2023-09-01", "2023-09-02"]:
+            s_three.put_object(Bucket="bucket", Body=day.encode(),
+                               Key=f"rollups/daily/plant/date={day}/part-abc.parquet")
+
+        etags = get_items_in_buckets(s_three, "bucket", "rollups/daily/plant/",
+                                     start_after="rollups/daily/plant/date=2023-09-01")
+
+        assert list(etags) == ["rollups/daily/plant/date=2023-09-01/part-abc.parquet",
+                               "rollups/daily/plant/date=2023-09-02/part-abc.parquet"]
+        assert all(etag == s_three.head_object(Bucket="bucket", Key=key)["ETag"]
+                   for key, etag in etags.items())
+
+
+def test_get_plant_names(archive_paths):
+    """Verifies the plants are named once each, across both archive objects"""
+
+    assert get_plant_names(archive_paths, START, END) == ["Plant A", "Plant B", "Plant C"]
+
+
+def test_get_average_soil_moisture(archive_paths):
+    """Verifies the mean soil moisture leaves out errors, readings after the range
+    and plants that are not chosen"""
+
+    average_soil_moisture = get_average_soil_moisture(archive_paths, START, END,
+                                                      ("Plant A", "Plant B"))
+
+    assert average_soil_moisture.to_dict("records") == [
+        {"plant_name": "Plant A", "soil_moisture": 25.0},
+        {"plant_name": "Plant B", "soil_moisture": 40.0}]
+
+
+def test_get_plants_by_continent(archive_paths):
+    """Verifies each plant is counted once for its continent"""
+
+    assert get_plants_by_continent(archive_paths, START, END).to_dict("records") == [
+        {"continent": "Asia", "plants": 1}, {"continent": "Europe", "plants": 2}]
+
+
+def test_get_temperature_statistics(archive_paths):
+    """Verifies the mean, median and sample standard deviation of each continent"""
+
+    statistics = get_temperature_statistics(archive_paths, START, END)
+
+    assert statistics["continent"].to_list() == ["Asia", "Europe"]
+    assert statistics["mean"].to_list() == [20.0, 14.0]
+    assert statistics["median"].to_list() == [20.0, 14.0]
+    assert np.isnan(statistics["std"][0])
+    assert statistics["std"][1] == 4.0
+
+
+def test_query_archive_reads_objects_missing_a_column(archive_paths):
+    """Verifies objects written before result_id was added are read with it missing"""
+
+    result_ids = query_archive(archive_paths, """SELECT result_id FROM {readings}
+        ORDER BY recording_taken""", {})
+
+    assert result_ids["result_id"].isna().to_list() == [True, True, True, False, False, False]
+    assert result_ids["result_id"].dropna().to_list() == [1, 2, 3]
+
+
+def test_prune_archive_keys_by_date(manifest):
+    """Verifies only the objects holding readings from start up to end are kept,
+    with their ETags"""
+
+    assert prune_archive_keys(manifest, pd.Timestamp("2023-09-02 11:30"), END) == {
+        "readings/date=2023-09-02/part-c.parquet": None}
+    assert prune_archive_keys(manifest, START, pd.Timestamp("2023-09-02")) == {
+        "readings/date=2023-09-01/part-a.parquet": '"a"'}
+
+
+def test_prune_archive_keys_by_plant(manifest):
+    """Verifies only the objects holding readings of the chosen plants are kept"""
+
+    assert list(prune_archive_keys(manifest, plants=("Plant C",))) == [
+        "readings/date=2023-09-02/part-b.parquet"]
+    assert list(prune_archive_keys(manifest, START, END, ("Plant B",))) == [
+        "readings/date=2023-09-01/part-a.parquet", "readings/date=2023-09-02/part-c.parquet"]
+    assert prune_archive_keys(manifest, plants=()) == {}
+
+
+def test_get_moisture_readings_keeps_extremes_within_budget(tmp_path):
+    """Verifies a day of readings every 10 seconds is reduced to at most the lowest and
+    highest reading for each pixel, keeping both extremes of every bucket"""
+
+    recording_taken = pd.date_range("2023-09-01", "2023-09-02", freq="10s", inclusive="left")
+    readings = pd.DataFrame({
+        "plant_name": "Plant A", "error": "No Error", "recording_taken": recording_taken,
+        "soil_moisture": np.random.default_rng(0).uniform(0, 100, len(recording_taken))})
+    readings_path = str(tmp_path / "readings.parquet")
+    readings.to_parquet(readings_path, index=False)
+
+    moisture = get_moisture_readings((readings_path,), START, START + pd.Timedelta(days=1),
+                                     ("Plant A",))
+
+    assert len(moisture) <= 2 * (CHART_WIDTH_PIXELS + 1)
+    bucket_seconds = 24 * 60 * 60 / CHART_WIDTH_PIXELS
+    buckets = (recording_taken.astype("int64") // 10 ** 9 // bucket_seconds).to_numpy()
+    kept = set(zip(moisture["recording_taken"], moisture["soil_moisture"]))
+    for _, bucket in readings.groupby(buckets):
+        for extreme in (bucket["soil_moisture"].idxmin(), bucket["soil_moisture"].idxmax()):
+            assert (bucket["recording_taken"][extreme],
+                    np.float32(bucket["soil_moisture"][extreme])) in kept
+
+
+def test_get_moisture_rollups_merges_partial_rollups(tmp_path):
+    """Verifies the partial rollups of a period are merged into its mean, lowest and
+    highest soil moisture, for the chosen plants only"""
+
+    rollups = pd.DataFrame({
+        "plant_name": ["Plant A", "Plant A", "Plant A", "Plant B"],
+        "period_start": pd.to_datetime(["2023-09-01 10:00", "2023-09-01 10:00",
+                                        "2023-09-01 11:00", "2023-09-01 10:00"]),
+        "soil_moisture_count": [2, 1, 1, 1], "soil_moisture_sum": [50.0, 40.0, 30.0, 10.0],
+        "soil_moisture_min": [20.0, 40.0, 30.0, 10.0],
+        "soil_moisture_max": [30.0, 40.0, 30.0, 10.0]})
+    rollup_path = str(tmp_path / "rollup.parquet")
+    rollups.to_parquet(rollup_path, index=False)
+
+    moisture = get_moisture_rollups((rollup_path,), START, END, ("Plant A",))
+
+    assert moisture.to_dict("records") == [
+        {"plant_name": "Plant A", "recording_taken": pd.Timestamp("2023-09-01 10:00"),
+         "soil_moisture": 30.0, "soil_moisture_min": 20.0, "soil_moisture_max": 40.0},
+        {"plant_name": "Plant A", "recording_taken": pd.Timestamp("2023-09-01 11:00"),
+         "soil_moisture": 30.0, "soil_moisture_min": 30.0, "soil_moisture_max": 30.0}]
+
+
+@pytest.mark.parametrize("days, resolution", [(1, "Readings"), (7, "Readings"), (8, "Hourly"),
+                                              (26, "Hourly"), (27, "Daily"), (365, "Daily")])
+def test_choose_resolution(days, resolution):
+    """Verifies each span is drawn at the finest resolution within about one point per pixel"""
+
+    assert choose_resolution(START, START + pd.Timedelta(days=days)) == resolution
@@ -0,0 +1,38 @@
+"""Conftest file with fixtures for the long term load tests"""
+
+from boto3 import client
+from moto import mock_aws
+from pytest import fixture
+import pandas as pd
+
+from load_long_term import COLUMNS
+
+
+@fixture
+def fake_s3():
+    """Returns an S3 client for a mocked bucket named test-bucket"""
+
+    with mock_aws():
+        s3_client = client("s3", region_name="eu-west-2",
+                           aws_access_key_id="testing", aws_secret_access_key="testing")
+        s3_client.create_bucket(Bucket="test-bucket", CreateBucketConfiguration={
+                                "LocationConstraint": "eu-west-2"})
+        yield s3_client
+
+
+@fixture
+def archive_data() -> pd.DataFrame:
+    """Returns readings retrieved from the short term database over two days"""
+
+    rows = []
+    for api_id, recording_taken in [(1, "2023-09-01 23:59:00"), (2, "2023-09-02 00:01:00"),
+                                    (1, "2023-09-02 00:02:00")]:
+        rows.append({"plant_name": f"Plant {api_id}", "scientific_name": "Plantae",
+                     "api_id": api_id, "cycle": "Perennial",
+                     "last_watered": "2023-09-01 13:24:30", "soil_moisture": 30.5,
+                     "temperature": 12.4, "sunlight": "full sun",
+                     "recording_taken": recording_taken, "longitude": 22.4711,
+                     "latitude": 88.1453, "country": "IN", "continent": "Asia",
+                     "botanist_name": "Fake Name", "email": "fake.name@lnhm.co.uk",
+                     "phone": "001-481-273-3691", "error": "No Error"})
+    return pd.DataFrame(rows, columns=COLUMNS)
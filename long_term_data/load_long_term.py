@@ -1,21 +1,78 @@
-"""Selects and deletes data older than 24hrs from the short term database
-and add this data to the longer term database"""
+"""Selects and deletes the data recorded before the start of the day 24hrs ago from the
+short term database, which keeps between 24 and 48hrs of data, and adds it to the longer
+term database"""
+
+from __future__ import annotations
 
-import os
-from os import environ
 from datetime import datetime, timedelta
+from io import BytesIO
+from os import environ
+from typing import Iterator, TYPE_CHECKING
+from uuid import uuid4
 
-from boto3 import client
-from botocore.client import BaseClient
 import pandas as pd
 from dotenv import load_dotenv
 import psycopg2
 import psycopg2.extras
 import psycopg2.extensions
+from psycopg2 import sql
+
+from reading_schema import apply_reading_schema
+from rollups import write_rollups
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
 
 COLUMNS = ['plant_name', 'scientific_name', 'api_id', 'cycle', 'last_watered', 'soil_moisture',
            'temperature', 'sunlight', 'recording_taken', 'longitude', 'latitude', 'country',
-           'continent', 'botanist_name', 'email', 'phone', 'error']
+           'continent', 'botanist_name', 'email', 'phone', 'error', 'result_id']
+
+ARCHIVE_PREFIX = "readings"
+MANIFEST_KEY = "manifest/readings.parquet"
+MANIFEST_COLUMNS = ["key", "rows", "min_recording_taken", "max_recording_taken",
+                    "api_ids", "plant_names", "bytes", "etag"]
+EXPORT_CHUNK_SIZE = int(environ.get("EXPORT_CHUNK_SIZE", 50000))
+PARTITION_PREFIX = "sensor_result_"
+# The whole archive was kept in this one csv object before readings were archived as parquet
+LEGACY_CSV_KEY = "full_s3_data.csv"
+LEGACY_PART_PREFIX = "legacy-csv"
+DEFAULT_PARTITION = "sensor_result_default"
+
+# Reads the next batch of readings after the watermark, in watermark order
+QUERY_FOR_DATA = """SELECT
+    p.plant_name as plant_name,
+    p.scientific_name as scientific_name,
+    p.api_id as api_id,
+    p.cycle as cycle,
+    sr.last_watered as last_watered,
+    sr.soil_moisture as soil_moisture,
+    sr.temperature as temperature,
+    p.sunlight as sunlight,
+    sr.recording_taken as recording_taken,
+    o.longitude as longitude,
+    o.latitude as latitude,
+    o.country as country,
+    o.continent as continent,
+    b.name AS botanist_name,
+    b.email as email,
+    b.phone as phone,
+    av.type_of_availability AS error,
+    sr.result_id as result_id
+    FROM sensor_result sr
+    LEFT JOIN plant p ON sr.plant_id = p.plant_id
+    LEFT JOIN origin o ON p.origin_id = o.origin_id
+    LEFT JOIN botanist b ON sr.botanist_id = b.botanist_id
+    LEFT JOIN plant_availability av ON sr.availability_id = av.availability_id
+    WHERE (sr.recording_taken, sr.result_id) > (%s, %s) AND sr.recording_taken < %s
+    ORDER BY sr.recording_taken, sr.result_id
+    LIMIT %s"""
+
+# Daily partitions are named sensor_result_YYYYMMDD by create_sensor_result_partitions
+PARTITIONS_QUERY = """SELECT child.relname AS partition_name
+    FROM pg_inherits
+    JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+    JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+    WHERE parent.relname = 'sensor_result' AND child.relname ~ '^sensor_result_[0-9]{8}$'"""
 
 
 def get_short_term_db_connection(config: dict) -> psycopg2.extensions.connection | None:
@@ -35,95 +92,249 @@ def get_short_term_db_connection(config: dict) -> psycopg2.extensions.connection
         raise psycopg2.DatabaseError("Error connecting to database.")
 
 
-def retrieve_data_older_than_24_hours(connection: psycopg2.extensions.connection) -> None:
-    """Retrieves data older than 24hrs from the short term RDS database and stores as a CSV file
-    and deletes data older than 24hrs from the RDS."""
-
-    twenty_four_hours_ago = datetime.now() - timedelta(hours=24)
-    formatted_time = twenty_four_hours_ago.strftime("%Y-%m-%d %H:%M:%S")
-
-    query_for_data = """SELECT
-        p.plant_name as plant_name,
-        p.scientific_name as scientific_name,
-        p.api_id as api_id,
-        p.cycle as cycle,
-        sr.last_watered as last_watered,
-        sr.soil_moisture as soil_moisture,
-        sr.temperature as temperature,
-        p.sunlight as sunlight,
-        sr.recording_taken as recording_taken,
-        o.longitude as longitude,
-        o.latitude as latitude,
-        o.country as country,
-        o.continent as continent,
-        b.name AS botanist_name,
-        b.email as email,
-        b.phone as phone,
-        av.type_of_availability AS error
-        FROM sensor_result sr
-        LEFT JOIN plant p ON sr.plant_id = p.plant_id
-        LEFT JOIN origin o ON p.origin_id = o.origin_id
-        LEFT JOIN botanist b ON sr.botanist_id = b.botanist_id
-        LEFT JOIN plant_availability av ON sr.availability_id = av.availability_id
-        WHERE sr.recording_taken < %s"""
-    delete_query = "DELETE FROM sensor_result sr WHERE sr.recording_taken < %s"
+def get_expired_partitions(connection: psycopg2.extensions.connection, cutoff: datetime) -> list[str]:
+    """Returns the names of the daily sensor_result partitions that end before the cutoff"""
 
     with connection.cursor() as cur:
-        cur.execute(query_for_data, (formatted_time,))
-        result = cur.fetchall()
-        cur.execute(delete_query, (formatted_time,))
-        connection.commit()
+        cur.execute(PARTITIONS_QUERY)
+        partitions = [row["partition_name"] for row in cur.fetchall()]
+
+    expired = []
+    for partition in partitions:
+        # only daily partitions are named after their day, never the default partition
+        try:
+            partition_day = datetime.strptime(
+                partition.removeprefix(PARTITION_PREFIX), "%Y%m%d")
+        except ValueError:
+            continue
+        if partition_day + timedelta(days=1) <= cutoff:
+            expired.append(partition)
+    return sorted(expired)
+
+
+def get_archive_key(day: str, part_name: str) -> str:
+    """Returns the key of an archive object in the date partition of the given day"""
+
+    return f"{ARCHIVE_PREFIX}/date={day}/part-{part_name}.parquet"
+
 
-    data = pd.DataFrame(result, columns=COLUMNS)
-    data.to_csv("long_term_data/24_hour_data.csv", index=False)
+def get_manifest_entry(key: str, data: pd.DataFrame, size: int, etag: str) -> dict:
+    """Returns the manifest entry describing the readings in an archive object"""
 
+    return {"key": key, "rows": len(data),
+            "min_recording_taken": data["recording_taken"].min(),
+            "max_recording_taken": data["recording_taken"].max(),
+            "api_ids": sorted(data["api_id"].dropna().astype(int).unique().tolist()),
+            "plant_names": sorted(data["plant_name"].dropna().unique().tolist()),
+            "bytes": size, "etag": etag}
 
-def create_download_folders() -> None:
-    """Creates a folder with the name 'long_term_data' if it doesn't already exist."""
 
-    folder_exists = os.path.exists("long_term_data")
+def write_archive_partitions(current_s3: BaseClient, bucket: str, data: pd.DataFrame,
+                             part_name: str | None = None) -> list[dict]:
+    """Writes new readings to the archive as immutable parquet objects, one for each recording date,
+    so a run only ever uploads its own data. Returns the manifest entries of the objects written"""
 
-    if not folder_exists:
-        os.makedirs("long_term_data")
+    if data.empty:
+        return []
 
+    data = data.copy()
+    data["recording_taken"] = pd.to_datetime(data["recording_taken"])
+    data["last_watered"] = pd.to_datetime(data["last_watered"])
+    if part_name is None:
+        part_name = f"{datetime.now():%Y%m%dT%H%M%S}-{uuid4().hex[:8]}"
+    entries = []
 
-def download_data_from_s3(current_s3: BaseClient) -> None:
-    """Downloads the csv file containing the older than 24hrs data. If no such file is found,
-    an empty file is created"""
+    for day, day_data in data.groupby(data["recording_taken"].dt.strftime("%Y-%m-%d")):
+        key = get_archive_key(day, part_name)
+        buffer = BytesIO()
+        day_data.to_parquet(buffer, index=False)
+        response = current_s3.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+        entries.append(get_manifest_entry(key, day_data, buffer.tell(), response["ETag"]))
+    return entries
 
-    download_path = os.path.join(
-        "long_term_data", os.path.basename("full_s3_data.csv"))
+
+def read_manifest(current_s3: BaseClient, bucket: str) -> pd.DataFrame:
+    """Returns the manifest of the archive objects, empty if none has been written yet"""
 
     try:
-        current_s3.download_file(environ.get(
-            "BUCKET_NAME"), "full_s3_data.csv", download_path)
+        body = current_s3.get_object(Bucket=bucket, Key=MANIFEST_KEY)["Body"].read()
+    except current_s3.exceptions.NoSuchKey:
+        return pd.DataFrame(columns=MANIFEST_COLUMNS)
+    return pd.read_parquet(BytesIO(body))
+
+
+def write_manifest(current_s3: BaseClient, bucket: str, manifest: pd.DataFrame) -> None:
+    """Replaces the manifest of the archive objects"""
+
+    buffer = BytesIO()
+    manifest.to_parquet(buffer, index=False)
+    current_s3.put_object(Bucket=bucket, Key=MANIFEST_KEY, Body=buffer.getvalue())
 
-    except:
-        df = pd.DataFrame(columns=COLUMNS)
-        df.to_csv("long_term_data/full_s3_data.csv", index=False)
 
+def update_manifest(current_s3: BaseClient, bucket: str, entries: list[dict]) -> pd.DataFrame:
+    """Adds entries to the manifest, replacing any for the same keys so a retried
+    batch is only listed once. Returns the updated manifest"""
 
-def combine_csv_files() -> None:
-    """Combines the new 24 hour old data with the existing file containing all old data"""
+    manifest = read_manifest(current_s3, bucket)
+    if entries:
+        manifest = pd.concat([manifest[~manifest["key"].isin([entry["key"] for entry in entries])],
+                              pd.DataFrame(entries, columns=MANIFEST_COLUMNS)], ignore_index=True)
+        write_manifest(current_s3, bucket, manifest)
+    return manifest
 
-    main_csv_dateframe = pd.read_csv("long_term_data/full_s3_data.csv")
-    new_csv_dateframe = pd.read_csv("long_term_data/24_hour_data.csv")
 
-    combined_df = pd.concat(
-        [main_csv_dateframe, new_csv_dateframe], ignore_index=True)
+def rebuild_manifest(current_s3: BaseClient, bucket: str) -> pd.DataFrame:
+    """Rebuilds the manifest by reading every archive object.
+    Only needed once for archives written before the manifest existed"""
 
-    os.remove("long_term_data/full_s3_data.csv")
-    os.remove("long_term_data/24_hour_data.csv")
+    entries = []
+    paginator = current_s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{ARCHIVE_PREFIX}/"):
+        for item in page.get("Contents", []):
+            body = current_s3.get_object(Bucket=bucket, Key=item["Key"])["Body"].read()
+            data = pd.read_parquet(BytesIO(body), columns=[
+                "api_id", "plant_name", "recording_taken"])
+            entries.append(get_manifest_entry(item["Key"], data, item["Size"], item["ETag"]))
 
-    combined_df.to_csv('long_term_data/full_s3_data.csv', index=False)
+    manifest = pd.DataFrame(entries, columns=MANIFEST_COLUMNS)
+    write_manifest(current_s3, bucket, manifest)
+    return manifest
 
 
-def upload_files_to_s3(current_s3: BaseClient) -> None:
-    """Uploads the new combined csv file with all data older than 24hrs,
-    replacing file that exists in the s3 bucket."""
+def convert_legacy_csv(current_s3: BaseClient, bucket: str,
+                       chunk_size: int = EXPORT_CHUNK_SIZE) -> list[str]:
+    """
+    Converts the readings archived in the legacy csv object into date partitioned
+    parquet objects and their rollups, a chunk at a time, and lists them in the manifest.
+    Runs once: it is skipped when there is no csv or the manifest already lists its parts,
+    and a retried conversion overwrites its own objects. Returns the keys written
+    """
+
+    manifest = read_manifest(current_s3, bucket)
+    if manifest["key"].str.contains(f"/part-{LEGACY_PART_PREFIX}-", regex=False).any():
+        return []
+    try:
+        body = current_s3.get_object(Bucket=bucket, Key=LEGACY_CSV_KEY)["Body"]
+    except current_s3.exceptions.NoSuchKey:
+        return []
+
+    keys, entries = [], []
+    for chunk_number, chunk in enumerate(pd.read_csv(body, chunksize=chunk_size)):
+        readings = apply_reading_schema(chunk.reindex(columns=COLUMNS).assign(
+            recording_taken=lambda data: pd.to_datetime(data["recording_taken"]),
+            last_watered=lambda data: pd.to_datetime(data["last_watered"])))
+        part_name = f"{LEGACY_PART_PREFIX}-{chunk_number}"
+        chunk_entries = write_archive_partitions(current_s3, bucket, readings, part_name)
+        entries.extend(chunk_entries)
+        keys.extend(entry["key"] for entry in chunk_entries)
+        keys.extend(write_rollups(current_s3, bucket, readings, part_name))
+
+    # listed only once every chunk is written, so a failed conversion is retried whole
+    update_manifest(current_s3, bucket, entries)
+    return keys
+
+
+def stream_query(connection: psycopg2.extensions.connection, query: str | sql.Composable,
+                 params: tuple | None = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Runs a query through a named server-side cursor and yields the rows in
+    fixed-size chunks, so only one chunk is ever held in memory"""
+
+    with connection.cursor(name="archive_export", cursor_factory=psycopg2.extensions.cursor) as cur:
+        cur.itersize = chunk_size
+        cur.execute(query, params)
+        while rows := cur.fetchmany(chunk_size):
+            yield apply_reading_schema(pd.DataFrame.from_records(rows, columns=COLUMNS))
+
+
+def get_watermark(connection: psycopg2.extensions.connection) -> tuple[datetime, int]:
+    """Returns the recording time and result id of the last reading archived"""
+
+    with connection:
+        with connection.cursor() as cur:
+            cur.execute("SELECT recording_taken, result_id FROM archive_watermark;")
+            watermark = cur.fetchone()
+    return watermark["recording_taken"], watermark["result_id"]
+
+
+def fetch_archive_batch(connection: psycopg2.extensions.connection, watermark: tuple[datetime, int],
+                        archive_cutoff: datetime, batch_size: int = EXPORT_CHUNK_SIZE) -> pd.DataFrame:
+    """Returns the next batch of readings after the watermark that are older than the cutoff.
+    The batch is read in its own transaction, committed before it is uploaded, so no
+    locks are held on sensor_result while waiting on S3"""
+
+    with connection:
+        chunks = list(stream_query(connection, QUERY_FOR_DATA,
+                                   (*watermark, archive_cutoff, batch_size), batch_size))
+    return chunks[0] if chunks else apply_reading_schema(pd.DataFrame(columns=COLUMNS))
+
+
+def archive_batch(connection: psycopg2.extensions.connection, current_s3: BaseClient, bucket: str,
+                  batch: pd.DataFrame, watermark: tuple[datetime, int]) -> tuple[list[str], tuple[datetime, int]]:
+    """Uploads a batch and its rollups to the archive and lists it in the manifest.
+    Only once S3 has acknowledged them, deletes the batch from the default partition
+    and moves the watermark past it in a second short transaction.
+    Returns the keys written and the new watermark"""
+
+    last_reading = batch.iloc[-1]
+    new_watermark = (pd.Timestamp(last_reading["recording_taken"]).to_pydatetime(),
+                     int(last_reading["result_id"]))
+
+    # named after the batch start so a retried batch overwrites its own objects
+    part_name = f"{watermark[0]:%Y%m%dT%H%M%S}-{watermark[1]}"
+    entries = write_archive_partitions(current_s3, bucket, batch, part_name)
+    keys = [entry["key"] for entry in entries]
+    keys.extend(write_rollups(current_s3, bucket, batch, part_name))
+    update_manifest(current_s3, bucket, entries)
+
+    with connection:
+        with connection.cursor() as cur:
+            cur.execute(sql.SQL("""DELETE FROM {} WHERE (recording_taken, result_id) > (%s, %s)
+                AND (recording_taken, result_id) <= (%s, %s);""").format(
+                sql.Identifier(DEFAULT_PARTITION)), (*watermark, *new_watermark))
+            cur.execute("""UPDATE archive_watermark
+                SET recording_taken = %s, result_id = %s, updated_at = NOW();""", new_watermark)
+    return keys, new_watermark
+
+
+def drop_expired_partitions(connection: psycopg2.extensions.connection, archive_cutoff: datetime) -> list[str]:
+    """Detaches and drops the daily partitions that have been fully archived,
+    and creates the upcoming ones. Returns the partitions dropped"""
+
+    expired_partitions = get_expired_partitions(connection, archive_cutoff)
+
+    with connection:
+        with connection.cursor() as cur:
+            for partition in expired_partitions:
+                cur.execute(sql.SQL("ALTER TABLE sensor_result DETACH PARTITION {};").format(
+                    sql.Identifier(partition)))
+                cur.execute(sql.SQL("DROP TABLE {};").format(sql.Identifier(partition)))
+            cur.execute("SELECT create_sensor_result_partitions();")
+    return expired_partitions
+
+
+def retrieve_data_older_than_24_hours(connection: psycopg2.extensions.connection,
+                                      current_s3: BaseClient, bucket: str) -> list[str]:
+    """Archives the readings from before the start of the day 24hrs ago in bounded batches
+    keyed on the persisted watermark, so a failed run resumes where it stopped.
+    Whole daily partitions are dropped once archived, so only the few rows in the
+    default partition are ever deleted. Returns the keys of the archive objects written."""
+
+    archive_cutoff = (datetime.now() - timedelta(hours=24)).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    watermark = get_watermark(connection)
+    archive_keys = []
+
+    if read_manifest(current_s3, bucket).empty:
+        rebuild_manifest(current_s3, bucket)
+    archive_keys.extend(convert_legacy_csv(current_s3, bucket))
+
+    while not (batch := fetch_archive_batch(connection, watermark, archive_cutoff)).empty:
+        keys, watermark = archive_batch(
+            connection, current_s3, bucket, batch, watermark)
+        archive_keys.extend(keys)
 
-    current_s3.upload_file("long_term_data/full_s3_data.csv", environ.get(
-        "BUCKET_NAME"), "full_s3_data.csv")
+    drop_expired_partitions(connection, archive_cutoff)
+    return archive_keys
 
 
 if __name__ == "__main__":
@@ -139,15 +350,10 @@ if __name__ == "__main__":
 
     short_db_conn = get_short_term_db_connection(config)
 
-    create_download_folders()
-    retrieve_data_older_than_24_hours(short_db_conn)
-    print("Data older than 24hrs retrieved.")
+    # boto3 is only imported by the entry point, as it is slow to import
+    from boto3 import client
     current_s3 = client("s3", aws_access_key_id=environ.get("ACCESS_KEY_ID"),
                         aws_secret_access_key=environ.get("SECRET_ACCESS_KEY"))
-    download_data_from_s3(current_s3)
-    print("Data from s3 bucket downloaded.")
-    combine_csv_files()
-    print("Files combined.")
-    upload_files_to_s3(current_s3)
-    os.remove("long_term_data/full_s3_data.csv")
-    print("File uploaded to S3.")
+    archive_keys = retrieve_data_older_than_24_hours(
+        short_db_conn, current_s3, environ.get("BUCKET_NAME"))
+    print(f"Data from before the start of the day 24hrs ago archived to {len(archive_keys)} file(s) on S3.")
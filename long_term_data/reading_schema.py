@@ -0,0 +1,20 @@
+"""Column types of the archived readings, shared by the long term load that writes them
+and the dashboard that reads them"""
+
+import pandas as pd
+
+# Dimensions repeat one of a few dozen values on every row so are dictionary encoded,
+# and measurements only need float32. Coordinates keep full precision
+READING_SCHEMA = {"plant_name": "category", "scientific_name": "category", "api_id": "Int32",
+                  "cycle": "category", "last_watered": "datetime64[us]", "soil_moisture": "float32",
+                  "temperature": "float32", "sunlight": "category", "recording_taken": "datetime64[us]",
+                  "longitude": "float64", "latitude": "float64", "country": "category",
+                  "continent": "category", "botanist_name": "category", "email": "category",
+                  "phone": "category", "error": "category", "result_id": "Int64"}
+
+
+def apply_reading_schema(data: pd.DataFrame) -> pd.DataFrame:
+    """Returns the readings with the column types of the reading schema"""
+
+    return data.astype({column: dtype for column, dtype in READING_SCHEMA.items()
+                        if column in data.columns})
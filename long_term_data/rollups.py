@@ -0,0 +1,146 @@
+"""Builds the hourly and daily rollups of archived readings for each plant and continent.
+Rollups are mergeable, so each archived batch writes its own partial rollup and readers
+combine them with merge_rollups"""
+
+from __future__ import annotations
+
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+ROLLUP_PREFIX = "rollups"
+NO_ERROR = "No Error"
+
+# Resolution name and the frequency readings are floored to
+ROLLUP_RESOLUTIONS = {"hourly": "h", "daily": "D"}
+
+# Level name and the columns rollups at that level are grouped by
+ROLLUP_LEVELS = {"plant": ["api_id", "plant_name"], "continent": ["continent"]}
+
+# Metric and the (lowest, highest, number of bins) of its fixed-bin histogram sketch.
+# Medians read from the sketch are within half a bin width of the true median
+ROLLUP_METRICS = {"soil_moisture": (0, 100, 400), "temperature": (-10, 40, 500)}
+
+
+def get_rollup_key(resolution: str, level: str, day: str, part_name: str) -> str:
+    """Returns the key of a rollup object, partitioned by date like the archive"""
+
+    return f"{ROLLUP_PREFIX}/{resolution}/{level}/date={day}/part-{part_name}.parquet"
+
+
+def histogram_bins(values: pd.Series, metric: str) -> np.ndarray:
+    """Returns the sketch bin of each value, with out of range values in the end bins"""
+
+    lowest, highest, number_of_bins = ROLLUP_METRICS[metric]
+    bin_width = (highest - lowest) / number_of_bins
+    bins = np.floor((values.to_numpy(dtype=float) - lowest) / bin_width)
+    return np.clip(bins, 0, number_of_bins - 1).astype(int)
+
+
+def build_rollup(data: pd.DataFrame, level: str, resolution: str) -> pd.DataFrame:
+    """
+    Returns the count, sum, sum of squares, min, max and histogram sketch of
+    each metric for every group of readings at the level in each period
+    """
+
+    group_columns = ROLLUP_LEVELS[level] + ["period_start"]
+    data = data[data["error"] == NO_ERROR].dropna(subset=ROLLUP_LEVELS[level])
+    data = data.assign(period_start=pd.to_datetime(data["recording_taken"]).dt.floor(
+        ROLLUP_RESOLUTIONS[resolution]))
+
+    aggregations = {"readings": ("period_start", "size")}
+    for metric in ROLLUP_METRICS:
+        # summed as float64, as readings are stored as float32
+        data[metric] = pd.to_numeric(data[metric], errors="coerce").astype("float64")
+        data[f"{metric}_squared"] = data[metric] ** 2
+        aggregations.update({f"{metric}_count": (metric, "count"),
+                             f"{metric}_sum": (metric, "sum"),
+                             f"{metric}_sumsq": (f"{metric}_squared", "sum"),
+                             f"{metric}_min": (metric, "min"),
+                             f"{metric}_max": (metric, "max")})
+
+    groups = data.groupby(group_columns, sort=True, observed=True)
+    rollup = groups.agg(**aggregations).reset_index()
+    group_ids = groups.ngroup().to_numpy()
+
+    for metric, (_, _, number_of_bins) in ROLLUP_METRICS.items():
+        present = data[metric].notna().to_numpy()
+        histograms = np.zeros((len(rollup), number_of_bins), dtype=np.int64)
+        np.add.at(histograms, (group_ids[present],
+                               histogram_bins(data.loc[present, metric], metric)), 1)
+        rollup[f"{metric}_histogram"] = list(histograms)
+
+    return rollup
+
+
+def merge_sketches(sketches: pd.Series) -> np.ndarray:
+    """Returns the histogram sketch of all the readings counted in the given sketches"""
+
+    return np.sum(np.stack(sketches.to_numpy()), axis=0)
+
+
+def merge_rollups(rollups: pd.DataFrame, level: str) -> pd.DataFrame:
+    """Combines partial rollups of the same group and period into one row each"""
+
+    group_columns = ROLLUP_LEVELS[level] + ["period_start"]
+    aggregations = {"readings": "sum"}
+    for metric in ROLLUP_METRICS:
+        aggregations.update({f"{metric}_count": "sum", f"{metric}_sum": "sum",
+                             f"{metric}_sumsq": "sum", f"{metric}_min": "min",
+                             f"{metric}_max": "max", f"{metric}_histogram": merge_sketches})
+    return rollups.groupby(group_columns, as_index=False, sort=True, observed=True).agg(aggregations)
+
+
+def sketch_quantile(histogram: np.ndarray, metric: str, quantile: float) -> float:
+    """Returns the quantile of a histogram sketch, interpolating within its bin"""
+
+    lowest, highest, number_of_bins = ROLLUP_METRICS[metric]
+    histogram = np.asarray(histogram)
+    total = histogram.sum()
+    if total == 0:
+        return np.nan
+
+    bin_width = (highest - lowest) / number_of_bins
+    cumulative = np.cumsum(histogram)
+    target = quantile * total
+    bin_index = int(np.searchsorted(cumulative, target))
+    below = cumulative[bin_index - 1] if bin_index else 0
+    fraction = (target - below) / histogram[bin_index]
+    return lowest + (bin_index + fraction) * bin_width
+
+
+def summarise_rollup(rollup: pd.DataFrame, metric: str) -> pd.DataFrame:
+    """Adds the mean, sample standard deviation and median of a metric to a rollup"""
+
+    count = rollup[f"{metric}_count"]
+    total = rollup[f"{metric}_sum"]
+    variance = (rollup[f"{metric}_sumsq"] - total ** 2 / count) / (count - 1)
+
+    return rollup.assign(**{
+        f"{metric}_mean": total / count,
+        f"{metric}_std": np.sqrt(variance.clip(lower=0)).where(count > 1),
+        f"{metric}_median": rollup[f"{metric}_histogram"].map(
+            lambda sketch: sketch_quantile(sketch, metric, 0.5))
+    })
+
+
+def write_rollups(current_s3: BaseClient, bucket: str, data: pd.DataFrame, part_name: str) -> list[str]:
+    """Writes the rollups of a batch of readings at every level and resolution,
+    one object per date. Returns the keys written"""
+
+    keys = []
+    for resolution in ROLLUP_RESOLUTIONS:
+        for level in ROLLUP_LEVELS:
+            rollup = build_rollup(data, level, resolution)
+            for day, day_rollup in rollup.groupby(rollup["period_start"].dt.strftime("%Y-%m-%d")):
+                key = get_rollup_key(resolution, level, day, part_name)
+                buffer = BytesIO()
+                day_rollup.to_parquet(buffer, index=False)
+                current_s3.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+                keys.append(key)
+    return keys
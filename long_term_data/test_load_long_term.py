@@ -0,0 +1,275 @@
+"""Tests for load_long_term.py file"""
+
+from datetime import datetime
+from io import BytesIO
+from unittest.mock import MagicMock
+
+import pandas as pd
+from psycopg2 import sql
+from pytest import raises
+
+from load_long_term import write_archive_partitions, get_archive_key, stream_query, COLUMNS
+from load_long_term import archive_batch, read_manifest, update_manifest, rebuild_manifest
+from load_long_term import fetch_archive_batch, convert_legacy_csv
+from load_long_term import LEGACY_CSV_KEY, get_expired_partitions, drop_expired_partitions
+from reading_schema import apply_reading_schema
+
+
+def read_archive_object(s3_client, key: str) -> pd.DataFrame:
+    """Reads one parquet object from the mocked bucket"""
+
+    body = s3_client.get_object(Bucket="test-bucket", Key=key)["Body"].read()
+    return pd.read_parquet(BytesIO(body))
+
+
+def test_get_archive_key():
+    """Verifies that archive objects are partitioned by date"""
+
+    assert get_archive_key("2023-09-01", "abc") == "readings/date=2023-09-01/part-abc.parquet"
+
+
+def test_write_archive_partitions_one_object_per_date(fake_s3, archive_data):
+    """Verifies that readings are split into a parquet object for each recording date"""
+
+    keys = [entry["key"] for entry in write_archive_partitions(fake_s3, "test-bucket", archive_data)]
+
+    assert [key.split("/")[1] for key in keys] == ["date=2023-09-01", "date=2023-09-02"]
+    assert len(read_archive_object(fake_s3, keys[0])) == 1
+    assert read_archive_object(fake_s3, keys[1])["api_id"].to_list() == [2, 1]
+
+
+def test_write_archive_partitions_appends(fake_s3, archive_data):
+    """Verifies that a second run adds new objects rather than replacing existing ones"""
+
+    first_keys = [entry["key"] for entry in write_archive_partitions(
+        fake_s3, "test-bucket", archive_data)]
+    second_keys = [entry["key"] for entry in write_archive_partitions(
+        fake_s3, "test-bucket", archive_data)]
+    stored_keys = [item["Key"] for item in fake_s3.list_objects_v2(
+        Bucket="test-bucket")["Contents"]]
+
+    assert set(first_keys).isdisjoint(second_keys)
+    assert len(stored_keys) == 4
+
+
+def test_write_archive_partitions_no_data(fake_s3, archive_data):
+    """Verifies that nothing is uploaded when there are no new readings"""
+
+    assert write_archive_partitions(fake_s3, "test-bucket", archive_data.iloc[0:0]) == []
+    assert "Contents" not in fake_s3.list_objects_v2(Bucket="test-bucket")
+
+
+def test_write_archive_partitions_manifest_entries(fake_s3, archive_data):
+    """Verifies that each object written is described for the manifest"""
+
+    entries = write_archive_partitions(fake_s3, "test-bucket", archive_data)
+    stored = fake_s3.head_object(Bucket="test-bucket", Key=entries[1]["key"])
+
+    assert entries[1]["rows"] == 2
+    assert entries[1]["api_ids"] == [1, 2]
+    assert entries[1]["min_recording_taken"] == pd.Timestamp("2023-09-02 00:01:00")
+    assert entries[1]["max_recording_taken"] == pd.Timestamp("2023-09-02 00:02:00")
+    assert entries[1]["bytes"] == stored["ContentLength"]
+    assert entries[1]["etag"] == stored["ETag"]
+
+
+def test_update_manifest_replaces_retried_entries(fake_s3, archive_data):
+    """Verifies that entries for keys already in the manifest are replaced, not duplicated"""
+
+    entries = write_archive_partitions(fake_s3, "test-bucket", archive_data, "abc")
+    update_manifest(fake_s3, "test-bucket", entries)
+    update_manifest(fake_s3, "test-bucket", entries[1:])
+
+    manifest = read_manifest(fake_s3, "test-bucket")
+    assert manifest["key"].to_list() == [entry["key"] for entry in entries]
+    assert manifest["api_ids"].map(list).to_list() == [[1], [1, 2]]
+
+
+def test_read_manifest_missing(fake_s3):
+    """Verifies that a bucket without a manifest has an empty one"""
+
+    assert read_manifest(fake_s3, "test-bucket").empty
+
+
+def test_rebuild_manifest(fake_s3, archive_data):
+    """Verifies that the manifest can be rebuilt from the objects already archived"""
+
+    entries = write_archive_partitions(fake_s3, "test-bucket", archive_data)
+
+    manifest = rebuild_manifest(fake_s3, "test-bucket")
+
+    assert manifest["rows"].to_list() == [entry["rows"] for entry in entries]
+    assert read_manifest(fake_s3, "test-bucket")["key"].to_list() == \
+        [entry["key"] for entry in entries]
+
+
+def put_legacy_csv(s3_client, data: pd.DataFrame) -> None:
+    """Uploads readings as the legacy csv archive, which had no result_id column"""
+
+    s3_client.put_object(Bucket="test-bucket", Key=LEGACY_CSV_KEY,
+                         Body=data.drop(columns="result_id").to_csv(index=False))
+
+
+def test_convert_legacy_csv(fake_s3, archive_data):
+    """Verifies that the legacy csv readings are partitioned by date, typed and listed
+    in the manifest, a chunk at a time"""
+
+    put_legacy_csv(fake_s3, archive_data)
+
+    keys = convert_legacy_csv(fake_s3, "test-bucket", chunk_size=2)
+    manifest = read_manifest(fake_s3, "test-bucket")
+
+    assert manifest["key"].to_list() == [
+        "readings/date=2023-09-01/part-legacy-csv-0.parquet",
+        "readings/date=2023-09-02/part-legacy-csv-0.parquet",
+        "readings/date=2023-09-02/part-legacy-csv-1.parquet"]
+    assert set(manifest["key"]) < set(keys)
+    assert manifest["rows"].sum() == 3
+    stored = read_archive_object(fake_s3, manifest["key"][0])
+    assert stored["temperature"].dtype == "float32"
+    assert stored["recording_taken"].to_list() == [pd.Timestamp("2023-09-01 23:59:00")]
+    assert stored["result_id"].isna().all()
+
+
+def test_convert_legacy_csv_runs_once(fake_s3, archive_data):
+    """Verifies that a converted csv is not converted again on the next run"""
+
+    put_legacy_csv(fake_s3, archive_data)
+    convert_legacy_csv(fake_s3, "test-bucket")
+    manifest = read_manifest(fake_s3, "test-bucket")
+
+    assert convert_legacy_csv(fake_s3, "test-bucket") == []
+    assert read_manifest(fake_s3, "test-bucket").equals(manifest)
+
+
+def test_convert_legacy_csv_missing(fake_s3):
+    """Verifies that a bucket without the legacy csv is left as it is"""
+
+    assert convert_legacy_csv(fake_s3, "test-bucket") == []
+    assert "Contents" not in fake_s3.list_objects_v2(Bucket="test-bucket")
+
+
+def test_write_archive_partitions_keeps_schema(fake_s3, archive_data):
+    """Verifies that typed readings keep their types in the archive"""
+
+    entries = write_archive_partitions(fake_s3, "test-bucket", apply_reading_schema(archive_data))
+    stored = read_archive_object(fake_s3, entries[0]["key"])
+
+    assert stored["continent"].dtype == "category"
+    assert stored["temperature"].dtype == "float32"
+
+
+def test_stream_query_yields_fixed_size_chunks(archive_data):
+    """Verifies that rows are fetched from the named cursor and yielded a chunk at a time"""
+
+    rows = list(archive_data.itertuples(index=False, name=None))
+    fake_connection = MagicMock()
+    fake_cursor = fake_connection.cursor().__enter__()
+    fake_cursor.fetchmany.side_effect = [rows[:2], rows[2:], []]
+
+    chunks = list(stream_query(fake_connection, "SELECT", chunk_size=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert chunks[0].columns.to_list() == COLUMNS
+    assert chunks[0]["error"].dtype == "category"
+    fake_cursor.fetchmany.assert_called_with(2)
+    assert fake_connection.cursor.call_args.kwargs["name"] == "archive_export"
+
+
+def test_fetch_archive_batch_commits_before_upload(archive_data):
+    """Verifies that the batch is read in its own transaction, which has ended
+    by the time it is returned for upload"""
+
+    rows = list(archive_data.assign(result_id=[4, 5, 6]).itertuples(index=False, name=None))
+    fake_connection = MagicMock()
+    fake_cursor = fake_connection.cursor().__enter__()
+    fake_cursor.fetchmany.side_effect = [rows, []]
+
+    batch = fetch_archive_batch(fake_connection, (datetime(2023, 9, 1), 3),
+                                datetime(2023, 9, 3), batch_size=10)
+
+    assert len(batch) == 3
+    fake_connection.__enter__.assert_called_once()
+    fake_connection.__exit__.assert_called_once()
+
+
+def test_archive_batch_moves_watermark_after_upload(fake_s3, archive_data):
+    """Verifies that the batch is uploaded and the watermark moved to its last reading"""
+
+    archive_data["recording_taken"] = pd.to_datetime(archive_data["recording_taken"])
+    archive_data["result_id"] = [4, 5, 6]
+    fake_connection = MagicMock()
+    fake_cursor = fake_connection.cursor().__enter__()
+
+    keys, watermark = archive_batch(fake_connection, fake_s3, "test-bucket",
+                                    archive_data, (datetime(2023, 9, 1), 3))
+
+    assert watermark == (datetime(2023, 9, 2, 0, 2), 6)
+    assert keys[:2] == ["readings/date=2023-09-01/part-20230901T000000-3.parquet",
+                        "readings/date=2023-09-02/part-20230901T000000-3.parquet"]
+    assert "rollups/daily/plant/date=2023-09-02/part-20230901T000000-3.parquet" in keys
+    assert read_manifest(fake_s3, "test-bucket")["key"].to_list() == keys[:2]
+    assert fake_cursor.execute.call_args.args[1] == watermark
+
+
+def test_archive_batch_failed_upload_keeps_watermark(archive_data):
+    """Verifies that nothing is deleted or committed when the upload fails"""
+
+    archive_data["result_id"] = [4, 5, 6]
+    fake_connection = MagicMock()
+    fake_s3 = MagicMock()
+    fake_s3.put_object.side_effect = ConnectionError
+
+    with raises(ConnectionError):
+        archive_batch(fake_connection, fake_s3, "test-bucket",
+                      archive_data, (datetime(2023, 9, 1), 3))
+
+    fake_connection.cursor().__enter__().execute.assert_not_called()
+
+
+def get_partitions_connection(*partitions: str) -> MagicMock:
+    """Returns a fake connection listing the given sensor_result partitions"""
+
+    fake_connection = MagicMock()
+    fake_connection.cursor().__enter__().fetchall.return_value = [
+        {"partition_name": partition} for partition in partitions]
+    return fake_connection
+
+
+def test_get_expired_partitions_cutoff_boundary():
+    """Verifies a partition expires once the cutoff reaches the end of its day"""
+
+    fake_connection = get_partitions_connection(
+        "sensor_result_20230902", "sensor_result_20230901", "sensor_result_20230831")
+
+    assert get_expired_partitions(fake_connection, datetime(2023, 9, 2)) == [
+        "sensor_result_20230831", "sensor_result_20230901"]
+    assert get_expired_partitions(fake_connection, datetime(2023, 9, 1, 23, 59)) == [
+        "sensor_result_20230831"]
+
+
+def test_get_expired_partitions_skips_default():
+    """Verifies partitions not named after their day are never expired"""
+
+    fake_connection = get_partitions_connection("sensor_result_default", "sensor_result_20230901")
+
+    assert get_expired_partitions(fake_connection, datetime(2023, 9, 3)) == [
+        "sensor_result_20230901"]
+
+
+def test_drop_expired_partitions_keeps_default_and_current():
+    """Verifies only the expired partitions are dropped, then the upcoming ones created"""
+
+    fake_connection = get_partitions_connection(
+        "sensor_result_default", "sensor_result_20230901", "sensor_result_20230902",
+        "sensor_result_20230903")
+    fake_cursor = fake_connection.cursor().__enter__()
+
+    assert drop_expired_partitions(fake_connection, datetime(2023, 9, 2)) == [
+        "sensor_result_20230901"]
+    executed = [call.args[0] for call in fake_cursor.execute.call_args_list[1:]]
+    assert executed == [
+        sql.SQL("ALTER TABLE sensor_result DETACH PARTITION {};").format(
+            sql.Identifier("sensor_result_20230901")),
+        sql.SQL("DROP TABLE {};").format(sql.Identifier("sensor_result_20230901")),
+        "SELECT create_sensor_result_partitions();"]
@@ -0,0 +1,15 @@
+"""Tests for reading_schema.py file"""
+
+from reading_schema import apply_reading_schema
+
+
+def test_apply_reading_schema(archive_data):
+    """Verifies that dimensions are dictionary encoded and measurements stored as float32"""
+
+    typed_data = apply_reading_schema(archive_data)
+
+    assert typed_data["plant_name"].dtype == "category"
+    assert typed_data["soil_moisture"].dtype == "float32"
+    assert typed_data["recording_taken"].dtype == "datetime64[us]"
+    assert typed_data["longitude"].dtype == "float64"
+    assert typed_data.memory_usage(deep=True).sum() < archive_data.memory_usage(deep=True).sum()
@@ -0,0 +1,91 @@
+"""Tests for rollups.py file"""
+
+import numpy as np
+import pandas as pd
+
+from rollups import build_rollup, merge_rollups, summarise_rollup, sketch_quantile
+from rollups import get_rollup_key, write_rollups
+from reading_schema import apply_reading_schema
+
+
+def test_get_rollup_key():
+    """Verifies that rollup objects are partitioned by resolution, level and date"""
+
+    assert get_rollup_key("daily", "plant", "2023-09-01", "abc") == \
+        "rollups/daily/plant/date=2023-09-01/part-abc.parquet"
+
+
+def test_build_rollup_daily_plant(archive_data):
+    """Verifies that readings are rolled up per plant per day"""
+
+    archive_data["soil_moisture"] = [30.0, 20.0, 40.0]
+    rollup = build_rollup(archive_data, "plant", "daily")
+
+    assert rollup["api_id"].to_list() == [1, 1, 2]
+    assert rollup["readings"].to_list() == [1, 1, 1]
+    assert rollup["soil_moisture_sum"].to_list() == [30.0, 40.0, 20.0]
+    assert rollup["soil_moisture_sumsq"].to_list() == [900.0, 1600.0, 400.0]
+    assert rollup["soil_moisture_histogram"].map(np.sum).to_list() == [1, 1, 1]
+
+
+def test_build_rollup_skips_errors(archive_data):
+    """Verifies that readings with errors are left out of the rollups"""
+
+    archive_data.loc[0, "error"] = "plant not found"
+    rollup = build_rollup(archive_data, "continent", "hourly")
+
+    assert rollup["readings"].sum() == 2
+
+
+def test_build_rollup_categorical_groups(archive_data):
+    """Verifies that only plants and continents with readings get a rollup row, with
+    their own histogram, when the columns are categorical with unused categories"""
+
+    archive_data["soil_moisture"] = [30.0, 20.0, 40.0]
+    typed = apply_reading_schema(archive_data)
+    typed["plant_name"] = typed["plant_name"].cat.add_categories(["Plant 9"])
+    typed["continent"] = typed["continent"].cat.add_categories(["Europe"])
+
+    plant_rollup = build_rollup(typed, "plant", "daily")
+    continent_rollup = merge_rollups(build_rollup(typed, "continent", "daily"), "continent")
+
+    assert plant_rollup["plant_name"].to_list() == ["Plant 1", "Plant 1", "Plant 2"]
+    assert plant_rollup["soil_moisture_histogram"].map(
+        lambda sketch: int(np.argmax(sketch))).to_list() == [120, 160, 80]
+    assert continent_rollup["continent"].to_list() == ["Asia", "Asia"]
+    assert continent_rollup["readings"].to_list() == [1, 2]
+
+
+def test_merged_rollups_match_raw_statistics():
+    """Verifies that partial rollups merge to the statistics of all the readings"""
+
+    rng = np.random.default_rng(1)
+    readings = pd.DataFrame({
+        "api_id": 1, "plant_name": "Plant 1", "continent": "Asia", "error": "No Error",
+        "recording_taken": pd.Timestamp("2023-09-01") + pd.to_timedelta(np.arange(1000), unit="min"),
+        "soil_moisture": rng.uniform(0, 100, 1000), "temperature": rng.normal(15, 5, 1000)})
+
+    rollup = merge_rollups(pd.concat([build_rollup(readings.iloc[:300], "continent", "daily"),
+                                      build_rollup(readings.iloc[300:], "continent", "daily")]),
+                           "continent")
+    summary = summarise_rollup(rollup, "temperature")
+
+    assert summary["temperature_count"].to_list() == [1000]
+    assert np.isclose(summary["temperature_mean"][0], readings["temperature"].mean())
+    assert np.isclose(summary["temperature_std"][0], readings["temperature"].std())
+    assert abs(summary["temperature_median"][0] - readings["temperature"].median()) < 0.1
+
+
+def test_sketch_quantile_empty():
+    """Verifies that an empty sketch has no median"""
+
+    assert np.isnan(sketch_quantile(np.zeros(500), "temperature", 0.5))
+
+
+def test_write_rollups(fake_s3, archive_data):
+    """Verifies that a rollup object is written per resolution, level and date"""
+
+    keys = write_rollups(fake_s3, "test-bucket", archive_data, "abc")
+
+    assert len(keys) == 8
+    assert "rollups/hourly/continent/date=2023-09-01/part-abc.parquet" in keys
@@ -4,6 +4,8 @@ from pytest import fixture
 import pandas as pd
 from unittest.mock import MagicMock
 
+from extract import PLANT_DATA_COLUMNS
+
 
 @fixture
 def duplicate_data() -> pd.DataFrame:
@@ -32,7 +34,7 @@ def mock_multiprocessing() -> MagicMock:
 def mock_acquire_plant_data(*args) -> dict:
     """Function to mock acquire plant data"""
 
-    return {"test": True, "plant_id": 2, "temperature": None}
+    return {"test": True, "plant_id": 2, "temperature": None, "soil_moisture": 30.5}
 
 
 @fixture
@@ -98,3 +100,87 @@ class FakeCursor:
     def execute(self, *args) -> None:
         """Mocking cursor.execute"""
         print("Executed!")
+
+    def copy_expert(self, *args) -> None:
+        """Mocking cursor.copy_expert"""
+        print("Copied!")
+
+
+class FakeResponse:
+    """Class for mocking an aiohttp response"""
+
+    def __init__(self, data: dict) -> None:
+        """Stores the data the response will return"""
+        self.data = data
+
+    async def __aenter__(self) -> 'FakeResponse':
+        """Mocking opening the response"""
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        """Mocking closing the response"""
+        pass
+
+    async def json(self, **kwargs) -> dict:
+        """Mocking the json body of the response"""
+        return self.data
+
+
+class FakeSession:
+    """Class for mocking an aiohttp client session"""
+
+    def __init__(self, data: dict | None = None, error: Exception | None = None) -> None:
+        """Stores the data returned, or the error raised, on every request"""
+        self.data = data
+        self.error = error
+        self.requested_urls = []
+
+    def get(self, url: str) -> FakeResponse:
+        """Mocking session.get"""
+        self.requested_urls.append(url)
+        if self.error is not None:
+            raise self.error
+        return FakeResponse(self.data)
+
+
+@fixture
+def plant_batch() -> pd.DataFrame:
+    """Returns an extracted batch in memory with one error row and two plant readings"""
+
+    plants = [{"api_id": 0, "error": "plant not found"}]
+    for api_id in (1, 2):
+        plants.append({"plant_name": f"Plant {api_id}", "scientific_name": "['Plantae']",
+                       "api_id": api_id, "cycle": "Perennial",
+                       "last_watered": "Tue, 29 Aug 2023 13:24:30 GMT",
+                       "soil_moisture": 30.5, "temperature": 12.4, "sunlight": "full sun",
+                       "recording_taken": f"2023-08-30 12:0{api_id}:34",
+                       "longitude": "22.4711", "latitude": "88.1453", "country": "IN",
+                       "continent": "Asia", "botanist_name": "Fake Name",
+                       "email": "fake.name@lnhm.co.uk", "phone": "001.481.273.3691x69537"})
+    return pd.DataFrame(plants, columns=PLANT_DATA_COLUMNS)
+
+
+@fixture
+def sensor_dataframe() -> pd.DataFrame:
+    """Returns a sensor batch with a full reading and an error reading"""
+
+    return pd.DataFrame({"last_watered": pd.to_datetime(["2023-08-29 13:24:30", None]),
+                         "soil_moisture": [30.5, None], "temperature": [12.4, None],
+                         "recording_taken": pd.to_datetime(["2023-08-30 12:01:34"] * 2),
+                         "availability_id": [1, 3], "botanist_id": [3.0, None],
+                         "plant_id": [7, None]})
+
+
+@fixture
+def plant_dataframe() -> pd.DataFrame:
+    """Returns a transformed batch with an error row and a reading for the same plant"""
+
+    return pd.DataFrame({"plant_name": [None, None, "Plant 1"],
+                         "scientific_name": [None, None, "Plantae"],
+                         "cycle": [None, None, "Perennial"], "sunlight": [None, None, "full sun"],
+                         "api_id": [0, 1, 1], "origin_id": [None, None, 2],
+                         "botanist_name": [None, None, "Fake Name"],
+                         "email": [None, None, "fake.name@lnhm.co.uk"],
+                         "phone": [None, None, "001-481-273-3691"],
+                         "error": ["plant not found", "plant on loan to another museum", "No Error"]},
+                        index=[4, 5, 6])
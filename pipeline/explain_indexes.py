@@ -0,0 +1,147 @@
+"""Seeds a fresh local database with generated readings and runs EXPLAIN ANALYZE
+on the queries each read-path index is meant to serve"""
+
+from os import environ
+
+from dotenv import load_dotenv
+import psycopg2.extensions
+
+from load_short_term import get_db_connection
+from migrate import run_migrations
+
+
+SEED_DAYS = int(environ.get("SEED_DAYS", 7))
+SEED_PLANTS = 51
+
+SEED_QUERY = """
+DO $$
+BEGIN
+    FOR day_offset IN 1..%(days)s LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %%I PARTITION OF sensor_result FOR VALUES FROM (%%L) TO (%%L)',
+            'sensor_result_' || to_char(CURRENT_DATE - day_offset, 'YYYYMMDD'),
+            CURRENT_DATE - day_offset, CURRENT_DATE - day_offset + 1);
+    END LOOP;
+END $$;
+
+INSERT INTO origin (longitude, latitude, country, continent)
+    SELECT plant_number * 1.5, plant_number * -1.5, 'GB', 'Europe'
+    FROM generate_series(0, %(plants)s - 1) AS plant_number;
+
+INSERT INTO botanist (name, email, phone)
+    SELECT 'Botanist ' || plant_number, 'botanist' || plant_number || '@lnhm.co.uk',
+        '001-481-273-' || lpad(plant_number::TEXT, 4, '0')
+    FROM generate_series(0, %(plants)s - 1) AS plant_number;
+
+INSERT INTO plant (origin_id, api_id, plant_name, scientific_name, cycle, sunlight)
+    SELECT origin_id, origin_id - 1, 'Plant ' || origin_id, 'Plantae', 'Perennial', 'full sun'
+    FROM origin;
+
+-- Readings are written in time order, as the loader writes them, which is the layout BRIN relies on
+INSERT INTO sensor_result (botanist_id, availability_id, plant_id, last_watered,
+                           soil_moisture, temperature, recording_taken)
+    SELECT plant_id, 1, plant_id, reading_time - INTERVAL '1 day',
+        random() * 100, random() * 30, reading_time
+    FROM generate_series(CURRENT_DATE - %(days)s, NOW(), INTERVAL '1 minute') AS reading_time
+    CROSS JOIN plant
+    ORDER BY reading_time, plant_id;
+
+ANALYZE;
+"""
+
+# Each query is paired with the index it should be planned with, and whether sequential
+# scans are disabled for it. The seeded dimension tables fit in a page or two, so the
+# planner rightly scans them whole and is only made to use their index to check it serves
+# the lookup. The sensor_result queries are planned freely, so using the index means
+# the planner chose it
+EXPLAIN_QUERIES = [
+    ("sensor_result_recording_taken_brin",
+     "SELECT count(*) FROM sensor_result WHERE recording_taken >= CURRENT_DATE - 2 + TIME '09:00' AND recording_taken < CURRENT_DATE - 2 + TIME '10:00';",
+     False),
+    ("sensor_result_plant_id_recording_taken_idx",
+     "SELECT recording_taken, soil_moisture FROM sensor_result WHERE plant_id = 7 AND recording_taken >= CURRENT_DATE - 1;",
+     False),
+    ("botanist_phone_key",
+     "SELECT botanist_id FROM botanist WHERE phone = '001-481-273-0007';", True),
+    ("plant_api_id_key",
+     "SELECT plant_id FROM plant WHERE api_id = 7;", True),
+    ("origin_longitude_latitude_idx",
+     "SELECT origin_id FROM origin WHERE longitude = 10.5 AND latitude = -10.5;", True),
+    ("plant_availability_type_of_availability_key",
+     "SELECT availability_id FROM plant_availability WHERE type_of_availability = 'plant not found';",
+     True)
+]
+
+
+def seed_database(connection: psycopg2.extensions.connection, days: int = SEED_DAYS) -> None:
+    """Fills an empty database with a reading every minute for every plant over the past days"""
+
+    with connection:
+        with connection.cursor() as cur:
+            cur.execute("SELECT EXISTS (SELECT 1 FROM sensor_result) AS seeded;")
+            if cur.fetchone()["seeded"]:
+                raise ValueError(
+                    "sensor_result already has data - only seed a fresh local database.")
+            cur.execute(SEED_QUERY, {"days": days, "plants": SEED_PLANTS})
+
+
+def get_index_names(connection: psycopg2.extensions.connection, index: str) -> list[str]:
+    """Returns the name of an index and of the copies of it on each partition"""
+
+    with connection.cursor() as cur:
+        cur.execute("""SELECT child.relname AS index_name FROM pg_inherits
+            JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+            JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+            WHERE parent.relname = %s;""", (index,))
+        return [index] + [row["index_name"] for row in cur.fetchall()]
+
+
+def explain_query(connection: psycopg2.extensions.connection, query: str,
+                  disable_seqscan: bool = False) -> list[str]:
+    """Returns the EXPLAIN ANALYZE plan of a query as a list of lines,
+    optionally with sequential scans disabled for just this query"""
+
+    with connection:
+        with connection.cursor() as cur:
+            if disable_seqscan:
+                cur.execute("SET LOCAL enable_seqscan = off;")
+            cur.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}")
+            return [row["QUERY PLAN"] for row in cur.fetchall()]
+
+
+def explain_indexes(connection: psycopg2.extensions.connection) -> dict[str, bool]:
+    """Prints the plan of every read-path query and returns whether it used its index"""
+
+    index_used = {}
+    for index, query, disable_seqscan in EXPLAIN_QUERIES:
+        plan = explain_query(connection, query, disable_seqscan)
+        index_names = get_index_names(connection, index)
+        index_used[index] = any(
+            f" {name} " in f"{line} " for line in plan for name in index_names)
+
+        print(f"\n{index}{' (sequential scans disabled)' if disable_seqscan else ''}\n{query}")
+        print("\n".join(plan))
+    return index_used
+
+
+if __name__ == "__main__":
+
+    load_dotenv()
+    config = {
+        "DATABASE_NAME": environ.get("DATABASE_NAME"),
+        "DATABASE_USERNAME": environ.get("DATABASE_USERNAME"),
+        "DATABASE_ENDPOINT": environ.get("DATABASE_ENDPOINT"),
+        "DATABASE_PASSWORD": environ.get("DATABASE_PASSWORD")
+    }
+
+    conn = get_db_connection(config)
+
+    run_migrations(conn)
+    seed_database(conn)
+    results = explain_indexes(conn)
+
+    print("\nIndex used:")
+    for index_name, used in results.items():
+        print(f"  {index_name}: {'yes' if used else 'NO'}")
+
+    conn.close()
@@ -1,31 +1,84 @@
-"""Extracts all the plant data from plant 0 - 50 and adds to csv file"""
+"""Extracts all the plant data from plant 0 - 50 and adds to csv file.
+requests, aiohttp and pandas are imported by the functions that use them,
+so importing the module only for its constants stays fast"""
 
+from __future__ import annotations
+
+import asyncio
+from itertools import islice
 from multiprocessing import Pool
 import os
 import time
+from typing import AsyncIterator, TYPE_CHECKING
+
+from metrics import observe_http_latency
 
-import pandas as pd
-import requests
+if TYPE_CHECKING:
+    import aiohttp
+    import pandas as pd
 
 
-NUMBER_OF_PLANTS = 50
+NUMBER_OF_PLANTS = int(os.environ.get("NUMBER_OF_PLANTS", 50))
+# Fields the API returns as lists, which transform expects in their string form
+LIST_COLUMNS = ["scientific_name", "sunlight"]
+PLANT_API_URL = os.environ.get("PLANT_API_URL",
+                               "https://data-eng-plants-api.herokuapp.com/plants/{}")
+EXTRACT_MODE = os.environ.get("EXTRACT_MODE", "async")
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", 50))
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", 10))
+TIMEOUT_ERROR = "Timeout: The request could not be completed."
+REQUEST_ERROR = "Request failed: The response could not be read."
+MISSING_FIELD_ERROR = "Missing field in data."
+# Fields check_plant_data reads from every response that is not an error
+CHECKED_FIELDS = ["plant_id", "temperature", "soil_moisture"]
+PLANT_DATA_COLUMNS = ["plant_name", "scientific_name", "api_id", "cycle", "last_watered",
+                      "soil_moisture", "temperature", "sunlight", "recording_taken", "longitude",
+                      "latitude", "country", "continent", "botanist_name", "email", "phone", "error"]
 
 
 def get_plant_data_by_id(plant_id: int) -> dict:
     """Connects to a corresponding plant endpoint using the given id and return
      a dict of all data for the plant"""
 
-    url = f"https://data-eng-plants-api.herokuapp.com/plants/{plant_id}"
+    import requests
+
+    url = PLANT_API_URL.format(plant_id)
     try:
-        response = requests.get(url, timeout=10)
+        response = requests.get(url, timeout=REQUEST_TIMEOUT)
         response = response.json()
 
     except requests.exceptions.Timeout:
-        response = {
-            "error": "Timeout: The request could not be completed.", "plant_id": plant_id}
+        response = {"error": TIMEOUT_ERROR, "plant_id": plant_id}
     return response
 
 
+async def fetch_plant_data_by_id(session: aiohttp.ClientSession, semaphore: asyncio.Semaphore,
+                                 plant_id: int) -> dict:
+    """Asynchronously requests a plant endpoint through a shared session and returns
+    a dict of all data for the plant. The semaphore caps the requests in flight so the
+    per-request timeout only starts once a connection slot is free. A request that fails
+    is recorded as an error for that plant, so it does not fail the rest of the batch"""
+
+    import aiohttp
+
+    url = PLANT_API_URL.format(plant_id)
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            async with session.get(url) as response:
+                return await response.json(content_type=None)
+
+        except asyncio.TimeoutError:
+            return {"error": TIMEOUT_ERROR, "plant_id": plant_id}
+
+        # connection resets, dropped connections and bodies that are not JSON
+        except (aiohttp.ClientError, ValueError):
+            return {"error": REQUEST_ERROR, "plant_id": plant_id}
+
+        finally:
+            observe_http_latency(time.perf_counter() - started)
+
+
 def obtain_relevant_data(plant: dict) -> dict:
     """Obtains only the relevant data from the plant api and returns as a dict"""
 
@@ -49,16 +102,18 @@ def obtain_relevant_data(plant: dict) -> dict:
 
     except:
         relevant_data = {
-            "api_id": plant["plant_id"], "error": "Missing field in data."}
+            "api_id": plant.get("plant_id"), "error": MISSING_FIELD_ERROR}
     return relevant_data
 
 
-def acquire_plant_data(id: int) -> dict:
-    """Returns a dictionary with the plant data for each plant"""
+def check_plant_data(plant: dict) -> dict:
+    """Returns a dictionary with the relevant data, or the error, for a plant response"""
 
-    plant = get_plant_data_by_id(id)
     if "error" not in plant.keys():
-        if plant["temperature"] is None:
+        if any(field not in plant for field in CHECKED_FIELDS):
+            relevant_data = {
+                "api_id": plant.get("plant_id"), "error": MISSING_FIELD_ERROR}
+        elif plant["temperature"] is None:
             relevant_data = {
                 "api_id": plant["plant_id"], "error": "Missing temperature reading."}
         elif plant["soil_moisture"] is None:
@@ -68,10 +123,17 @@ def acquire_plant_data(id: int) -> dict:
             relevant_data = obtain_relevant_data(plant)
     else:
         relevant_data = {
-            "api_id": plant["plant_id"], "error": plant["error"]}
+            "api_id": plant.get("plant_id"), "error": plant["error"]}
     return relevant_data
 
 
+def acquire_plant_data(id: int) -> dict:
+    """Returns a dictionary with the plant data for each plant"""
+
+    plant = get_plant_data_by_id(id)
+    return check_plant_data(plant)
+
+
 def add_to_plant_data_list() -> list[dict]:
     """Returns a list of all plants where each plant is a dictionary of the required
     keys"""
@@ -83,6 +145,70 @@ def add_to_plant_data_list() -> list[dict]:
     return list_of_plants
 
 
+def create_client_session(max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+                          timeout: float = REQUEST_TIMEOUT) -> aiohttp.ClientSession:
+    """Returns a keep-alive session pooling up to max_concurrent connections.
+    Must be called from inside a running event loop"""
+
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit=max_concurrent)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=client_timeout)
+
+
+async def gather_plant_data(plant_ids: range | list[int],
+                            max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+                            timeout: float = REQUEST_TIMEOUT,
+                            session: aiohttp.ClientSession | None = None) -> list[dict]:
+    """Requests every plant id concurrently over one pooled keep-alive session
+    and returns the checked plant data in the same order as the ids.
+    An open session is reused if given, otherwise one is created for this batch"""
+
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    if session is None:
+        async with create_client_session(max_concurrent, timeout) as batch_session:
+            return await gather_plant_data(plant_ids, max_concurrent, timeout, batch_session)
+
+    plants = await asyncio.gather(
+        *(fetch_plant_data_by_id(session, semaphore, plant_id) for plant_id in plant_ids))
+    return [check_plant_data(plant) for plant in plants]
+
+
+async def stream_plant_data(session: aiohttp.ClientSession, plant_ids: range | list[int],
+                            max_concurrent: int = MAX_CONCURRENT_REQUESTS) -> AsyncIterator[dict]:
+    """Yields the checked data of each plant as soon as its response arrives, in the order
+    they arrive. Keeps up to max_concurrent requests in flight, but only sends another once
+    a record has been taken, so a consumer that falls behind slows the requests down"""
+
+    semaphore = asyncio.Semaphore(max_concurrent)
+    plant_ids = iter(plant_ids)
+    in_flight = set()
+
+    try:
+        while True:
+            for plant_id in islice(plant_ids, max_concurrent - len(in_flight)):
+                in_flight.add(asyncio.create_task(
+                    fetch_plant_data_by_id(session, semaphore, plant_id)))
+            if not in_flight:
+                return
+
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for request in done:
+                yield check_plant_data(request.result())
+
+    finally:
+        for request in in_flight:
+            request.cancel()
+
+
+def add_to_plant_data_list_async() -> list[dict]:
+    """Returns a list of all plants using the asyncio extract engine"""
+
+    return asyncio.run(gather_plant_data(range(NUMBER_OF_PLANTS + 1)))
+
+
 def create_download_folders() -> None:
     """Creates a folder with the name "extracted_data" if it doesn't already exist"""
 
@@ -94,21 +220,61 @@ def create_download_folders() -> None:
 def add_to_csv(list_of_plants: list[dict]):
     """Takes a list of plants and add them to a csv file with a row for each plant"""
 
+    import pandas as pd
+
     dataframe = pd.DataFrame(list_of_plants)
     csv_filename = "data/plant_data.csv"
     dataframe.to_csv(csv_filename, index=False)
 
 
-def extract_and_create_csv():
-    """A function that runs the whole extract script"""
+def create_plant_dataframe(list_of_plants: list[dict]) -> pd.DataFrame:
+    """Returns a data-frame with a row for each plant and the same columns on every run,
+    even when a batch is made up only of errors. Lists are turned into strings, as they
+    were when batches were handed to transform through a csv file"""
+
+    import pandas as pd
+
+    plant_data = pd.DataFrame(list_of_plants, columns=PLANT_DATA_COLUMNS)
+    for column in LIST_COLUMNS:
+        plant_data[column] = plant_data[column].map(
+            lambda value: str(value) if isinstance(value, list) else value)
+    return plant_data
+
+
+def extract_plant_data() -> pd.DataFrame:
+    """Runs the extract and returns the batch in memory as a data-frame"""
 
     start_time = time.time()
     print("Extracting...")
 
-    plants = add_to_plant_data_list()
-    create_download_folders()
-    add_to_csv(plants)
+    if EXTRACT_MODE == "async":
+        plants = add_to_plant_data_list_async()
+    else:
+        plants = add_to_plant_data_list()
 
     end_time = time.time()
     elapsed_time = end_time - start_time
     print(f"Total extraction time: {elapsed_time:.2f} seconds.")
+    return create_plant_dataframe(plants)
+
+
+async def extract_plant_data_async(session: aiohttp.ClientSession) -> pd.DataFrame:
+    """Runs the extract over an open session, so a long-running process keeps its
+    connections to the API between batches, and returns the batch as a data-frame"""
+
+    start_time = time.time()
+    print("Extracting...")
+
+    plants = await gather_plant_data(range(NUMBER_OF_PLANTS + 1), session=session)
+
+    elapsed_time = time.time() - start_time
+    print(f"Total extraction time: {elapsed_time:.2f} seconds.")
+    return create_plant_dataframe(plants)
+
+
+def extract_and_create_csv():
+    """A function that runs the whole extract script"""
+
+    plant_data = extract_plant_data()
+    create_download_folders()
+    add_to_csv(plant_data.to_dict("records"))
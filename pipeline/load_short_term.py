@@ -1,16 +1,133 @@
 """Retrieves cleaned data from transform, and inserts into a Postgres db
-This assumes the database already exists and has some initial data - see README / rds_schema.sql"""
+This assumes the database already exists and is migrated - see README / migrate.py"""
 
+from collections import OrderedDict
+from datetime import date
+from io import StringIO
 import os
 
 from dotenv import load_dotenv
-import numpy as np
 import pandas as pd
 import psycopg2
 import psycopg2.errors
 import psycopg2.extras
 import psycopg2.extensions
 
+from metrics import count_db_round_trip
+
+
+SENSOR_RESULT_COLUMNS = ["last_watered", "soil_moisture", "temperature", "recording_taken",
+                         "availability_id", "botanist_id", "plant_id"]
+SENSOR_ID_COLUMNS = ["availability_id", "botanist_id", "plant_id"]
+NO_ERROR = "No Error"
+DIMENSION_CACHE_SIZE = int(os.environ.get("DIMENSION_CACHE_SIZE", 10000))
+MISSING = object()
+PARTITION_DAYS_AHEAD = 2
+
+# Each dimension table lists its columns as (dataframe column, table column, type).
+# Rows are only inserted when their natural key and required columns are present.
+DIMENSION_TABLES = {
+    "origin": {
+        "id_column": "origin_id",
+        "key_columns": ["longitude", "latitude"],
+        "required_columns": [],
+        "columns": [("longitude", "longitude", "FLOAT"), ("latitude", "latitude", "FLOAT"),
+                    ("country", "country", "TEXT"), ("continent", "continent", "TEXT")]
+    },
+    "botanist": {
+        "id_column": "botanist_id",
+        "key_columns": ["phone"],
+        "required_columns": [],
+        "columns": [("botanist_name", "name", "TEXT"), ("email", "email", "TEXT"),
+                    ("phone", "phone", "TEXT")]
+    },
+    "plant": {
+        "id_column": "plant_id",
+        "key_columns": ["api_id"],
+        "required_columns": ["plant_name"],
+        "columns": [("plant_name", "plant_name", "TEXT"), ("scientific_name", "scientific_name", "TEXT"),
+                    ("cycle", "cycle", "TEXT"), ("sunlight", "sunlight", "TEXT"),
+                    ("api_id", "api_id", "INT"), ("origin_id", "origin_id", "INT")]
+    },
+    "plant_availability": {
+        "id_column": "availability_id",
+        "key_columns": ["error"],
+        "required_columns": [],
+        "columns": [("error", "type_of_availability", "TEXT")]
+    }
+}
+
+class DimensionKeyCache:
+    """
+    Bounded in-process cache from natural key to id for each dimension table.
+    A key cached as None has been looked up and is not in the table
+    """
+
+    def __init__(self, max_size: int = DIMENSION_CACHE_SIZE) -> None:
+        """Creates an empty cache holding at most max_size keys per table"""
+        self.max_size = max_size
+        self.tables = {table: OrderedDict() for table in DIMENSION_TABLES}
+        self.warmed = False
+
+    def warm(self, connection: psycopg2.extensions.connection) -> None:
+        """Fills the cache with the most recent keys of every dimension table in one query"""
+        queries = []
+        for table, dimension in DIMENSION_TABLES.items():
+            table_columns = {column: table_column for column, table_column, _ in dimension["columns"]}
+            keys = ", ".join(table_columns[column] for column in dimension["key_columns"])
+            queries.append(f"""(SELECT '{table}' AS dimension, {dimension["id_column"]} AS id,
+                json_build_array({keys}) AS natural_key FROM {table}
+                ORDER BY {dimension["id_column"]} DESC LIMIT {self.max_size})""")
+
+        with connection.cursor() as cur:
+            cur.execute(" UNION ALL ".join(queries) + ";")
+            rows = cur.fetchall()
+
+        for row in rows:
+            self.put(row["dimension"], tuple(row["natural_key"]), row["id"])
+        self.warmed = True
+
+    def get(self, table: str, key: tuple, default=MISSING):
+        """Returns the id cached for a natural key, or default if the key is not cached"""
+        keys = self.tables[table]
+        if key not in keys:
+            return default
+        keys.move_to_end(key)
+        return keys[key]
+
+    def put(self, table: str, key: tuple, id: int | None) -> None:
+        """Caches the id of a natural key, evicting the least recently used key when full"""
+        keys = self.tables[table]
+        keys[key] = id
+        keys.move_to_end(key)
+        if len(keys) > self.max_size:
+            keys.popitem(last=False)
+
+    def invalidate(self, table: str | None = None) -> None:
+        """Empties the cache for one dimension table, or for all of them"""
+        for name in ([table] if table else self.tables):
+            self.tables[name].clear()
+        if table is None:
+            self.warmed = False
+
+
+class CountingCursor(psycopg2.extras.RealDictCursor):
+    """Dictionary cursor that counts every statement it sends towards the batch metrics"""
+
+    def execute(self, query, vars=None):
+        """Counts the statement before executing it"""
+        count_db_round_trip()
+        return super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        """Counts the COPY before streaming the file"""
+        count_db_round_trip()
+        return super().copy_expert(sql, file, size)
+
+
+DIMENSION_CACHE = DimensionKeyCache()
+partitions_created_on = None
+
 
 def get_db_connection(config: dict) -> psycopg2.extensions.connection | None:
     """
@@ -23,7 +140,7 @@ def get_db_connection(config: dict) -> psycopg2.extensions.connection | None:
                                 user=config["DATABASE_USERNAME"],
                                 host=config["DATABASE_ENDPOINT"],
                                 password=config["DATABASE_PASSWORD"],
-                                cursor_factory=psycopg2.extras.RealDictCursor)
+                                cursor_factory=CountingCursor)
 
     except:
         raise psycopg2.DatabaseError("Error connecting to database.")
@@ -37,203 +154,214 @@ def create_dataframe(file_name: str = "data/plant_data.csv") -> pd.DataFrame:
     return plant_df
 
 
-def insert_dataframe_into_origin_table(connection: psycopg2.extensions.connection, dataframe: pd.DataFrame) -> None:
-    """Inserts origin info from a dataframe into the postgres db"""
-
-    for index, row in dataframe.iterrows():
-        try:
-            with connection:
-                with connection.cursor() as cur:
-                    cur.execute(
-                        "INSERT INTO origin (longitude, latitude, country, continent) VALUES (%s, %s, %s, %s);", row.to_list())
-                    connection.commit()
-
-        except psycopg2.errors.UniqueViolation:
-            continue  # We don't want duplicate values, but also don't want to crash
-        except Exception as e:
-            print("Unexpected Error Ocurred")
-            print(e.args)
-            print(str(e))
-
-
-def insert_dataframe_into_botanist_table(connection: psycopg2.extensions.connection, dataframe: pd.DataFrame) -> None:
-    """Inserts botanist info from a dataframe into the postgres db"""
-
-    for index, row in dataframe.iterrows():
-        try:
-            with connection:
-                with connection.cursor() as cur:
-                    cur.execute(
-                        "INSERT INTO botanist (name, email, phone) VALUES (%s, %s, %s);", row.to_list())
-                    connection.commit()
-
-        except psycopg2.errors.UniqueViolation:
-            continue  # We don't want duplicate values, but also don't want to crash
-        except Exception as e:
-            print("Unexpected Error Ocurred")
-            print(e.args)
-            print(str(e))
-
-
-def add_origin_ids_to_plant_df(connection: psycopg2.extensions.connection, total_dataframe: pd.DataFrame, plant_dataframe: pd.DataFrame) -> pd.DataFrame:
+def build_upsert_query(table: str) -> str:
     """
-    Constructs list of origin ids based on plant data, 
-    then given a plant dataframe, adds a new column with origin ids
+    Builds one statement that inserts the new natural keys of a dimension table
+    and returns the id of every key in the batch, whether new or already stored
     """
 
-    plant_dataframe = plant_dataframe.copy()
-    origin_ids = []
+    dimension = DIMENSION_TABLES[table]
+    id_column = dimension["id_column"]
+    table_columns = {column: table_column for column, table_column, _ in dimension["columns"]}
+    columns = ", ".join(table_columns.values())
+    keys = [table_columns[column] for column in dimension["key_columns"]]
+    required = keys + [table_columns[column] for column in dimension["required_columns"]]
+
+    required_filter = " AND ".join(f"{column} IS NOT NULL" for column in required)
+    key_join = " AND ".join(f"t.{key} = b.{key}" for key in keys)
+
+    return f"""WITH batch ({columns}) AS (VALUES %s),
+        inserted AS (
+            INSERT INTO {table} ({columns})
+            SELECT {columns} FROM batch WHERE {required_filter}
+            ON CONFLICT DO NOTHING
+            RETURNING {id_column}, {", ".join(keys)})
+        SELECT {id_column}, {", ".join(keys)} FROM inserted
+        UNION ALL
+        SELECT t.{id_column}, {", ".join(f"t.{key}" for key in keys)}
+        FROM {table} t JOIN batch b ON {key_join};"""
+
+
+def upsert_dimension(connection: psycopg2.extensions.connection, table: str, dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+    Upserts the distinct natural keys of a batch into a dimension table in one round trip,
+    returning a dataframe mapping each natural key to its id
+    """
 
-    for index, row in total_dataframe.iterrows():
-        with connection.cursor() as cur:
-            cur.execute(
-                "SELECT origin_id FROM origin WHERE (longitude = (%s) and latitude = (%s));", (row["longitude"], row["latitude"]))
-            current_origin_id = cur.fetchone()
-        origin_ids.append(current_origin_id["origin_id"])
+    dimension = DIMENSION_TABLES[table]
+    key_columns = dimension["key_columns"]
+    columns = [column for column, _, _ in dimension["columns"]]
+    id_map_columns = key_columns + [dimension["id_column"]]
 
-    plant_dataframe["origin_id"] = origin_ids
-    return plant_dataframe
+    # rows that can be inserted take priority over lookup-only rows sharing their key
+    batch = dataframe[columns].dropna(subset=key_columns)
+    insertable = batch[dimension["required_columns"]].notna().all(axis=1)
+    batch = pd.concat([batch[insertable], batch[~insertable]]).drop_duplicates(subset=key_columns)
+    if batch.empty:
+        return pd.DataFrame(columns=id_map_columns)
 
+    batch = batch.astype(object).where(batch.notna(), None)
+    template = "(" + ", ".join(f"%s::{column_type}" for _, _, column_type in dimension["columns"]) + ")"
 
-def insert_dataframe_into_plant_table(connection: psycopg2.extensions.connection, dataframe: pd.DataFrame) -> None:
-    """Inserts plant info from a dataframe into the postgres db"""
+    with connection:
+        with connection.cursor() as cur:
+            rows = psycopg2.extras.execute_values(
+                cur, build_upsert_query(table), list(batch.itertuples(index=False, name=None)),
+                template=template, page_size=len(batch), fetch=True)
 
-    for index, row in dataframe.iterrows():
-        try:
-            with connection:
-                with connection.cursor() as cur:
-                    cur.execute(
-                        "INSERT INTO plant (plant_name, scientific_name, cycle, sunlight, api_id, origin_id) VALUES (%s, %s, %s, %s, %s, %s);", row.to_list())
-                    connection.commit()
+    table_columns = {column: table_column for column, table_column, _ in dimension["columns"]}
+    key_names = {table_columns[column]: column for column in key_columns}
+    id_map = pd.DataFrame(rows, columns=[dimension["id_column"], *key_names])
+    id_map = id_map.rename(columns=key_names)
+    return id_map[id_map_columns].drop_duplicates(subset=key_columns)
 
-        except psycopg2.errors.UniqueViolation:
-            continue  # We don't want duplicate values, but also don't want to crash
-        except Exception as e:
-            print("Unexpected Error Ocurred")
-            print(e.args)
-            print(str(e))
 
+def merge_dimension_ids(dataframe: pd.DataFrame, id_map: pd.DataFrame, table: str) -> pd.DataFrame:
+    """Fills in the id column of a dimension for every row of the batch with a single join"""
 
-def insert_dataframe_into_sensor_result_table(connection: psycopg2.extensions.connection, dataframe: pd.DataFrame) -> None:
-    """
-    Finally inserts sensor info from a dataframe into the postgres db. 
-    relies on all other data already having been inserted
-    """
+    dimension = DIMENSION_TABLES[table]
+    id_column = dimension["id_column"]
+    key_columns = dimension["key_columns"]
 
-    for index, row in dataframe.iterrows():
-        with connection:
-            with connection.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO sensor_result (last_watered, soil_moisture, temperature, recording_taken, availability_id, botanist_id, plant_id) VALUES (%s, %s, %s, %s, %s, %s, %s);", row.to_list())
-                connection.commit()
+    dataframe = dataframe.drop(columns=[id_column], errors="ignore")
+    id_map = id_map.astype({key: dataframe[key].dtype for key in key_columns})
+    merged = dataframe.merge(id_map, how="left", on=key_columns)
+    merged.index = dataframe.index
+    return merged
 
 
-def add_availability_ids_to_sensor_df(connection: psycopg2.extensions.connection, total_dataframe: pd.DataFrame, sensor_dataframe: pd.DataFrame) -> pd.DataFrame:
+def add_dimension_ids(connection: psycopg2.extensions.connection, dataframe: pd.DataFrame, table: str,
+                      cache: DimensionKeyCache | None = None) -> pd.DataFrame:
     """
-    Constructs list of availability ids based on sensor data, 
-    then given a sensor dataframe, adds a new column with availability ids
+    Adds the id column of a dimension table to the batch. With a cache, only keys
+    the cache does not know are upserted, so a steady-state batch sends no queries
     """
 
-    sensor_dataframe = sensor_dataframe.copy()
-    availability_ids = []
-
-    for index, row in total_dataframe.iterrows():
-        with connection.cursor() as cur:
-            cur.execute(
-                "SELECT availability_id FROM plant_availability WHERE type_of_availability LIKE %s;", (str(row["error"]),))
-            current_availability_id = cur.fetchone()
-
-        if current_availability_id is None:
-            availability_ids.append(1)
+    if cache is None:
+        id_map = upsert_dimension(connection, table, dataframe)
+        return merge_dimension_ids(dataframe, id_map, table)
+
+    dimension = DIMENSION_TABLES[table]
+    key_columns = dimension["key_columns"]
+
+    batch = dataframe.dropna(subset=key_columns)
+    keys = pd.Series(list(batch[key_columns].itertuples(index=False, name=None)),
+                     index=batch.index, dtype=object)
+    insertable = batch[dimension["required_columns"]].notna().all(axis=1)
+    known = {key: cache.get(table, key) for key in keys.unique()}
+
+    # unknown keys, and keys not in the table that this batch can now insert
+    needs_upsert = keys.map(lambda key: known[key] is MISSING) | (
+        keys.map(lambda key: known[key] is None) & insertable)
+
+    if needs_upsert.any():
+        id_map = upsert_dimension(connection, table, batch[needs_upsert])
+        resolved = dict(zip(id_map[key_columns].itertuples(index=False, name=None),
+                            id_map[dimension["id_column"]]))
+        for key in keys[needs_upsert].unique():
+            known[key] = resolved.get(key)
+
+        # an insertable key that came back without an id conflicted with another row
+        if any(key not in resolved for key in keys[needs_upsert & insertable]):
+            cache.invalidate(table)
         else:
-            availability_ids.append(
-                current_availability_id["availability_id"])
+            for key in keys[needs_upsert].unique():
+                cache.put(table, key, known[key])
 
-    sensor_dataframe["availability_id"] = availability_ids
-    return sensor_dataframe
+    id_map = pd.DataFrame([(*key, id) for key, id in known.items() if id not in (None, MISSING)],
+                          columns=key_columns + [dimension["id_column"]])
+    return merge_dimension_ids(dataframe, id_map, table)
 
 
-def add_botanist_ids_to_sensor_df(connection: psycopg2.extensions.connection, total_dataframe: pd.DataFrame, sensor_dataframe: pd.DataFrame) -> pd.DataFrame:
-    """
-    Constructs list of botanist ids based on sensor data, 
-    then given a sensor dataframe, adds a new column with botanist ids
-    """
+def ensure_sensor_result_partitions(connection: psycopg2.extensions.connection) -> None:
+    """Creates the daily sensor_result partitions from yesterday to the days ahead, once per
+    process per day. The database counts days by its own CURRENT_DATE, so yesterday's
+    partition covers readings stamped by this process while it is a day behind"""
 
-    sensor_dataframe = sensor_dataframe.copy()
-    botanist_ids = []
+    global partitions_created_on
+    if partitions_created_on == date.today():
+        return
 
-    for index, row in total_dataframe.iterrows():
+    with connection:
         with connection.cursor() as cur:
-            cur.execute(
-                "SELECT botanist_id FROM botanist WHERE phone LIKE %s;", (str(row["phone"]),))
-            current_botanist_id = cur.fetchone()
-
-        if current_botanist_id is None:
-            botanist_ids.append(None)
-        else:
-            botanist_ids.append(current_botanist_id["botanist_id"])
+            cur.execute("SELECT create_sensor_result_partitions(%s);",
+                        (PARTITION_DAYS_AHEAD,))
+    partitions_created_on = date.today()
 
-    sensor_dataframe["botanist_id"] = botanist_ids
-    return sensor_dataframe
 
-
-def add_plant_ids_to_sensor_df(connection: psycopg2.extensions.connection, total_dataframe: pd.DataFrame, sensor_dataframe: pd.DataFrame) -> pd.DataFrame:
+def create_sensor_result_buffer(dataframe: pd.DataFrame) -> StringIO:
     """
-    Constructs list of plant ids based on sensor data, 
-    then given a sensor dataframe, adds a new column with plant ids
+    Writes the sensor batch as csv into an in-memory buffer ready for COPY.
+    Missing values become empty fields, which COPY reads as NULL
     """
 
-    sensor_dataframe = sensor_dataframe.copy()
-    plant_ids = []
+    dataframe = dataframe.astype({column: "Int64" for column in SENSOR_ID_COLUMNS})
+    buffer = StringIO()
+    dataframe[SENSOR_RESULT_COLUMNS].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    return buffer
 
-    for index, row in total_dataframe.iterrows():
-        with connection.cursor() as cur:
-            cur.execute(
-                "SELECT plant_id FROM plant WHERE api_id = %s;", (row["api_id"],))
-            current_plant_id = cur.fetchone()
 
-        if current_plant_id is None:
-            plant_ids.append(None)
-        else:
-            plant_ids.append(current_plant_id["plant_id"])
+def insert_dataframe_into_sensor_result_table(connection: psycopg2.extensions.connection, dataframe: pd.DataFrame) -> None:
+    """
+    Finally inserts sensor info from a dataframe into the postgres db,
+    streaming the whole batch with a single COPY in one transaction.
+    relies on all other data already having been inserted
+    """
 
-    sensor_dataframe["plant_id"] = plant_ids
-    return sensor_dataframe
+    buffer = create_sensor_result_buffer(dataframe)
+    copy_query = f"COPY sensor_result ({', '.join(SENSOR_RESULT_COLUMNS)}) FROM STDIN WITH (FORMAT csv);"
 
+    with connection:
+        with connection.cursor() as cur:
+            cur.copy_expert(copy_query, buffer)
 
-def load_all_data(connection: psycopg2.extensions.connection) -> None:
-    """Given a db connection and csv file, inserts all data into the database"""
-    # get all data
-    full_df = create_dataframe()
 
-    # split into individual dfs for insertion
-    origin_df = full_df[["longitude", "latitude", "country", "continent"]]
-    plant_df = full_df[["plant_name",
-                        "scientific_name", "cycle", "sunlight", "api_id"]]
-    botanist_df = full_df[["botanist_name", "email", "phone"]]
-    sensor_df = full_df[['last_watered', 'soil_moisture',
-                         'temperature', 'recording_taken']]
+def resolve_dimension_ids(connection: psycopg2.extensions.connection, full_df: pd.DataFrame,
+                          cache: DimensionKeyCache | None = None) -> pd.DataFrame:
+    """Adds the id column of every dimension table to the batch"""
 
-    # insert data with no foreign key requirements
-    insert_dataframe_into_origin_table(connection, origin_df)
-    insert_dataframe_into_botanist_table(connection, botanist_df)
+    # plants last as they depend on origin ids
+    full_df = add_dimension_ids(connection, full_df, "origin", cache)
+    full_df = add_dimension_ids(connection, full_df, "botanist", cache)
+    full_df = add_dimension_ids(connection, full_df, "plant_availability", cache)
+    return add_dimension_ids(connection, full_df, "plant", cache)
 
-    # update plant data with origin keys
-    plant_df = add_origin_ids_to_plant_df(connection, full_df, plant_df)
 
-    insert_dataframe_into_plant_table(connection, plant_df)
+def load_all_data(connection: psycopg2.extensions.connection, full_df: pd.DataFrame | None = None,
+                  cache: DimensionKeyCache | None = DIMENSION_CACHE) -> int:
+    """
+    Given a db connection and a batch of transformed data, inserts all data into the database.
+    Reads the batch from the csv file when none is passed in. Returns the number of readings copied
+    """
+    # get all data
+    if full_df is None:
+        full_df = create_dataframe()
 
-    # update sensor data with avail, botanist and plant ids.
-    sensor_df = add_availability_ids_to_sensor_df(
-        connection, full_df, sensor_df)
-    sensor_df = add_botanist_ids_to_sensor_df(connection, full_df, sensor_df)
-    sensor_df = add_plant_ids_to_sensor_df(connection, full_df, sensor_df)
+    full_df = full_df.copy()
+    full_df["error"] = full_df["error"].fillna(NO_ERROR)
+    # readings are partitioned by recording time, which the API records as the time of the call
+    full_df["recording_taken"] = full_df["recording_taken"].fillna(
+        pd.Timestamp.now().floor("s"))
 
-    # sensor_df = sensor_df.where(pd.notnull(sensor_df), None)
+    ensure_sensor_result_partitions(connection)
 
-    sensor_df = sensor_df.replace(np.nan, None)
+    if cache is not None and not cache.warmed:
+        cache.warm(connection)
 
-    insert_dataframe_into_sensor_result_table(connection, sensor_df)
+    try:
+        sensor_df = resolve_dimension_ids(connection, full_df, cache)
+        insert_dataframe_into_sensor_result_table(connection, sensor_df)
+
+    except psycopg2.errors.ForeignKeyViolation:
+        if cache is None:
+            raise
+        # a cached id no longer exists, so resolve every key against the db again
+        cache.invalidate()
+        sensor_df = resolve_dimension_ids(connection, full_df)
+        insert_dataframe_into_sensor_result_table(connection, sensor_df)
+
+    return len(sensor_df)
 
 
 if __name__ == "__main__":
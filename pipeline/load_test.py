@@ -0,0 +1,96 @@
+"""Load tests the extract against the mock plant API, measuring throughput and
+request latency percentiles at each number of plants in LOAD_TEST_PLANT_COUNTS"""
+
+import asyncio
+from collections import Counter
+from os import environ
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+
+LOAD_TEST_PLANT_COUNTS = [int(count) for count in
+                          environ.get("LOAD_TEST_PLANT_COUNTS", "50,1000,10000").split(",")]
+MOCK_API_HOST = environ.get("MOCK_API_HOST", "127.0.0.1")
+MOCK_API_PORT = int(environ.get("MOCK_API_PORT", 8080))
+MOCK_API_START_TIMEOUT = 10
+
+
+def start_mock_api(plant_count: int) -> subprocess.Popen:
+    """Starts the mock plant API in its own process, so serving requests does not
+    take time away from the extract being measured, and waits until it is listening"""
+
+    environment = {**environ, "MOCK_PLANT_COUNT": str(plant_count),
+                   "MOCK_API_HOST": MOCK_API_HOST, "MOCK_API_PORT": str(MOCK_API_PORT)}
+    server = subprocess.Popen([sys.executable, "mock_plant_api.py"], env=environment)
+
+    deadline = time.monotonic() + MOCK_API_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((MOCK_API_HOST, MOCK_API_PORT), timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.1)
+
+    server.terminate()
+    raise TimeoutError("The mock plant API did not start listening.")
+
+
+def get_percentiles(latencies: list[float]) -> dict[str, float]:
+    """Returns the p50, p95 and p99 of the latencies in milliseconds"""
+
+    if len(latencies) < 2:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    cut_points = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {f"p{percentile}_ms": round(cut_points[percentile - 1] * 1000, 1)
+            for percentile in (50, 95, 99)}
+
+
+async def measure_extract(plant_count: int) -> dict:
+    """Extracts plants 0 to plant_count with the async extract engine and returns its
+    throughput, request latency percentiles and the errors returned"""
+
+    from extract import MAX_CONCURRENT_REQUESTS, REQUEST_TIMEOUT
+    from extract import create_client_session, gather_plant_data
+    from metrics import start_batch, finish_batch
+
+    batch_metrics = start_batch("plants_load_test", keep_latency_samples=True)
+    started = time.perf_counter()
+    async with create_client_session(MAX_CONCURRENT_REQUESTS, REQUEST_TIMEOUT) as session:
+        plants = await gather_plant_data(range(plant_count + 1), MAX_CONCURRENT_REQUESTS,
+                                         REQUEST_TIMEOUT, session)
+    elapsed = time.perf_counter() - started
+    finish_batch(batch_metrics, textfile=None, gateway_url=None)
+
+    return {"plants": len(plants), "seconds": round(elapsed, 2),
+            "plants_per_second": round(len(plants) / elapsed, 1),
+            **get_percentiles(batch_metrics.http_latency.samples),
+            "errors": dict(Counter(plant["error"] for plant in plants if "error" in plant))}
+
+
+def run_load_test(plant_counts: list[int] = LOAD_TEST_PLANT_COUNTS) -> list[dict]:
+    """Runs the extract against a mock API of each size in turn, printing each result"""
+
+    results = []
+    for plant_count in plant_counts:
+        server = start_mock_api(plant_count)
+        try:
+            result = asyncio.run(measure_extract(plant_count))
+        finally:
+            server.terminate()
+            server.wait()
+
+        print(f"{result['plants']:>6} plants: {result['seconds']:>7.2f} s, "
+              f"{result['plants_per_second']:>8.1f} plants/s, p50 {result['p50_ms']} ms, "
+              f"p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, errors {result['errors']}")
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+
+    # extract reads the API address when it is imported, so it is set first
+    environ["PLANT_API_URL"] = f"http://{MOCK_API_HOST}:{MOCK_API_PORT}/plants/{{}}"
+    run_load_test()
@@ -0,0 +1,272 @@
+"""Records per-stage metrics for each pipeline batch and writes them out as a
+structured JSON log line and in the Prometheus text format.
+Only the standard library is imported, so recording metrics does not slow start up"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+from os import environ, replace
+import resource
+import sys
+import time
+from typing import Iterator
+
+
+METRICS_JOB = environ.get("METRICS_JOB", "plants_pipeline")
+METRICS_TEXTFILE = environ.get("METRICS_TEXTFILE")
+METRICS_PUSHGATEWAY_URL = environ.get("METRICS_PUSHGATEWAY_URL")
+PUSH_TIMEOUT = 5
+
+# Upper bounds in seconds of the buckets plant API request latencies are counted in
+HTTP_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Metric name, help text and the stage attribute it is read from
+STAGE_GAUGES = [
+    ("stage_duration_seconds", "Wall time of the stage in the last batch", "wall_time_seconds"),
+    ("stage_rows_in", "Rows handed to the stage in the last batch", "rows_in"),
+    ("stage_rows_out", "Rows handed on by the stage in the last batch", "rows_out"),
+    ("stage_db_round_trips", "Statements sent to the database by the stage in the last batch",
+     "db_round_trips"),
+    ("stage_peak_rss_bytes", "Peak resident memory of the process by the end of the stage",
+     "peak_rss_bytes")
+]
+
+active_metrics = None
+# Each task or thread records to the stage it is running, so stages can overlap
+current_stage = ContextVar("current_stage", default=None)
+
+
+def get_peak_rss_bytes() -> int:
+    """Returns the peak resident memory of the process so far in bytes"""
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in kilobytes on Linux and in bytes on macOS
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+class StageMetrics:
+    """Wall time, row counts, rejects per reason, database round trips and peak memory of a stage"""
+
+    def __init__(self, name: str, rows_in: int | None = None) -> None:
+        """Creates empty metrics for a stage"""
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.rejected = {}
+        self.db_round_trips = 0
+        self.wall_time_seconds = None
+        self.peak_rss_bytes = None
+
+    def add_rows(self, rows_in: int | None = None, rows_out: int | None = None) -> None:
+        """Adds to the rows handed to and on by the stage"""
+        if rows_in is not None:
+            self.rows_in = (self.rows_in or 0) + rows_in
+        if rows_out is not None:
+            self.rows_out = (self.rows_out or 0) + rows_out
+
+    def add_rejects(self, rejected: dict[str, int]) -> None:
+        """Adds to the number of rows rejected for each reason"""
+        for reason, count in rejected.items():
+            if count:
+                self.rejected[reason] = self.rejected.get(reason, 0) + int(count)
+
+    def to_dict(self) -> dict:
+        """Returns the stage metrics as a dictionary"""
+        return {"wall_time_seconds": self.wall_time_seconds, "rows_in": self.rows_in,
+                "rows_out": self.rows_out, "rejected": self.rejected,
+                "db_round_trips": self.db_round_trips, "peak_rss_bytes": self.peak_rss_bytes}
+
+
+class LatencyHistogram:
+    """Cumulative histogram of request latencies with fixed bucket bounds.
+    Every latency is also kept when keep_samples is set, for exact percentiles"""
+
+    def __init__(self, buckets: tuple[float, ...] = HTTP_LATENCY_BUCKETS,
+                 keep_samples: bool = False) -> None:
+        """Creates an empty histogram"""
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = [] if keep_samples else None
+
+    def observe(self, seconds: float) -> None:
+        """Counts a latency in every bucket it falls within"""
+        self.count += 1
+        self.sum += seconds
+        if self.samples is not None:
+            self.samples.append(seconds)
+        for index, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.bucket_counts[index] += 1
+
+    def to_dict(self) -> dict:
+        """Returns the histogram as a dictionary of cumulative bucket counts"""
+        return {"buckets": {str(bound): count for bound, count
+                            in zip(self.buckets, self.bucket_counts)},
+                "count": self.count, "sum": self.sum}
+
+
+class BatchMetrics:
+    """The metrics of every stage of one pipeline batch"""
+
+    def __init__(self, job: str = METRICS_JOB, keep_latency_samples: bool = False) -> None:
+        """Creates empty metrics for a batch"""
+        self.job = job
+        self.started_at = time.time()
+        self.wall_time_seconds = None
+        self.stages = {}
+        self.http_latency = LatencyHistogram(keep_samples=keep_latency_samples)
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int | None = None) -> Iterator[StageMetrics]:
+        """Times a stage, attributing rejects and round trips recorded meanwhile to it.
+        A stage run once per micro-batch adds up its time and rows over the batch"""
+        stage_metrics = self.stages.setdefault(name, StageMetrics(name))
+        stage_metrics.add_rows(rows_in=rows_in)
+        token = current_stage.set(stage_metrics)
+        started = time.perf_counter()
+        try:
+            yield stage_metrics
+        finally:
+            stage_metrics.wall_time_seconds = ((stage_metrics.wall_time_seconds or 0)
+                                               + time.perf_counter() - started)
+            stage_metrics.peak_rss_bytes = get_peak_rss_bytes()
+            current_stage.reset(token)
+
+    def to_log_record(self) -> dict:
+        """Returns the batch metrics as a structured log record"""
+        return {"event": "pipeline_batch", "job": self.job, "started_at": self.started_at,
+                "wall_time_seconds": self.wall_time_seconds,
+                "stages": {name: stage.to_dict() for name, stage in self.stages.items()},
+                "http_latency_seconds": self.http_latency.to_dict()}
+
+    def to_prometheus(self) -> str:
+        """Returns the batch metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric, help_text, attribute in STAGE_GAUGES:
+            lines += [f"# HELP {self.job}_{metric} {help_text}",
+                      f"# TYPE {self.job}_{metric} gauge"]
+            for name, stage in self.stages.items():
+                value = getattr(stage, attribute)
+                if value is not None:
+                    lines.append(f"{self.job}_{metric}{format_labels(stage=name)} {value}")
+
+        lines += [f"# HELP {self.job}_stage_rejected_rows Rows rejected by the stage "
+                  "in the last batch, by reason",
+                  f"# TYPE {self.job}_stage_rejected_rows gauge"]
+        for name, stage in self.stages.items():
+            for reason, count in stage.rejected.items():
+                lines.append(f"{self.job}_stage_rejected_rows"
+                             f"{format_labels(stage=name, reason=reason)} {count}")
+
+        histogram = f"{self.job}_http_request_duration_seconds"
+        lines += [f"# HELP {histogram} Latency of plant API requests in the last batch",
+                  f"# TYPE {histogram} histogram"]
+        for bound, count in zip(self.http_latency.buckets, self.http_latency.bucket_counts):
+            lines.append(f"{histogram}_bucket{format_labels(le=str(bound))} {count}")
+        lines += [f"{histogram}_bucket{format_labels(le='+Inf')} {self.http_latency.count}",
+                  f"{histogram}_sum {self.http_latency.sum}",
+                  f"{histogram}_count {self.http_latency.count}"]
+
+        if self.wall_time_seconds is not None:
+            lines += [f"# HELP {self.job}_batch_duration_seconds Wall time of the last batch, "
+                      "less than the sum of its stages when they overlap",
+                      f"# TYPE {self.job}_batch_duration_seconds gauge",
+                      f"{self.job}_batch_duration_seconds {self.wall_time_seconds}"]
+        lines += [f"# HELP {self.job}_last_batch_timestamp_seconds Start time of the last batch",
+                  f"# TYPE {self.job}_last_batch_timestamp_seconds gauge",
+                  f"{self.job}_last_batch_timestamp_seconds {self.started_at}"]
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(**labels: str) -> str:
+    """Returns Prometheus labels with backslashes, quotes and newlines escaped"""
+
+    escaped = {name: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for name, value in labels.items()}
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped.items()) + "}"
+
+
+def start_batch(job: str = METRICS_JOB, keep_latency_samples: bool = False) -> BatchMetrics:
+    """Starts recording the metrics of a new batch, which stages then record to"""
+
+    global active_metrics
+    active_metrics = BatchMetrics(job, keep_latency_samples)
+    return active_metrics
+
+
+@contextmanager
+def stage(name: str, rows_in: int | None = None) -> Iterator[StageMetrics]:
+    """Times a stage of the active batch. Outside a batch the metrics are not kept"""
+
+    if active_metrics is None:
+        yield StageMetrics(name, rows_in)
+        return
+    with active_metrics.stage(name, rows_in) as stage_metrics:
+        yield stage_metrics
+
+
+def record_rejects(rejected: dict[str, int]) -> None:
+    """Adds rows rejected for each reason to the current stage of the active batch"""
+
+    stage_metrics = current_stage.get()
+    if active_metrics is not None and stage_metrics is not None:
+        stage_metrics.add_rejects(rejected)
+
+
+def observe_http_latency(seconds: float) -> None:
+    """Counts the latency of a plant API request in the active batch"""
+
+    if active_metrics is not None:
+        active_metrics.http_latency.observe(seconds)
+
+
+def count_db_round_trip() -> None:
+    """Counts a statement sent to the database by the current stage of the active batch"""
+
+    stage_metrics = current_stage.get()
+    if active_metrics is not None and stage_metrics is not None:
+        stage_metrics.db_round_trips += 1
+
+
+def write_textfile(batch_metrics: BatchMetrics, file_name: str) -> None:
+    """Writes the metrics for the node exporter textfile collector. The file is
+    replaced in one step so the collector never reads a half written file"""
+
+    temporary_file_name = f"{file_name}.tmp"
+    with open(temporary_file_name, "w", encoding="utf-8") as textfile:
+        textfile.write(batch_metrics.to_prometheus())
+    replace(temporary_file_name, file_name)
+
+
+def push_metrics(batch_metrics: BatchMetrics, gateway_url: str) -> None:
+    """Replaces the metrics of the job on a Prometheus pushgateway"""
+
+    from urllib.request import Request, urlopen
+
+    request = Request(f"{gateway_url.rstrip('/')}/metrics/job/{batch_metrics.job}",
+                      data=batch_metrics.to_prometheus().encode(), method="PUT",
+                      headers={"Content-Type": "text/plain; version=0.0.4"})
+    with urlopen(request, timeout=PUSH_TIMEOUT):
+        pass
+
+
+def finish_batch(batch_metrics: BatchMetrics, textfile: str | None = METRICS_TEXTFILE,
+                 gateway_url: str | None = METRICS_PUSHGATEWAY_URL) -> None:
+    """Logs the batch metrics as one JSON line and writes them to the textfile
+    and pushgateway when configured. Failing to export never fails the batch"""
+
+    global active_metrics
+    if active_metrics is batch_metrics:
+        active_metrics = None
+    batch_metrics.wall_time_seconds = time.time() - batch_metrics.started_at
+
+    print(json.dumps(batch_metrics.to_log_record()))
+    try:
+        if textfile:
+            write_textfile(batch_metrics, textfile)
+        if gateway_url:
+            push_metrics(batch_metrics, gateway_url)
+    except OSError as error:
+        print(f"Could not export metrics: {error}")
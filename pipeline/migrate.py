@@ -0,0 +1,81 @@
+"""Applies the versioned schema migrations in the migrations folder to the database in order"""
+
+from os import environ, listdir, path
+import re
+
+from dotenv import load_dotenv
+import psycopg2.extensions
+
+from load_short_term import get_db_connection
+
+
+MIGRATIONS_FOLDER = path.join(path.dirname(path.abspath(__file__)), "migrations")
+MIGRATION_FILENAME = re.compile(r"^(\d{4})_[a-z0-9_]+\.sql$")
+
+
+def get_migration_files(folder: str = MIGRATIONS_FOLDER) -> list[tuple[str, str]]:
+    """Returns the version and path of every migration file in the folder, oldest first"""
+
+    migrations = []
+    for filename in listdir(folder):
+        match = MIGRATION_FILENAME.match(filename)
+        if match is not None:
+            migrations.append((match.group(1), path.join(folder, filename)))
+    return sorted(migrations)
+
+
+def get_applied_versions(connection: psycopg2.extensions.connection) -> set[str]:
+    """Returns the versions already applied, creating the table that records them if needed"""
+
+    with connection:
+        with connection.cursor() as cur:
+            cur.execute("""CREATE TABLE IF NOT EXISTS schema_migrations(
+                version TEXT PRIMARY KEY,
+                applied_at TIMESTAMP NOT NULL DEFAULT NOW());""")
+            cur.execute("SELECT version FROM schema_migrations;")
+            return {row["version"] for row in cur.fetchall()}
+
+
+def apply_migration(connection: psycopg2.extensions.connection, version: str, file_path: str) -> None:
+    """Runs one migration file and records its version in the same transaction"""
+
+    with open(file_path, encoding="utf-8") as migration_file:
+        migration = migration_file.read()
+
+    with connection:
+        with connection.cursor() as cur:
+            cur.execute(migration)
+            cur.execute(
+                "INSERT INTO schema_migrations (version) VALUES (%s);", (version,))
+
+
+def run_migrations(connection: psycopg2.extensions.connection, folder: str = MIGRATIONS_FOLDER) -> list[str]:
+    """Applies every migration not yet applied to the database and returns their versions"""
+
+    applied_versions = get_applied_versions(connection)
+    newly_applied = []
+
+    for version, file_path in get_migration_files(folder):
+        if version not in applied_versions:
+            print(f"Applying migration {path.basename(file_path)}")
+            apply_migration(connection, version, file_path)
+            newly_applied.append(version)
+    return newly_applied
+
+
+if __name__ == "__main__":
+
+    load_dotenv()
+    config = {
+        "DATABASE_NAME": environ.get("DATABASE_NAME"),
+        "DATABASE_USERNAME": environ.get("DATABASE_USERNAME"),
+        "DATABASE_ENDPOINT": environ.get("DATABASE_ENDPOINT"),
+        "DATABASE_PASSWORD": environ.get("DATABASE_PASSWORD")
+    }
+
+    conn = get_db_connection(config)
+
+    applied = run_migrations(conn)
+    print(f"{len(applied)} migration(s) applied.")
+
+    conn.close()
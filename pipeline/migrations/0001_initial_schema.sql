@@ -0,0 +1,103 @@
+-- Initial schema: the star schema with sensor_result as the fact table.
+-- Databases created from the old rds_schema.sql already have these tables, so every
+-- statement leaves existing objects as they are and the migration can run on them too
+
+CREATE TABLE IF NOT EXISTS origin(
+    origin_id INT GENERATED ALWAYS AS IDENTITY,
+    longitude FLOAT UNIQUE,
+    latitude FLOAT UNIQUE,
+    country TEXT,
+    continent TEXT,
+    PRIMARY KEY (origin_id)
+);
+
+
+CREATE TABLE IF NOT EXISTS plant(
+    plant_id INT GENERATED ALWAYS AS IDENTITY,
+    origin_id INT,
+    api_id INT UNIQUE,
+    plant_name TEXT,
+    scientific_name TEXT,
+    cycle TEXT,
+    sunlight TEXT,
+    PRIMARY KEY (plant_id),
+    FOREIGN KEY (origin_id) REFERENCES origin(origin_id)
+);
+
+
+CREATE TABLE IF NOT EXISTS botanist(
+    botanist_id INT GENERATED ALWAYS AS IDENTITY,
+    name TEXT,
+    email TEXT,
+    phone TEXT UNIQUE,
+    PRIMARY KEY (botanist_id)
+);
+
+
+CREATE TABLE IF NOT EXISTS plant_availability(
+    availability_id INT GENERATED ALWAYS AS IDENTITY,
+    type_of_availability TEXT UNIQUE,
+    PRIMARY KEY (availability_id)
+);
+
+-- Currently these are the only errors/availability results
+INSERT INTO plant_availability (type_of_availability) VALUES ('No Error') ON CONFLICT DO NOTHING;
+INSERT INTO plant_availability (type_of_availability) VALUES ('plant on loan to another museum') ON CONFLICT DO NOTHING;
+INSERT INTO plant_availability (type_of_availability) VALUES ('plant not found') ON CONFLICT DO NOTHING;
+INSERT INTO plant_availability (type_of_availability) VALUES ('Timeout: The request could not be completed.') ON CONFLICT DO NOTHING;
+INSERT INTO plant_availability (type_of_availability) VALUES ('Missing field in data.') ON CONFLICT DO NOTHING;
+INSERT INTO plant_availability (type_of_availability) VALUES ('Missing soil_moisture reading.') ON CONFLICT DO NOTHING;
+INSERT INTO plant_availability (type_of_availability) VALUES ('Missing temperature reading.') ON CONFLICT DO NOTHING;
+
+
+
+
+-- An unpartitioned sensor_result from rds_schema.sql is renamed out of the way, with the
+-- names of its primary key and identity sequence, and its rows are moved over in 0004
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'sensor_result' AND relkind = 'r') THEN
+        ALTER TABLE sensor_result RENAME TO sensor_result_unpartitioned;
+        ALTER TABLE sensor_result_unpartitioned
+            RENAME CONSTRAINT sensor_result_pkey TO sensor_result_unpartitioned_pkey;
+        ALTER SEQUENCE sensor_result_result_id_seq RENAME TO sensor_result_unpartitioned_result_id_seq;
+    END IF;
+END $$;
+
+
+-- sensor_result is partitioned by day so that expired days can be archived and dropped whole
+CREATE TABLE IF NOT EXISTS sensor_result(
+    result_id INT GENERATED ALWAYS AS IDENTITY,
+    botanist_id INT,
+    availability_id INT,
+    plant_id INT,
+    last_watered TIMESTAMP,
+    soil_moisture FLOAT,
+    temperature FLOAT,
+    recording_taken TIMESTAMP NOT NULL,
+    PRIMARY KEY (result_id, recording_taken),
+    FOREIGN KEY (botanist_id) REFERENCES botanist(botanist_id),
+    FOREIGN KEY (availability_id) REFERENCES plant_availability(availability_id),
+    FOREIGN KEY (plant_id) REFERENCES plant(plant_id)
+) PARTITION BY RANGE (recording_taken);
+
+
+-- Catches any reading that falls outside the daily partitions
+CREATE TABLE IF NOT EXISTS sensor_result_default PARTITION OF sensor_result DEFAULT;
+
+
+-- Creates the daily partitions from today up to days_ahead days in the future
+CREATE OR REPLACE FUNCTION create_sensor_result_partitions(days_ahead INT DEFAULT 2) RETURNS VOID AS $$
+DECLARE
+    partition_day DATE;
+BEGIN
+    FOR day_offset IN 0..days_ahead LOOP
+        partition_day := CURRENT_DATE + day_offset;
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF sensor_result FOR VALUES FROM (%L) TO (%L)',
+            'sensor_result_' || to_char(partition_day, 'YYYYMMDD'), partition_day, partition_day + 1);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_sensor_result_partitions();
@@ -0,0 +1,13 @@
+-- Indexes for the archive and Tableau time range queries and the loader's natural key lookups
+
+-- Readings arrive in time order, so a BRIN index stays tiny while pruning time ranges
+CREATE INDEX sensor_result_recording_taken_brin ON sensor_result USING BRIN (recording_taken);
+
+-- Per plant history over a time range
+CREATE INDEX sensor_result_plant_id_recording_taken_idx ON sensor_result (plant_id, recording_taken);
+
+-- Origins are looked up by both coordinates together
+CREATE INDEX origin_longitude_latitude_idx ON origin (longitude, latitude);
+
+-- botanist.phone, plant.api_id and plant_availability.type_of_availability
+-- already have equality indexes through their UNIQUE constraints
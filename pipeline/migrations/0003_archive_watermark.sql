@@ -0,0 +1,15 @@
+-- High-water mark of the readings already archived to S3 by the long term job
+
+CREATE TABLE archive_watermark(
+    watermark_id INT DEFAULT 1,
+    recording_taken TIMESTAMP NOT NULL,
+    result_id INT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (watermark_id),
+    CHECK (watermark_id = 1)
+);
+
+INSERT INTO archive_watermark (recording_taken, result_id) VALUES ('1970-01-01', 0);
+
+-- Lets the archiver page through readings in (recording_taken, result_id) order
+CREATE INDEX sensor_result_recording_taken_result_id_idx ON sensor_result (recording_taken, result_id);
@@ -0,0 +1,41 @@
+-- Moves the readings of a database created from rds_schema.sql, renamed to
+-- sensor_result_unpartitioned by 0001, into the daily partitions of sensor_result
+
+DO $$
+DECLARE
+    reading_day DATE;
+BEGIN
+    IF to_regclass('sensor_result_unpartitioned') IS NULL THEN
+        RETURN;
+    END IF;
+
+    -- Each day gets its own partition, so the archive drops them whole once they expire
+    FOR reading_day IN SELECT DISTINCT recording_taken::DATE FROM sensor_result_unpartitioned
+                       WHERE recording_taken IS NOT NULL LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF sensor_result FOR VALUES FROM (%L) TO (%L)',
+            'sensor_result_' || to_char(reading_day, 'YYYYMMDD'), reading_day, reading_day + 1);
+    END LOOP;
+
+    -- Readings keep their result_id, which the archive watermark and manifest refer to
+    INSERT INTO sensor_result (result_id, botanist_id, availability_id, plant_id, last_watered,
+                               soil_moisture, temperature, recording_taken)
+        OVERRIDING SYSTEM VALUE
+        SELECT result_id, botanist_id, availability_id, plant_id, last_watered,
+            soil_moisture, temperature, recording_taken
+        FROM sensor_result_unpartitioned
+        WHERE recording_taken IS NOT NULL;
+
+    -- New readings carry on from the last result_id, including any left behind below
+    PERFORM setval(pg_get_serial_sequence('sensor_result', 'result_id'), max(result_id))
+        FROM sensor_result_unpartitioned HAVING max(result_id) IS NOT NULL;
+
+    DELETE FROM sensor_result_unpartitioned WHERE recording_taken IS NOT NULL;
+
+    -- Readings without a recording time cannot be placed in a partition, so are left behind
+    IF EXISTS (SELECT 1 FROM sensor_result_unpartitioned) THEN
+        RAISE NOTICE 'Readings without recording_taken were left in sensor_result_unpartitioned.';
+    ELSE
+        DROP TABLE sensor_result_unpartitioned;
+    END IF;
+END $$;
@@ -0,0 +1,25 @@
+-- Partitions are created from the day before the database's CURRENT_DATE, as the loader
+-- only calls this once per day by its own clock and stamps readings with its own time,
+-- which can be a day behind the database's around midnight
+
+CREATE OR REPLACE FUNCTION create_sensor_result_partitions(days_ahead INT DEFAULT 2) RETURNS VOID AS $$
+DECLARE
+    partition_day DATE;
+BEGIN
+    FOR day_offset IN -1..days_ahead LOOP
+        partition_day := CURRENT_DATE + day_offset;
+        -- A day whose readings already went to the default partition cannot be attached,
+        -- so they stay there until archived
+        IF to_regclass('sensor_result_' || to_char(partition_day, 'YYYYMMDD')) IS NULL
+            AND EXISTS (SELECT 1 FROM sensor_result_default WHERE recording_taken >= partition_day
+                        AND recording_taken < partition_day + 1) THEN
+            CONTINUE;
+        END IF;
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF sensor_result FOR VALUES FROM (%L) TO (%L)',
+            'sensor_result_' || to_char(partition_day, 'YYYYMMDD'), partition_day, partition_day + 1);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_sensor_result_partitions();
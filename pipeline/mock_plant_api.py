@@ -0,0 +1,159 @@
+"""Local stand-in for the plant API, serving the same payloads and error responses with
+configurable latency, error rate and number of plants. Point extract at it with
+PLANT_API_URL=http://127.0.0.1:8080/plants/{}"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from os import environ
+import random
+
+from aiohttp import web
+
+
+MOCK_API_HOST = environ.get("MOCK_API_HOST", "127.0.0.1")
+MOCK_API_PORT = int(environ.get("MOCK_API_PORT", 8080))
+
+NOT_FOUND_ERROR = "plant not found"
+ON_LOAN_ERROR = "plant on loan to another museum"
+# Error responses a plant that exists can give, each equally likely
+ERROR_MODES = ["not found", "on loan", "missing field", "missing reading"]
+# Fields of a plant that can be left out, each making the payload unusable to extract.
+# Readings can also be left out altogether, rather than sent as null
+REQUIRED_FIELDS = ["name", "origin_location", "botanist"]
+READING_FIELDS = ["temperature", "soil_moisture"]
+# Ways a request can fail before a payload is read, each equally likely
+FAILURE_MODES = ["disconnect", "invalid json"]
+
+PLANTS = [("Epipremnum Aureum", "Epipremnum aureum", "Perennial", ["part shade", "full shade"]),
+          ("Venus flytrap", "Dionaea muscipula", "Perennial", ["full sun"]),
+          ("Bird of paradise", "Heliconia schiedeana 'Fire and Ice'", "Perennial", ["full sun"]),
+          ("Cactus", "Opuntia microdasys", "Perennial", ["full sun", "part shade"]),
+          ("Snake plant", "Sansevieria trifasciata", "Perennial", ["part shade"])]
+ORIGINS = [("Resplendor", "BR", "America/Sao_Paulo"), ("Pujali", "IN", "Asia/Kolkata"),
+           ("Ueno", "JP", "Asia/Tokyo"), ("Calauan", "PH", "Asia/Manila"),
+           ("Oschatz", "DE", "Europe/Berlin")]
+BOTANISTS = [("Carl Linnaeus", "carl.linnaeus@lnhm.co.uk", "(146)994-1635x35992"),
+             ("Gertrude Jekyll", "gertrude.jekyll@lnhm.co.uk", "001-481-273-3691x69537"),
+             ("Eliza Andrews", "eliza.andrews@lnhm.co.uk", "(846)669-6651x75948")]
+
+SETTINGS = web.AppKey("settings", dict)
+RANDOM = web.AppKey("random", random.Random)
+
+
+def get_settings() -> dict:
+    """Returns the mock API settings from the environment"""
+
+    return {
+        "plant_count": int(environ.get("MOCK_PLANT_COUNT", 50)),
+        "latency": float(environ.get("MOCK_LATENCY", 0.05)),
+        "slow_rate": float(environ.get("MOCK_SLOW_RATE", 0.01)),
+        "slow_latency": float(environ.get("MOCK_SLOW_LATENCY", 2)),
+        "error_rate": float(environ.get("MOCK_ERROR_RATE", 0.1)),
+        "failure_rate": float(environ.get("MOCK_FAILURE_RATE", 0)),
+        "seed": environ.get("MOCK_SEED")
+    }
+
+
+def build_plant(plant_id: int, rng: random.Random) -> dict:
+    """Returns the payload of a plant. Everything but the readings is the same on every request"""
+
+    name, scientific_name, cycle, sunlight = PLANTS[plant_id % len(PLANTS)]
+    town, country, time_zone = ORIGINS[plant_id % len(ORIGINS)]
+    botanist_name, email, phone = BOTANISTS[plant_id % len(BOTANISTS)]
+    if plant_id >= len(PLANTS):
+        name = f"{name} {plant_id // len(PLANTS)}"
+    now = datetime.now(timezone.utc)
+
+    return {
+        "plant_id": plant_id, "name": name, "scientific_name": [scientific_name],
+        "cycle": cycle, "sunlight": sunlight,
+        "origin_location": [f"{-60 + plant_id * 0.0123 % 120:.5f}",
+                            f"{-170 + plant_id * 0.0345 % 340:.5f}", town, country, time_zone],
+        "botanist": {"name": botanist_name, "email": email, "phone": phone},
+        "last_watered": (now - timedelta(hours=rng.uniform(1, 30))).strftime(
+            "%a, %d %b %Y %H:%M:%S GMT"),
+        "recording_taken": now.strftime("%Y-%m-%d %H:%M:%S"),
+        "soil_moisture": round(rng.uniform(10, 40), 2),
+        "temperature": round(rng.uniform(8, 25), 2)
+    }
+
+
+def build_error_response(mode: str, plant: dict, rng: random.Random) -> tuple[int, dict]:
+    """Returns the status and payload the API gives for an error mode"""
+
+    plant_id = plant["plant_id"]
+    if mode == "not found":
+        return 404, {"error": NOT_FOUND_ERROR, "plant_id": plant_id}
+    if mode == "on loan":
+        return 200, {"error": ON_LOAN_ERROR, "plant_id": plant_id}
+    if mode == "missing field":
+        plant.pop(rng.choice(REQUIRED_FIELDS + READING_FIELDS))
+    else:
+        plant[rng.choice(READING_FIELDS)] = None
+    return 200, plant
+
+
+def choose_response(plant_id: int, settings: dict, rng: random.Random) -> tuple[int, dict]:
+    """Returns the status and payload of a request, giving an error for error_rate of them
+    and plant not found for every id above plant_count"""
+
+    if plant_id > settings["plant_count"]:
+        return 404, {"error": NOT_FOUND_ERROR, "plant_id": plant_id}
+
+    plant = build_plant(plant_id, rng)
+    if rng.random() < settings["error_rate"]:
+        return build_error_response(rng.choice(ERROR_MODES), plant, rng)
+    return 200, plant
+
+
+def choose_latency(settings: dict, rng: random.Random) -> float:
+    """Returns how long to wait before responding, slow_latency for slow_rate of requests"""
+
+    if rng.random() < settings["slow_rate"]:
+        return settings["slow_latency"]
+    return settings["latency"] * rng.uniform(0.5, 1.5)
+
+
+def build_failure(mode: str, request: web.Request) -> web.Response:
+    """Returns a response that cannot be read as a plant, closing the connection
+    without a response for a disconnect"""
+
+    if mode == "disconnect":
+        request.transport.close()
+    return web.Response(text="<html>Application error</html>", content_type="text/html")
+
+
+async def get_plant(request: web.Request) -> web.Response:
+    """Responds to a request for a plant by id, failing for failure_rate of them"""
+
+    settings, rng = request.app[SETTINGS], request.app[RANDOM]
+    try:
+        plant_id = int(request.match_info["plant_id"])
+    except ValueError:
+        return web.json_response({"error": NOT_FOUND_ERROR}, status=404)
+
+    await asyncio.sleep(choose_latency(settings, rng))
+    if settings["failure_rate"] and rng.random() < settings["failure_rate"]:
+        return build_failure(rng.choice(FAILURE_MODES), request)
+    status, payload = choose_response(plant_id, settings, rng)
+    return web.json_response(payload, status=status)
+
+
+def create_app(settings: dict | None = None) -> web.Application:
+    """Returns the mock API application"""
+
+    settings = settings or get_settings()
+    app = web.Application()
+    app[SETTINGS] = settings
+    app[RANDOM] = random.Random(settings.get("seed"))
+    app.router.add_get("/plants/{plant_id}", get_plant)
+    return app
+
+
+if __name__ == "__main__":
+
+    mock_settings = get_settings()
+    print(f"Serving {mock_settings['plant_count'] + 1} mock plants on "
+          f"http://{MOCK_API_HOST}:{MOCK_API_PORT}/plants/{{}} with {mock_settings}")
+    web.run_app(create_app(mock_settings), host=MOCK_API_HOST, port=MOCK_API_PORT,
+                print=None)
@@ -1,18 +1,377 @@
-"""Pipeline script that combines all the extract, transform and load scripts"""
+"""Pipeline script that combines all the extract, transform and load scripts.
+By default the stages are streamed: plants are transformed and loaded in
+micro-batches while the rest of the batch is still being extracted.
+Each stage is imported when it first runs rather than at start up, so pandas,
+aiohttp and psycopg2 are only loaded once a batch needs them"""
 
+from __future__ import annotations
+
+import asyncio
+from math import floor
 from os import environ
+import signal
+from typing import TYPE_CHECKING
 
 from dotenv import load_dotenv
 
-from load_short_term import get_db_connection, load_all_data
-from extract import extract_and_create_csv
-from transform import transform_script
+from metrics import StageMetrics, start_batch, finish_batch, stage, record_rejects
 
+if TYPE_CHECKING:
+    import pandas as pd
+    import psycopg2.extensions
 
-if __name__ == "__main__":
 
-    extract_and_create_csv()
-    transform_script()
+PIPELINE_INTERVAL = float(environ.get("PIPELINE_INTERVAL", 60))
+PIPELINE_ENGINE = environ.get("PIPELINE_ENGINE", "stream")
+MICRO_BATCH_SIZE = int(environ.get("MICRO_BATCH_SIZE", 10))
+# Seconds to wait for a micro-batch to fill before transforming what has arrived
+MICRO_BATCH_WAIT = float(environ.get("MICRO_BATCH_WAIT", 0.5))
+# Transformed micro-batches waiting to be loaded before transform stops taking records
+LOAD_QUEUE_SIZE = int(environ.get("LOAD_QUEUE_SIZE", 2))
+END_OF_STREAM = object()
+# Key of the advisory lock held while a batch runs, so two pipelines never load at once
+PIPELINE_LOCK_ID = 4637
+
+
+def write_checkpoint(plant_data: pd.DataFrame, stage: str, append: bool = False) -> None:
+    """Writes the batch handed on by a stage to a csv file for debugging.
+    Micro-batches after the first are appended"""
+
+    from extract import create_download_folders
+
+    create_download_folders()
+    plant_data.to_csv(f"data/{stage}_plant_data.csv", index=False,
+                      mode="a" if append else "w", header=not append)
+
+
+def process_batch(connection, plant_data: pd.DataFrame, checkpoint: bool = False) -> None:
+    """Transforms and loads an extracted batch"""
+
+    from load_short_term import load_all_data
+    from transform import transform_data
+
+    if checkpoint:
+        write_checkpoint(plant_data, "extracted")
+
+    with stage("transform", rows_in=len(plant_data)) as transform_stage:
+        plant_data = transform_data(plant_data)
+        transform_stage.add_rows(rows_out=len(plant_data))
+    if checkpoint:
+        write_checkpoint(plant_data, "transformed")
+
+    with stage("load", rows_in=len(plant_data)) as load_stage:
+        load_stage.add_rows(rows_out=load_all_data(connection, plant_data))
+
+
+def record_extracted(extract_stage: StageMetrics, plant_data: pd.DataFrame) -> None:
+    """Records the rows extracted, and the plants the API returned an error
+    for instead of a reading as rejected by their error"""
+
+    extract_stage.add_rows(rows_out=len(plant_data))
+    extract_stage.add_rejects(plant_data["error"].value_counts().to_dict())
+
+
+def run_pipeline(connection, checkpoint: bool = False) -> None:
+    """Runs extract, transform and load, handing the batch between the stages in memory.
+    Csv files are only written when checkpoint is set"""
+
+    from extract import extract_plant_data
+
+    batch_metrics = start_batch()
+    try:
+        with stage("extract") as extract_stage:
+            plant_data = extract_plant_data()
+            record_extracted(extract_stage, plant_data)
+        process_batch(connection, plant_data, checkpoint)
+    finally:
+        finish_batch(batch_metrics)
+
+
+def drop_seen_plants(plant_data: pd.DataFrame, seen_plants: set[str]) -> pd.DataFrame:
+    """Removes readings of plants already loaded earlier in the batch, as transform
+    only removes duplicate plants within a micro-batch"""
+
+    seen = plant_data["error"].isna() & plant_data["plant_name"].isin(seen_plants)
+    record_rejects({"duplicate plant": int(seen.sum())})
+    plant_data = plant_data[~seen]
+    seen_plants.update(plant_data.loc[plant_data["error"].isna(), "plant_name"])
+    return plant_data
+
+
+def transform_micro_batch(records: list[dict], seen_plants: set[str],
+                          checkpoint: bool = False, append: bool = False) -> pd.DataFrame:
+    """Transforms the records of a micro-batch"""
+
+    from extract import create_plant_dataframe
+    from transform import transform_data
+
+    plant_data = create_plant_dataframe(records)
+    if checkpoint:
+        write_checkpoint(plant_data, "extracted", append)
+
+    with stage("transform", rows_in=len(plant_data)) as transform_stage:
+        plant_data = drop_seen_plants(transform_data(plant_data), seen_plants)
+        transform_stage.add_rows(rows_out=len(plant_data))
+    if checkpoint:
+        write_checkpoint(plant_data, "transformed", append)
+    return plant_data
+
+
+def load_micro_batch(connection: psycopg2.extensions.connection, plant_data: pd.DataFrame) -> int:
+    """Loads a transformed micro-batch, returning the number of readings copied"""
+
+    from load_short_term import load_all_data
+
+    with stage("load", rows_in=len(plant_data)) as load_stage:
+        rows_loaded = load_all_data(connection, plant_data)
+        load_stage.add_rows(rows_out=rows_loaded)
+    return rows_loaded
+
+
+async def run_in_thread(function, *args):
+    """Runs a blocking stage in a worker thread so responses keep arriving meanwhile.
+    If the task is cancelled the stage is still finished before the cancellation is
+    passed on, so the database connection is never used by two threads at once"""
+
+    work = asyncio.ensure_future(asyncio.to_thread(function, *args))
+    try:
+        return await asyncio.shield(work)
+    except asyncio.CancelledError:
+        await asyncio.wait([work])
+        raise
+
+
+async def extract_records(session, record_queue: asyncio.Queue) -> None:
+    """Puts each plant record on the queue as its response arrives"""
+
+    from extract import NUMBER_OF_PLANTS, MAX_CONCURRENT_REQUESTS, stream_plant_data
+
+    with stage("extract") as extract_stage:
+        async for record in stream_plant_data(session, range(NUMBER_OF_PLANTS + 1),
+                                              MAX_CONCURRENT_REQUESTS):
+            extract_stage.add_rows(rows_out=1)
+            if "error" in record:
+                extract_stage.add_rejects({record["error"]: 1})
+            await record_queue.put(record)
+    await record_queue.put(END_OF_STREAM)
+
+
+async def get_micro_batch(record_queue: asyncio.Queue, size: int,
+                          max_wait: float) -> tuple[list[dict], bool]:
+    """Waits for a record, then takes records until the micro-batch is full, max_wait
+    has passed or extract has finished. Returns the records and whether extract finished"""
+
+    loop = asyncio.get_running_loop()
+    records = []
+    record = await record_queue.get()
+    deadline = loop.time() + max_wait
+
+    while record is not END_OF_STREAM:
+        records.append(record)
+        if len(records) == size:
+            return records, False
+        try:
+            async with asyncio.timeout_at(deadline):
+                record = await record_queue.get()
+        except TimeoutError:
+            return records, False
+    return records, True
+
+
+async def transform_micro_batches(record_queue: asyncio.Queue, load_queue: asyncio.Queue,
+                                  size: int, max_wait: float, checkpoint: bool = False) -> None:
+    """Transforms records in micro-batches and queues them to be loaded. Waits while
+    the load queue is full, which in turn leaves extract waiting on a full record queue"""
+
+    seen_plants = set()
+    micro_batches = 0
+    extract_finished = False
+
+    while not extract_finished:
+        records, extract_finished = await get_micro_batch(record_queue, size, max_wait)
+        if records:
+            plant_data = await run_in_thread(transform_micro_batch, records, seen_plants,
+                                             checkpoint, micro_batches > 0)
+            micro_batches += 1
+            await load_queue.put(plant_data)
+    await load_queue.put(END_OF_STREAM)
+
+
+async def load_micro_batches(connection: psycopg2.extensions.connection,
+                             load_queue: asyncio.Queue) -> int:
+    """Loads transformed micro-batches one at a time as they are queued,
+    returning the number of readings copied"""
+
+    rows_loaded = 0
+    while (plant_data := await load_queue.get()) is not END_OF_STREAM:
+        rows_loaded += await run_in_thread(load_micro_batch, connection, plant_data)
+    return rows_loaded
+
+
+async def stream_batch(connection: psycopg2.extensions.connection, session,
+                       checkpoint: bool = False, micro_batch_size: int = MICRO_BATCH_SIZE,
+                       max_wait: float = MICRO_BATCH_WAIT,
+                       queue_size: int = LOAD_QUEUE_SIZE) -> int:
+    """
+    Runs extract, transform and load at the same time over bounded queues, so a
+    plant is loaded soon after its response arrives and a batch takes about as long
+    as its slowest stage. When load falls behind, the queues fill up and extract
+    stops sending requests until it catches up. Returns the number of readings copied
+    """
+
+    record_queue = asyncio.Queue(maxsize=micro_batch_size)
+    load_queue = asyncio.Queue(maxsize=queue_size)
+
+    stage_tasks = [
+        asyncio.create_task(extract_records(session, record_queue)),
+        asyncio.create_task(transform_micro_batches(record_queue, load_queue,
+                                                    micro_batch_size, max_wait, checkpoint)),
+        asyncio.create_task(load_micro_batches(connection, load_queue))]
+
+    try:
+        done, _ = await asyncio.wait(stage_tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for stage_task in done:
+            # a failed stage is raised as is, so it is handled like a failed batch
+            if stage_task.exception() is not None:
+                raise stage_task.exception()
+    finally:
+        # the other stages would wait forever on a stage that has failed
+        for stage_task in stage_tasks:
+            stage_task.cancel()
+        await asyncio.gather(*stage_tasks, return_exceptions=True)
+    return stage_tasks[-1].result()
+
+
+def get_next_run(started_at: float, interval: float, now: float) -> float:
+    """Returns the first run time after now on the fixed grid of intervals from started_at,
+    so time spent running batches never pushes later runs back"""
+
+    return started_at + (floor((now - started_at) / interval) + 1) * interval
+
+
+def get_live_connection(connection: psycopg2.extensions.connection | None,
+                        config: dict) -> psycopg2.extensions.connection:
+    """Returns the open connection, or a new one if it has been closed or lost"""
+
+    if connection is None or connection.closed:
+        from load_short_term import get_db_connection
+        return get_db_connection(config)
+    return connection
+
+
+def try_lock_pipeline(connection: psycopg2.extensions.connection) -> bool:
+    """Takes the pipeline lock if no other pipeline holds it, returning whether it was taken"""
+
+    with connection:
+        with connection.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s) AS locked;", (PIPELINE_LOCK_ID,))
+            return cur.fetchone()["locked"]
+
+
+def unlock_pipeline(connection: psycopg2.extensions.connection) -> None:
+    """Releases the pipeline lock, which is released anyway if the connection is lost"""
+
+    if not connection.closed:
+        with connection:
+            with connection.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s);", (PIPELINE_LOCK_ID,))
+
+
+async def run_engine(connection: psycopg2.extensions.connection, session,
+                     checkpoint: bool = False) -> None:
+    """Runs one batch with the streaming engine, or with each stage running over
+    the whole batch in turn when PIPELINE_ENGINE is batch"""
+
+    from extract import extract_plant_data_async
+
+    batch_metrics = start_batch()
+    try:
+        if PIPELINE_ENGINE == "stream":
+            await stream_batch(connection, session, checkpoint)
+        else:
+            with stage("extract") as extract_stage:
+                plant_data = await extract_plant_data_async(session)
+                record_extracted(extract_stage, plant_data)
+            process_batch(connection, plant_data, checkpoint)
+    finally:
+        finish_batch(batch_metrics)
+
+
+async def run_batch(connection: psycopg2.extensions.connection, session,
+                    checkpoint: bool = False) -> None:
+    """Runs one batch while holding the pipeline lock, skipping it if another pipeline has it"""
+
+    if not try_lock_pipeline(connection):
+        print("Another pipeline is running a batch, skipping this one.")
+        return
+
+    try:
+        await run_engine(connection, session, checkpoint)
+    finally:
+        unlock_pipeline(connection)
+
+
+async def run_once(connection: psycopg2.extensions.connection, checkpoint: bool = False) -> None:
+    """Runs a single batch over an HTTP session opened for it"""
+
+    from extract import create_client_session
+
+    async with create_client_session() as session:
+        await run_engine(connection, session, checkpoint)
+
+
+async def run_daemon(config: dict, checkpoint: bool = False, interval: float = PIPELINE_INTERVAL,
+                     stop: asyncio.Event | None = None) -> None:
+    """
+    Runs a batch every interval, keeping the database connection and the pooled
+    HTTP session open between batches. Runs are timed from a fixed start so they
+    do not drift, a batch that overruns skips the runs it missed rather than
+    overlapping them, and SIGTERM or SIGINT stop it once the current batch is done
+    """
+
+    import psycopg2
+    from extract import create_client_session
+
+    loop = asyncio.get_running_loop()
+    stop = stop or asyncio.Event()
+    for stop_signal in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(stop_signal, stop.set)
+
+    connection = None
+    started_at = next_run = loop.time()
+
+    try:
+        async with create_client_session() as session:
+            while not stop.is_set():
+                try:
+                    connection = get_live_connection(connection, config)
+                    await run_batch(connection, session, checkpoint)
+                except psycopg2.Error as error:
+                    print(f"Database error, reconnecting before the next batch: {error}")
+                    if connection is not None:
+                        connection.close()
+                except Exception as error:
+                    print(f"Batch failed: {error}")
+
+                following_run = get_next_run(started_at, interval, loop.time())
+                skipped_runs = round((following_run - next_run) / interval) - 1
+                if skipped_runs > 0:
+                    print(f"Batch overran the interval, skipping {skipped_runs} run(s).")
+                next_run = following_run
+
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=next_run - loop.time())
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        for stop_signal in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(stop_signal)
+        if connection is not None:
+            connection.close()
+        print("Pipeline stopped.")
+
+
+if __name__ == "__main__":
 
     load_dotenv()
     config = {
@@ -21,9 +380,18 @@ if __name__ == "__main__":
         "DATABASE_ENDPOINT": environ.get("DATABASE_ENDPOINT"),
         "DATABASE_PASSWORD": environ.get("DATABASE_PASSWORD")
     }
+    checkpoint = environ.get("PIPELINE_CHECKPOINT", "false").lower() == "true"
+
+    if environ.get("PIPELINE_MODE", "once").lower() == "daemon":
+        asyncio.run(run_daemon(config, checkpoint))
 
-    conn = get_db_connection(config)
+    else:
+        from load_short_term import get_db_connection
+        conn = get_db_connection(config)
 
-    load_all_data(conn)
+        if PIPELINE_ENGINE == "stream":
+            asyncio.run(run_once(conn, checkpoint))
+        else:
+            run_pipeline(conn, checkpoint)
 
-    conn.close()
+        conn.close()
@@ -0,0 +1,97 @@
+"""Records the import time of each entry point with python -X importtime and fails
+when an entry point takes longer than its budget to import, or loads a heavy
+dependency before any stage needs it"""
+
+from os import environ, path
+import statistics
+import subprocess
+import sys
+
+
+REPO_FOLDER = path.dirname(path.dirname(path.abspath(__file__)))
+IMPORT_BENCHMARK_RUNS = int(environ.get("IMPORT_BENCHMARK_RUNS", 5))
+
+# Entry point, the folder it runs from and its import budget in milliseconds
+ENTRY_POINTS = [
+    ("pipeline", "pipeline", float(environ.get("PIPELINE_IMPORT_BUDGET_MS", 150))),
+    ("load_long_term", "long_term_data", float(environ.get("LONG_TERM_IMPORT_BUDGET_MS", 900)))
+]
+
+# Dependencies an entry point must not load just by being imported
+HEAVY_MODULES = {
+    "pipeline": ["pandas", "numpy", "aiohttp", "requests", "psycopg2"],
+    "load_long_term": ["boto3", "botocore"]
+}
+
+
+def parse_importtime(output: str) -> dict[str, int]:
+    """Returns the cumulative import time in microseconds of every module in
+    the stderr written by python -X importtime"""
+
+    import_times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.removeprefix("import time:").split("|")
+        import_times[module.strip()] = int(cumulative)
+    return import_times
+
+
+def measure_import(module: str, folder: str) -> dict[str, int]:
+    """Imports a module in a fresh interpreter and returns its import times"""
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=path.join(REPO_FOLDER, folder), capture_output=True,
+                            text=True, check=True)
+    return parse_importtime(result.stderr)
+
+
+def get_import_time_ms(module: str, folder: str, runs: int = IMPORT_BENCHMARK_RUNS) -> float:
+    """Returns the median time in milliseconds taken to import a module over a number of runs"""
+
+    return statistics.median(
+        measure_import(module, folder)[module] / 1000 for _ in range(runs))
+
+
+def get_slowest_imports(import_times: dict[str, int], entry_point: str,
+                        count: int = 10) -> list[tuple[str, int]]:
+    """Returns the modules that took longest to import, not counting the entry point itself"""
+
+    import_times = {module: time for module, time in import_times.items()
+                    if module != entry_point}
+    return sorted(import_times.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+def get_loaded_heavy_modules(module: str, folder: str) -> list[str]:
+    """Returns the heavy dependencies loaded by importing a module in a fresh interpreter"""
+
+    return [heavy_module for heavy_module in HEAVY_MODULES.get(module, [])
+            if heavy_module in measure_import(module, folder)]
+
+
+def check_import_budgets(runs: int = IMPORT_BENCHMARK_RUNS) -> list[str]:
+    """Prints the import time of every entry point and returns the budgets it broke"""
+
+    failures = []
+    for module, folder, budget in ENTRY_POINTS:
+        import_time = get_import_time_ms(module, folder, runs)
+        print(f"\n{module}: {import_time:.1f} ms (budget {budget:.0f} ms)")
+        for slow_module, slow_time in get_slowest_imports(measure_import(module, folder), module):
+            print(f"  {slow_time / 1000:8.1f} ms  {slow_module}")
+
+        if import_time > budget:
+            failures.append(f"{module} took {import_time:.1f} ms to import, "
+                            f"over its budget of {budget:.0f} ms.")
+        for heavy_module in get_loaded_heavy_modules(module, folder):
+            failures.append(f"{module} loads {heavy_module} at import time.")
+    return failures
+
+
+if __name__ == "__main__":
+
+    budget_failures = check_import_budgets()
+
+    if budget_failures:
+        print("\n" + "\n".join(budget_failures))
+        sys.exit(1)
+    print("\nAll entry points are within their import budgets.")
@@ -1,10 +1,12 @@
 """Tests for extract.py file"""
 
+import asyncio
+
 import pandas as pd
 from pytest import raises
 from unittest.mock import MagicMock
 
-from conftest import mock_multiprocessing, mock_acquire_plant_data
+from conftest import mock_multiprocessing, mock_acquire_plant_data, FakeSession
 from extract import *
 
 
@@ -77,3 +79,130 @@ def test_obtain_relevant_data_with_error():
     fake_plant_data = {"test": "error", "plant_id": 0}
     assumed_result = {"api_id": 0, "error": "Missing field in data."}
     assert obtain_relevant_data(fake_plant_data) == assumed_result
+
+
+def test_check_plant_data_missing_temperature(fake_plant_data):
+    """Verifies a response without a temperature is recorded as an error for its plant"""
+
+    plant = {**fake_plant_data, "soil_moisture": 30.5}
+
+    assert check_plant_data(plant) == {"api_id": 1, "error": "Missing field in data."}
+
+
+def test_check_plant_data_missing_plant_id(fake_plant_data):
+    """Verifies a response without a plant id is recorded as an error without one"""
+
+    plant = {**fake_plant_data, "soil_moisture": 30.5, "temperature": 12.4}
+    del plant["plant_id"]
+
+    assert check_plant_data(plant) == {"api_id": None, "error": "Missing field in data."}
+
+
+def test_fetch_plant_data_by_id():
+    """Verifies that the async response is correctly processed"""
+
+    session = FakeSession({"object": "test"})
+    returned_data = asyncio.run(
+        fetch_plant_data_by_id(session, asyncio.Semaphore(1), 3))
+
+    assert returned_data["object"] == "test"
+    assert session.requested_urls == [PLANT_API_URL.format(3)]
+
+
+def test_fetch_plant_data_by_id_timeout():
+    """Verifies that a timed out request is recorded as an error"""
+
+    session = FakeSession(error=asyncio.TimeoutError())
+    returned_data = asyncio.run(
+        fetch_plant_data_by_id(session, asyncio.Semaphore(1), 3))
+
+    assert returned_data == {"error": TIMEOUT_ERROR, "plant_id": 3}
+
+
+def test_add_to_plant_data_list_async(monkeypatch):
+    """Verifies that the async extract returns checked data for every plant in order"""
+
+    async def fake_fetch(session, semaphore, plant_id):
+        return {"plant_id": plant_id, "error": "plant not found"}
+
+    monkeypatch.setattr("extract.fetch_plant_data_by_id", fake_fetch)
+    monkeypatch.setattr("extract.NUMBER_OF_PLANTS", 2)
+
+    returned_data = add_to_plant_data_list_async()
+
+    assert [plant["api_id"] for plant in returned_data] == [0, 1, 2]
+    assert all(plant["error"] == "plant not found" for plant in returned_data)
+
+
+def test_create_plant_dataframe():
+    """Verifies that every batch has the same columns, even with only errors"""
+
+    returned_data = create_plant_dataframe([{"api_id": 1, "error": "plant not found"}])
+    assert returned_data.columns.to_list() == PLANT_DATA_COLUMNS
+    assert returned_data["api_id"].iloc[0] == 1
+
+
+def test_create_plant_dataframe_lists_as_strings():
+    """Verifies that list fields reach transform in the same form as through a csv file"""
+
+    returned_data = create_plant_dataframe([{"api_id": 1, "scientific_name": ["Plantae"],
+                                             "sunlight": ["full sun", "part shade"]}])
+
+    assert returned_data["scientific_name"].iloc[0] == "['Plantae']"
+    assert returned_data["sunlight"].iloc[0] == "['full sun', 'part shade']"
+
+
+def test_extract_plant_data_async_reuses_session(monkeypatch):
+    """Verifies that the extract sends every request over the session it is given"""
+
+    sessions = []
+
+    async def fake_fetch(session, semaphore, plant_id):
+        sessions.append(session)
+        return {"plant_id": plant_id, "error": "plant not found"}
+
+    monkeypatch.setattr("extract.fetch_plant_data_by_id", fake_fetch)
+    monkeypatch.setattr("extract.NUMBER_OF_PLANTS", 2)
+    session = FakeSession()
+
+    returned_data = asyncio.run(extract_plant_data_async(session))
+
+    assert returned_data["api_id"].to_list() == [0, 1, 2]
+    assert all(used is session for used in sessions)
+
+
+def test_stream_plant_data_yields_as_responses_arrive(monkeypatch):
+    """Verifies that plants are yielded in the order their responses arrive"""
+
+    async def fake_fetch(session, semaphore, plant_id):
+        await asyncio.sleep((3 - plant_id) * 0.02)
+        return {"plant_id": plant_id, "error": "plant not found"}
+
+    monkeypatch.setattr("extract.fetch_plant_data_by_id", fake_fetch)
+
+    async def collect():
+        return [plant["api_id"] async for plant in stream_plant_data(FakeSession(), range(3))]
+
+    assert asyncio.run(collect()) == [2, 1, 0]
+
+
+def test_stream_plant_data_waits_for_consumer(monkeypatch):
+    """Verifies that no more than max_concurrent requests are sent ahead of the consumer"""
+
+    requested = []
+
+    async def fake_fetch(session, semaphore, plant_id):
+        requested.append(plant_id)
+        return {"plant_id": plant_id, "error": "plant not found"}
+
+    monkeypatch.setattr("extract.fetch_plant_data_by_id", fake_fetch)
+
+    async def take_one():
+        plants = stream_plant_data(FakeSession(), range(100), max_concurrent=3)
+        await anext(plants)
+        await asyncio.sleep(0.05)
+        await plants.aclose()
+
+    asyncio.run(take_one())
+
+    assert len(requested) == 3
@@ -1,7 +1,10 @@
 """Tests for load_short_term.py file"""
 
+from datetime import date
 from unittest.mock import MagicMock
 
+import pandas as pd
+
 from conftest import FakeConn
 from load_short_term import *
 
@@ -13,13 +16,6 @@ def test_get_db_connection(monkeypatch):
     assert get_db_connection(MagicMock()) is None
 
 
-def test_add_plant_ids_to_sensor_df(fake_dataframe, fake_dataframe_2):
-    """Verifies that None values are kept when received for ids"""
-
-    returned_df = add_plant_ids_to_sensor_df(FakeConn(), fake_dataframe, fake_dataframe)
-    assert returned_df.equals(fake_dataframe_2)
-
-
 def file_removed() -> None:
     """Mocks file removal"""
 
@@ -36,72 +32,159 @@ def test_create_dataframe(monkeypatch, fake_dataframe):
     assert returned_df.equals(fake_dataframe)
 
 
-def test_insert_dataframe_into_origin_table(fake_dataframe, capfd):
-    """Verifies that execute is ran without errors"""
+def test_insert_dataframe_into_sensor_result_table(sensor_dataframe, capfd):
+    """Verifies that the batch is copied without errors"""
 
-    insert_dataframe_into_origin_table(FakeConn(), fake_dataframe)
+    insert_dataframe_into_sensor_result_table(FakeConn(), sensor_dataframe)
     captured = capfd.readouterr()
 
-    assert "Executed!" in captured.out
+    assert "Copied!" in captured.out
+    assert "Executed!" not in captured.out
 
 
-def test_insert_dataframe_into_sensor_result_table(fake_dataframe, capfd):
-    """Verifies that execute is ran without errors"""
+def test_create_sensor_result_buffer(sensor_dataframe):
+    """Verifies that missing values are written as empty fields for COPY to read as NULL"""
 
-    insert_dataframe_into_sensor_result_table(FakeConn(), fake_dataframe)
-    captured = capfd.readouterr()
+    rows = create_sensor_result_buffer(sensor_dataframe).read().splitlines()
 
-    assert "Executed!" in captured.out
+    assert rows == ["2023-08-29 13:24:30,30.5,12.4,2023-08-30 12:01:34,1,3,7",
+                    ",,,2023-08-30 12:01:34,3,,"]
 
 
-def test_add_botanist_ids_to_sensor_df(fake_dataframe_2):
-    """Verifies that execution has changed the correct things in the dataframe"""
+def test_build_upsert_query():
+    """Verifies that the upsert inserts only complete rows and returns ids for every key"""
 
-    fake_dataframe_2 = fake_dataframe_2.rename(columns={"api_id": "botanist_id", "plant_id": "phone"})
+    query = build_upsert_query("plant")
 
-    returned_df = add_botanist_ids_to_sensor_df(FakeConn(), fake_dataframe_2, fake_dataframe_2)
-    assert returned_df["phone"].equals(fake_dataframe_2["phone"])
+    assert "WHERE api_id IS NOT NULL AND plant_name IS NOT NULL" in query
+    assert "ON CONFLICT DO NOTHING" in query
+    assert "RETURNING plant_id, api_id" in query
+    assert "JOIN batch b ON t.api_id = b.api_id" in query
 
 
-def test_add_origin_ids_to_plant_df(fake_dataframe_2):
-    """Verifies that execution has changed the correct things in the dataframe"""
+def test_upsert_dimension(monkeypatch, plant_dataframe):
+    """Verifies that distinct keys are sent in one statement and mapped back to ids"""
 
-    fake_dataframe_2 = fake_dataframe_2.rename(columns={"api_id": "latitude", "plant_id": "longitude"})
-    fake_connection = MagicMock()
-    fake_cursor = fake_connection.cursor().__enter__()
-    fake_fetch = fake_cursor.fetchone
-    fake_fetch.return_value = {"origin_id": None}
-    returned_df = add_origin_ids_to_plant_df(fake_connection, fake_dataframe_2, fake_dataframe_2)
-    print(returned_df["origin_id"])
-    assert returned_df["origin_id"].isna().sum()
+    sent_rows = []
 
+    def fake_execute_values(cur, query, rows, **kwargs):
+        sent_rows.extend(rows)
+        return [{"botanist_id": 5, "phone": "001-481-273-3691"}]
 
-def test_insert_dataframe_into_botanist_table(fake_dataframe, capfd):
-    """Verifies that execute is ran without errors"""
+    monkeypatch.setattr("psycopg2.extras.execute_values", fake_execute_values)
+    id_map = upsert_dimension(FakeConn(), "botanist", plant_dataframe)
 
-    insert_dataframe_into_botanist_table(FakeConn(), fake_dataframe)
-    captured = capfd.readouterr()
+    assert sent_rows == [("Fake Name", "fake.name@lnhm.co.uk", "001-481-273-3691")]
+    assert id_map.to_dict("records") == [{"phone": "001-481-273-3691", "botanist_id": 5}]
 
-    assert "Executed!" in captured.out
 
+def test_upsert_dimension_prefers_complete_rows(monkeypatch, plant_dataframe):
+    """Verifies that an error row does not hide the plant details sharing its api_id"""
 
-def test_insert_dataframe_into_plant_table(fake_dataframe, capfd):
-    """Verifies that execute is ran without errors"""
+    sent_rows = []
 
-    insert_dataframe_into_plant_table(FakeConn(), fake_dataframe)
-    captured = capfd.readouterr()
+    def fake_execute_values(cur, query, rows, **kwargs):
+        sent_rows.extend(rows)
+        return []
+
+    monkeypatch.setattr("psycopg2.extras.execute_values", fake_execute_values)
+    upsert_dimension(FakeConn(), "plant", plant_dataframe)
+
+    assert [row[0] for row in sent_rows] == ["Plant 1", None]
+
+
+def test_merge_dimension_ids(plant_dataframe):
+    """Verifies that ids are joined onto every row and unknown keys are left missing"""
+
+    id_map = pd.DataFrame({"api_id": [1], "plant_id": [7]})
+    returned_df = merge_dimension_ids(plant_dataframe, id_map, "plant")
+
+    assert returned_df.index.equals(plant_dataframe.index)
+    assert returned_df["plant_id"].to_list()[1:] == [7, 7]
+    assert pd.isna(returned_df["plant_id"].iloc[0])
+
+
+def test_dimension_key_cache_evicts_least_recent():
+    """Verifies that the cache stays bounded and keeps recently used keys"""
+
+    cache = DimensionKeyCache(max_size=2)
+    cache.put("plant", (1,), 10)
+    cache.put("plant", (2,), 20)
+    cache.get("plant", (1,))
+    cache.put("plant", (3,), 30)
+
+    assert cache.get("plant", (1,)) == 10
+    assert cache.get("plant", (2,)) is MISSING
+    assert cache.get("plant", (3,)) == 30
 
-    assert "Executed!" in captured.out
 
+def test_dimension_key_cache_invalidate():
+    """Verifies that invalidating one table leaves the others cached"""
 
-def test_add_availability_ids_to_sensor_df(fake_dataframe_2):
-    """Verifies that execution has changed the correct things in the dataframe"""
+    cache = DimensionKeyCache()
+    cache.put("plant", (1,), 10)
+    cache.put("botanist", ("001-481-273-3691",), 5)
+    cache.invalidate("plant")
 
-    fake_dataframe_2 = fake_dataframe_2.rename(columns={"api_id": "error"})
+    assert cache.get("plant", (1,)) is MISSING
+    assert cache.get("botanist", ("001-481-273-3691",)) == 5
+
+
+def test_add_dimension_ids_cached_keys_send_no_queries(monkeypatch, plant_dataframe):
+    """Verifies that a batch of known keys is resolved from the cache alone"""
+
+    def fail_upsert(*args):
+        raise AssertionError("Dimension queried")
+
+    monkeypatch.setattr("load_short_term.upsert_dimension", fail_upsert)
+    cache = DimensionKeyCache()
+    cache.put("plant", (0,), None)
+    cache.put("plant", (1,), 7)
+
+    returned_df = add_dimension_ids(FakeConn(), plant_dataframe, "plant", cache)
+    assert returned_df["plant_id"].to_list()[1:] == [7, 7]
+
+
+def test_add_dimension_ids_caches_new_keys(monkeypatch, plant_dataframe):
+    """Verifies that only unknown keys are upserted and their ids are cached"""
+
+    upserted = []
+
+    def fake_upsert(connection, table, dataframe):
+        upserted.extend(dataframe["api_id"].to_list())
+        return pd.DataFrame({"api_id": [1], "plant_id": [7]})
+
+    monkeypatch.setattr("load_short_term.upsert_dimension", fake_upsert)
+    cache = DimensionKeyCache()
+    cache.put("plant", (0,), None)
+
+    add_dimension_ids(FakeConn(), plant_dataframe, "plant", cache)
+    assert upserted == [1, 1]
+    assert cache.get("plant", (1,)) == 7
+
+
+def test_ensure_sensor_result_partitions_once_per_day(monkeypatch):
+    """Verifies the partitions are created on the first load of each day only"""
+
+    class FakeDate:
+        """Fakes the current date"""
+        day = date(2023, 9, 1)
+
+        @classmethod
+        def today(cls) -> date:
+            return cls.day
+
+    monkeypatch.setattr("load_short_term.date", FakeDate)
+    monkeypatch.setattr("load_short_term.partitions_created_on", None)
     fake_connection = MagicMock()
     fake_cursor = fake_connection.cursor().__enter__()
-    fake_fetch = fake_cursor.fetchone
-    fake_fetch.return_value = {"availability_id": None}
-    returned_df = add_availability_ids_to_sensor_df(fake_connection, fake_dataframe_2, fake_dataframe_2)
-    print(returned_df["availability_id"])
-    assert returned_df["availability_id"].isna().sum()
\ No newline at end of file
+
+    ensure_sensor_result_partitions(fake_connection)
+    ensure_sensor_result_partitions(fake_connection)
+    assert fake_cursor.execute.call_count == 1
+
+    FakeDate.day = date(2023, 9, 2)
+    ensure_sensor_result_partitions(fake_connection)
+    assert fake_cursor.execute.call_count == 2
+    fake_cursor.execute.assert_called_with("SELECT create_sensor_result_partitions(%s);",
+                                           (PARTITION_DAYS_AHEAD,))
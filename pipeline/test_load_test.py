@@ -0,0 +1,17 @@
+"""Tests for load_test.py file"""
+
+from load_test import get_percentiles
+
+
+def test_get_percentiles():
+    """Verifies the percentiles of the latencies are returned in milliseconds"""
+
+    latencies = [index / 1000 for index in range(1, 101)]
+
+    assert get_percentiles(latencies) == {"p50_ms": 50.5, "p95_ms": 95.1, "p99_ms": 99.0}
+
+
+def test_get_percentiles_too_few_latencies():
+    """Verifies no percentiles are given without at least two latencies"""
+
+    assert get_percentiles([0.1]) == {"p50_ms": None, "p95_ms": None, "p99_ms": None}
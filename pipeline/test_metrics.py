@@ -0,0 +1,133 @@
+"""Tests for metrics.py file"""
+
+import json
+from unittest.mock import MagicMock
+
+import metrics
+from metrics import BatchMetrics, LatencyHistogram, start_batch, finish_batch, stage
+from metrics import record_rejects, observe_http_latency, count_db_round_trip
+from metrics import format_labels, push_metrics
+
+
+def test_stage_records_work_done_in_the_stage():
+    """Verifies rows, rejects and round trips are recorded against the stage running"""
+
+    batch_metrics = start_batch("test_job")
+    with stage("transform", rows_in=5) as transform_stage:
+        record_rejects({"temperature above 39": 2, "phone invalid": 0})
+        count_db_round_trip()
+        transform_stage.rows_out = 3
+    record_rejects({"outside a stage": 1})
+    finish_batch(batch_metrics, textfile=None, gateway_url=None)
+
+    transform_stage = batch_metrics.stages["transform"]
+    assert transform_stage.to_dict()["rows_in"] == 5
+    assert transform_stage.rows_out == 3
+    assert transform_stage.rejected == {"temperature above 39": 2}
+    assert transform_stage.db_round_trips == 1
+    assert transform_stage.wall_time_seconds >= 0
+    assert transform_stage.peak_rss_bytes > 0
+
+
+def test_recording_outside_a_batch_is_ignored():
+    """Verifies stages still run when no batch is being recorded"""
+
+    metrics.active_metrics = None
+    with stage("load") as load_stage:
+        count_db_round_trip()
+        observe_http_latency(0.2)
+
+    assert load_stage.db_round_trips == 0
+    assert metrics.active_metrics is None
+
+
+def test_latency_histogram_is_cumulative():
+    """Verifies a latency is counted in every bucket at or above it"""
+
+    histogram = LatencyHistogram(buckets=(0.1, 1, 10))
+    for seconds in (0.05, 0.5, 0.5, 20):
+        histogram.observe(seconds)
+
+    assert histogram.bucket_counts == [1, 3, 3]
+    assert histogram.count == 4
+    assert histogram.sum == 21.05
+
+
+def test_latency_histogram_keeps_samples():
+    """Verifies every latency is kept only when samples are asked for"""
+
+    histogram = LatencyHistogram(keep_samples=True)
+    histogram.observe(0.2)
+    histogram.observe(0.4)
+
+    assert histogram.samples == [0.2, 0.4]
+    assert LatencyHistogram().samples is None
+
+
+def test_format_labels_escapes_values():
+    """Verifies quotes, backslashes and newlines in label values are escaped"""
+
+    assert format_labels(stage="load", reason='bad "value"\\\n') == \
+        '{stage="load",reason="bad \\"value\\"\\\\\\n"}'
+
+
+def test_to_prometheus():
+    """Verifies stage gauges, rejects and the latency histogram are written out"""
+
+    batch_metrics = BatchMetrics("test_job")
+    with batch_metrics.stage("extract") as extract_stage:
+        extract_stage.rows_out = 51
+        extract_stage.add_rejects({"plant not found": 2})
+    batch_metrics.http_latency.observe(0.3)
+
+    lines = batch_metrics.to_prometheus().splitlines()
+
+    assert "# TYPE test_job_stage_duration_seconds gauge" in lines
+    assert 'test_job_stage_rows_out{stage="extract"} 51' in lines
+    assert not any(line.startswith("test_job_stage_rows_in{") for line in lines)
+    assert 'test_job_stage_rejected_rows{stage="extract",reason="plant not found"} 2' in lines
+    assert 'test_job_http_request_duration_seconds_bucket{le="0.25"} 0' in lines
+    assert 'test_job_http_request_duration_seconds_bucket{le="0.5"} 1' in lines
+    assert 'test_job_http_request_duration_seconds_bucket{le="+Inf"} 1' in lines
+    assert "test_job_http_request_duration_seconds_count 1" in lines
+
+
+def test_finish_batch_logs_json_and_writes_textfile(tmp_path, capfd):
+    """Verifies the batch is logged as one JSON line and written to the textfile"""
+
+    textfile = tmp_path / "pipeline.prom"
+    batch_metrics = start_batch("test_job")
+    with stage("load", rows_in=4) as load_stage:
+        load_stage.rows_out = 4
+    finish_batch(batch_metrics, textfile=str(textfile), gateway_url=None)
+
+    log_record = json.loads(capfd.readouterr().out.strip().splitlines()[-1])
+    assert log_record["event"] == "pipeline_batch"
+    assert log_record["stages"]["load"]["rows_out"] == 4
+    assert textfile.read_text() == batch_metrics.to_prometheus()
+    assert not (tmp_path / "pipeline.prom.tmp").exists()
+    assert metrics.active_metrics is None
+
+
+def test_finish_batch_survives_failed_export(tmp_path, capfd):
+    """Verifies a textfile that cannot be written does not fail the batch"""
+
+    finish_batch(start_batch(), textfile=str(tmp_path / "missing" / "pipeline.prom"),
+                 gateway_url=None)
+
+    assert "Could not export metrics" in capfd.readouterr().out
+
+
+def test_push_metrics(monkeypatch):
+    """Verifies the metrics replace the job's group on the pushgateway"""
+
+    fake_urlopen = MagicMock()
+    monkeypatch.setattr("urllib.request.urlopen", fake_urlopen)
+    batch_metrics = BatchMetrics("test_job")
+
+    push_metrics(batch_metrics, "http://pushgateway:9091/")
+
+    request = fake_urlopen.call_args.args[0]
+    assert request.full_url == "http://pushgateway:9091/metrics/job/test_job"
+    assert request.get_method() == "PUT"
+    assert request.data == batch_metrics.to_prometheus().encode()
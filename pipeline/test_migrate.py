@@ -0,0 +1,48 @@
+"""Tests for migrate.py file"""
+
+from unittest.mock import MagicMock
+
+from migrate import get_migration_files, run_migrations
+
+
+def test_get_migration_files_in_order(tmp_path):
+    """Verifies that only migration files are returned, oldest first"""
+
+    for filename in ["0002_second.sql", "0001_first.sql", "notes.txt", "draft.sql"]:
+        (tmp_path / filename).write_text("SELECT 1;")
+
+    migrations = get_migration_files(str(tmp_path))
+    assert [version for version, _ in migrations] == ["0001", "0002"]
+
+
+def test_get_migration_files_shipped():
+    """Verifies that the shipped migrations start with the initial schema"""
+
+    migrations = get_migration_files()
+    assert migrations[0][1].endswith("0001_initial_schema.sql")
+
+
+def test_run_migrations_skips_applied(monkeypatch, tmp_path):
+    """Verifies that only migrations not yet recorded are applied"""
+
+    for filename in ["0001_first.sql", "0002_second.sql"]:
+        (tmp_path / filename).write_text("SELECT 1;")
+    applied = []
+
+    monkeypatch.setattr("migrate.get_applied_versions", lambda *args: {"0001"})
+    monkeypatch.setattr("migrate.apply_migration",
+                        lambda connection, version, file_path: applied.append(version))
+
+    assert run_migrations(MagicMock(), str(tmp_path)) == ["0002"]
+    assert applied == ["0002"]
+
+
+def test_initial_schema_runs_on_existing_tables():
+    """Verifies that the initial schema leaves the tables of a database created
+    from rds_schema.sql in place, so it can be applied to the cloud database"""
+
+    with open(get_migration_files()[0][1], encoding="utf-8") as migration_file:
+        migration = migration_file.read()
+
+    assert "CREATE TABLE " not in migration.replace("CREATE TABLE IF NOT EXISTS ", "")
+    assert migration.count("ON CONFLICT DO NOTHING") == migration.count("INSERT INTO")
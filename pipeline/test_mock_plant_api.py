@@ -0,0 +1,117 @@
+"""Tests for mock_plant_api.py file"""
+
+import asyncio
+import random
+
+from aiohttp import web
+import pytest
+
+from extract import check_plant_data, gather_plant_data, REQUEST_ERROR
+from mock_plant_api import build_plant, build_error_response, choose_response, choose_latency
+from mock_plant_api import create_app, FAILURE_MODES, REQUIRED_FIELDS, READING_FIELDS
+
+
+SETTINGS = {"plant_count": 3, "latency": 0, "slow_rate": 0, "slow_latency": 0,
+            "error_rate": 0, "failure_rate": 0, "seed": 1}
+
+
+def test_build_plant_is_read_by_extract():
+    """Verifies a plant payload has every field extract reads"""
+
+    plant = check_plant_data(build_plant(7, random.Random(1)))
+
+    assert "error" not in plant
+    assert plant["api_id"] == 7
+    assert plant["plant_name"] == "Bird of paradise 1"
+    assert plant["continent"] == "Asia"
+
+
+def test_build_error_response_modes():
+    """Verifies each error mode gives the error extract records for it"""
+
+    rng = random.Random(1)
+    errors = {}
+    for mode in ("not found", "on loan", "missing field", "missing reading"):
+        status, payload = build_error_response(mode, build_plant(1, rng), rng)
+        errors[mode] = (status, check_plant_data(payload)["error"])
+
+    assert errors["not found"] == (404, "plant not found")
+    assert errors["on loan"] == (200, "plant on loan to another museum")
+    assert errors["missing field"] == (200, "Missing field in data.")
+    assert errors["missing reading"][1] in ("Missing temperature reading.",
+                                            "Missing soil_moisture reading.")
+
+
+def test_build_error_response_missing_field_covers_readings():
+    """Verifies any required field or reading can be left out, each recorded as a missing field"""
+
+    rng = random.Random(1)
+    missing_fields = set()
+    for _ in range(50):
+        plant = build_plant(1, rng)
+        status, payload = build_error_response("missing field", dict(plant), rng)
+        missing_fields.update(plant.keys() - payload.keys())
+        assert (status, check_plant_data(payload)["error"]) == (200, "Missing field in data.")
+
+    assert missing_fields == set(REQUIRED_FIELDS + READING_FIELDS)
+
+
+def test_choose_response_not_found_above_plant_count():
+    """Verifies ids past the last plant are not found and the rest are plants"""
+
+    rng = random.Random(1)
+
+    assert choose_response(4, SETTINGS, rng) == (404, {"error": "plant not found", "plant_id": 4})
+    assert choose_response(3, SETTINGS, rng)[1]["name"] == "Cactus"
+
+
+def test_choose_response_error_rate():
+    """Verifies every response is an error when the error rate is one"""
+
+    rng = random.Random(1)
+    responses = [choose_response(1, {**SETTINGS, "error_rate": 1}, rng)[1] for _ in range(20)]
+
+    assert all("error" in check_plant_data(plant) for plant in responses)
+
+
+def test_choose_latency_slow_rate():
+    """Verifies slow requests wait for slow_latency"""
+
+    assert choose_latency({**SETTINGS, "slow_rate": 1, "slow_latency": 5}, random.Random(1)) == 5
+
+
+async def extract_from_mock_api(settings: dict, plant_ids: range, monkeypatch) -> list[dict]:
+    """Serves the mock API on a free port and extracts the plants from it"""
+
+    runner = web.AppRunner(create_app(settings))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0]
+    monkeypatch.setattr("extract.PLANT_API_URL", f"http://{host}:{port}/plants/{{}}")
+    try:
+        return await gather_plant_data(plant_ids, max_concurrent=2, timeout=5)
+    finally:
+        await runner.cleanup()
+
+
+def test_extract_against_mock_api(monkeypatch):
+    """Verifies the extract reads every plant served by the mock API"""
+
+    plants = asyncio.run(extract_from_mock_api(SETTINGS, range(5), monkeypatch))
+
+    assert [plant.get("error") for plant in plants] == [None, None, None, None, "plant not found"]
+    assert [plant["api_id"] for plant in plants] == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("mode", FAILURE_MODES)
+def test_extract_survives_failed_requests(monkeypatch, mode):
+    """Verifies a dropped connection or a body that is not JSON only loses that plant"""
+
+    monkeypatch.setattr("mock_plant_api.FAILURE_MODES", [mode])
+    settings = {**SETTINGS, "failure_rate": 0.5}
+
+    plants = asyncio.run(extract_from_mock_api(settings, range(4), monkeypatch))
+
+    assert [plant["api_id"] for plant in plants] == [0, 1, 2, 3]
+    assert {plant.get("error") for plant in plants} == {None, REQUEST_ERROR}
@@ -0,0 +1,161 @@
+"""Tests for pipeline.py file"""
+
+import asyncio
+import time
+from unittest.mock import MagicMock
+
+import pandas as pd
+from pytest import raises
+
+from pipeline import get_next_run, get_live_connection, run_batch, run_daemon
+from pipeline import drop_seen_plants, get_micro_batch, stream_batch, END_OF_STREAM
+
+
+def test_get_next_run_on_schedule():
+    """Verifies that the next run stays on the grid however long the batch took"""
+
+    assert get_next_run(100.0, 60.0, 100.0) == 160.0
+    assert get_next_run(100.0, 60.0, 112.5) == 160.0
+
+
+def test_get_next_run_after_overrun():
+    """Verifies that runs missed by an overrunning batch are skipped, not queued"""
+
+    assert get_next_run(100.0, 60.0, 230.0) == 280.0
+
+
+def test_get_live_connection_reconnects(monkeypatch):
+    """Verifies that a closed connection is replaced and an open one kept"""
+
+    new_connection = MagicMock()
+    monkeypatch.setattr("load_short_term.get_db_connection", lambda config: new_connection)
+    open_connection = MagicMock(closed=0)
+
+    assert get_live_connection(open_connection, {}) is open_connection
+    assert get_live_connection(MagicMock(closed=1), {}) is new_connection
+    assert get_live_connection(None, {}) is new_connection
+
+
+def test_run_batch_skips_when_locked(monkeypatch):
+    """Verifies that no batch is run while another pipeline holds the lock"""
+
+    fake_extract = MagicMock()
+    monkeypatch.setattr("pipeline.try_lock_pipeline", lambda connection: False)
+    monkeypatch.setattr("extract.extract_plant_data_async", fake_extract)
+
+    asyncio.run(run_batch(MagicMock(), MagicMock()))
+
+    fake_extract.assert_not_called()
+
+
+def test_run_daemon_reuses_connection_until_stopped(monkeypatch):
+    """Verifies that batches keep running on one connection, even after a failed batch,
+    until the daemon is told to stop"""
+
+    connections = []
+    fake_connection = MagicMock(closed=0)
+    monkeypatch.setattr("load_short_term.get_db_connection", lambda config: fake_connection)
+
+    async def run_until_third_batch():
+        stop = asyncio.Event()
+
+        async def fake_run_batch(connection, session, checkpoint):
+            connections.append(connection)
+            if len(connections) == 1:
+                raise ValueError("API down")
+            if len(connections) == 3:
+                stop.set()
+
+        monkeypatch.setattr("pipeline.run_batch", fake_run_batch)
+        await run_daemon({}, interval=0.01, stop=stop)
+
+    asyncio.run(run_until_third_batch())
+
+    assert connections == [fake_connection] * 3
+    fake_connection.close.assert_called_once()
+
+
+def test_get_micro_batch_fills_to_size():
+    """Verifies micro-batches are cut at their size and the end of extract is reported"""
+
+    async def take_micro_batches():
+        record_queue = asyncio.Queue()
+        for record in ({"api_id": 0}, {"api_id": 1}, {"api_id": 2}, END_OF_STREAM):
+            record_queue.put_nowait(record)
+        return [await get_micro_batch(record_queue, 2, 1.0) for _ in range(2)]
+
+    assert asyncio.run(take_micro_batches()) == [
+        ([{"api_id": 0}, {"api_id": 1}], False), ([{"api_id": 2}], True)]
+
+
+def test_get_micro_batch_stops_waiting():
+    """Verifies a part filled micro-batch is handed on once the wait is over"""
+
+    async def take_micro_batch():
+        record_queue = asyncio.Queue()
+        record_queue.put_nowait({"api_id": 0})
+        return await get_micro_batch(record_queue, 10, 0.01)
+
+    assert asyncio.run(take_micro_batch()) == ([{"api_id": 0}], False)
+
+
+def test_drop_seen_plants():
+    """Verifies readings of plants seen in earlier micro-batches are dropped, but errors kept"""
+
+    seen_plants = {"Plant 1"}
+    plant_data = pd.DataFrame({"plant_name": [None, "Plant 1", "Plant 2"],
+                               "error": ["plant not found", None, None]})
+
+    returned_data = drop_seen_plants(plant_data, seen_plants)
+
+    assert returned_data.index.to_list() == [0, 2]
+    assert seen_plants == {"Plant 1", "Plant 2"}
+
+
+def test_stream_batch_backpressure(monkeypatch):
+    """Verifies every record is loaded, and that extract stops requesting plants
+    while load is behind instead of reading the whole batch into memory"""
+
+    requested = []
+    requested_during_first_load = []
+
+    async def fake_fetch(session, semaphore, plant_id):
+        requested.append(plant_id)
+        return {"plant_id": plant_id, "error": "plant not found"}
+
+    def fake_load(connection, plant_data):
+        time.sleep(0.1)
+        if not requested_during_first_load:
+            requested_during_first_load.append(len(requested))
+        return len(plant_data)
+
+    monkeypatch.setattr("extract.fetch_plant_data_by_id", fake_fetch)
+    monkeypatch.setattr("extract.NUMBER_OF_PLANTS", 99)
+    monkeypatch.setattr("extract.MAX_CONCURRENT_REQUESTS", 5)
+    monkeypatch.setattr("pipeline.transform_micro_batch",
+                        lambda records, seen_plants, checkpoint, append: records)
+    monkeypatch.setattr("pipeline.load_micro_batch", fake_load)
+
+    rows_loaded = asyncio.run(stream_batch(MagicMock(), MagicMock(), micro_batch_size=5,
+                                           max_wait=1.0, queue_size=1))
+
+    assert rows_loaded == 100
+    assert requested_during_first_load[0] < 40
+
+
+def test_stream_batch_raises_failed_stage(monkeypatch):
+    """Verifies a failed stage stops the stream and is raised as it is"""
+
+    async def fake_fetch(session, semaphore, plant_id):
+        return {"plant_id": plant_id, "error": "plant not found"}
+
+    def fake_load(connection, plant_data):
+        raise ValueError("Load failed")
+
+    monkeypatch.setattr("extract.fetch_plant_data_by_id", fake_fetch)
+    monkeypatch.setattr("pipeline.transform_micro_batch",
+                        lambda records, seen_plants, checkpoint, append: records)
+    monkeypatch.setattr("pipeline.load_micro_batch", fake_load)
+
+    with raises(ValueError):
+        asyncio.run(stream_batch(MagicMock(), MagicMock()))
@@ -0,0 +1,50 @@
+"""Tests for the startup_benchmark script"""
+
+from startup_benchmark import parse_importtime, get_slowest_imports, get_loaded_heavy_modules
+from startup_benchmark import measure_import
+
+
+IMPORTTIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:      1500 |       4000 |     json.decoder
+import time:       300 |       4300 |   json
+import time:       900 |       5200 | pipeline
+"""
+
+
+def test_parse_importtime():
+    """Verifies the cumulative time of every module is read and the header skipped"""
+
+    assert parse_importtime(IMPORTTIME_OUTPUT) == {
+        "_io": 120, "json.decoder": 4000, "json": 4300, "pipeline": 5200}
+
+
+def test_get_slowest_imports_leaves_out_entry_point():
+    """Verifies the slowest imports are sorted and do not include the entry point"""
+
+    slowest = get_slowest_imports(parse_importtime(IMPORTTIME_OUTPUT), "pipeline", count=2)
+
+    assert slowest == [("json", 4300), ("json.decoder", 4000)]
+
+
+def test_pipeline_import_loads_no_heavy_modules():
+    """Verifies importing the pipeline leaves the stage dependencies until a batch runs"""
+
+    assert get_loaded_heavy_modules("pipeline", "pipeline") == []
+
+
+def test_load_long_term_import_loads_no_heavy_modules():
+    """Verifies importing the long term load leaves boto3 to the entry point"""
+
+    assert get_loaded_heavy_modules("load_long_term", "long_term_data") == []
+
+
+def test_measure_import_parses_real_importtime_output():
+    """Verifies the -X importtime output of a real interpreter is parsed, including the
+    entry point and the modules it imports. Import time itself is left to
+    startup_benchmark.py, as timings vary too much between machines for the unit tests"""
+
+    import_times = measure_import("pipeline", "pipeline")
+
+    assert {"pipeline", "metrics", "asyncio"} <= import_times.keys()
+    assert import_times["pipeline"] >= import_times["metrics"] > 0
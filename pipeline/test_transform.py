@@ -3,13 +3,16 @@
 from datetime import datetime
 
 import pandas as pd
-from pytest import raises
 
 from transform import remove_duplicate_plants, remove_comma
 from transform import remove_formatting, removing_invalid_values
-from transform import renaming_values, time_format_changed, missing_time_fixed
-from transform import correct_time_recorded, change_to_numeric
+from transform import renaming_values
+from transform import correct_time_recorded
 from transform import verifying_botanist_data, find_phone_number, find_email
+from transform import transform_data, parse_last_watered, parse_recording_taken
+from transform import validate_column, validate_botanist_columns, validate_phone_number
+from transform import build_validity_mask
+from metrics import start_batch, finish_batch, stage
 
 
 def test_remove_duplicate_plants_data_removed(duplicate_data):
@@ -72,21 +75,6 @@ def test_find_email_wront_type():
     assert find_email([]) is None
 
 
-def test_time_format_changed_incorrect():
-    """Verifies None is returned when time-string is
-    in incorrect format"""
-
-    assert time_format_changed(None) is None
-
-
-def test_time_format_changed_correct():
-    """Verifies datetype value is returned when time-string
-    is in correct format"""
-
-    time_string = "Tue, 29 Aug 2023 13:24:30 GMT"
-    assert isinstance(time_format_changed(time_string), datetime)
-
-
 def test_find_phone_number_correct():
     """Verifies None is returned when incorrectly
     formatted phone number is entered"""
@@ -103,51 +91,147 @@ def test_find_phone_number_incorrect():
     assert find_phone_number(number) == number
 
 
-def test_change_to_numeric_fully_numeric_df(duplicate_data):
-    """Verifies that numeric data is kept"""
+def test_correct_time_recorded(time_df):
+    """Verifying that time is correctly changed"""
 
-    returned_data = change_to_numeric(duplicate_data, ["plant_name"])
-    assert not returned_data.iloc[0:3].empty
+    returned_data, error_data = correct_time_recorded(time_df)
+    assert error_data.shape == (1, 3)
+    assert returned_data.shape == (5, 3)
+    assert all(isinstance(returned_data["last_watered"].iloc[i], datetime) for i in range (5))
 
 
-def test_change_to_numeric_not_fully_numeric_df(duplicate_data):
-    """Verifies that non numeric data is removed"""
+def test_transform_data_in_memory(plant_batch):
+    """Verifies that an in-memory batch is cleaned without a csv round-trip"""
 
-    extra_row = pd.DataFrame(["not numeric", 2], index=[4, 5])
-    duplicate_data = pd.concat([extra_row, duplicate_data])
-    returned_data = change_to_numeric(duplicate_data, ["plant_name"])
+    returned_data = transform_data(plant_batch)
 
-    with raises(IndexError):
-        returned_data.iloc[3]
+    assert returned_data["api_id"].to_list() == [0, 1, 2]
+    assert returned_data["error"].iloc[0] == "plant not found"
+    assert returned_data["phone"].iloc[1] == "001-481-273-3691x69537"
+    assert all(isinstance(returned_data["recording_taken"].iloc[i], datetime) for i in (1, 2))
 
 
-def test_missing_time_fixed_time():
-    """Verifies datetime is changed from a string"""
+def test_parse_last_watered():
+    """Verifies that the whole column is parsed and missing times are kept missing"""
 
-    time = missing_time_fixed("2023-05-26 12:01:34", {})
-    assert isinstance(time, datetime)
+    column = pd.Series(["Tue, 29 Aug 2023 13:24:30 GMT", None])
+    returned_data = parse_last_watered(column)
 
+    assert returned_data.iloc[0] == datetime(2023, 8, 29, 13, 24, 30)
+    assert pd.isna(returned_data.iloc[1])
 
-def test_missing_time_fixed_not_time():
-    """Verifies that None is correctly kept
-    as None"""
 
-    time = missing_time_fixed(None, {})
-    assert not isinstance(time, datetime)
+def test_parse_recording_taken_fills_missing(time_df):
+    """Verifies that each time is parsed and a missing time takes the last good time"""
 
+    returned_data = parse_recording_taken(time_df["recording_taken"])
 
-def test_missing_time_fixed_wrong_type(time_df):
-    """Verifying that recording_taken is adjusted with last value if None"""
+    assert returned_data.to_list() == [datetime(2023, 5, 26, 12, i, 34) for i in range(5)] + \
+        [datetime(2023, 5, 26, 12, 4, 34)]
 
-    cache_dict = {}
-    returned_data = time_df["recording_taken"].apply(lambda row: missing_time_fixed(row, cache_dict))
-    assert isinstance(returned_data.iloc[-1], datetime)
 
+def test_parse_recording_taken_leading_missing():
+    """Verifies that missing times before the first good time stay missing"""
 
-def test_correct_time_recorded(time_df):
-    """Verifying that time is correctly changed"""
+    column = pd.Series([None, "2023-05-26 12:01:34", None])
+    returned_data = parse_recording_taken(column)
 
-    returned_data, error_data = correct_time_recorded(time_df)
+    assert pd.isna(returned_data.iloc[0])
+    assert returned_data.iloc[2] == returned_data.iloc[1]
+
+
+def test_parse_recording_taken_malformed():
+    """Verifies that a malformed time is not filled, and later missing times
+    are filled from the last good time"""
+
+    column = pd.Series(["2023-05-26 12:01:34", "26/05/2023", None])
+    returned_data = parse_recording_taken(column)
+
+    assert pd.isna(returned_data.iloc[1])
+    assert returned_data.iloc[2] == returned_data.iloc[0]
+
+
+def test_correct_time_recorded_rejects_malformed(time_df):
+    """Verifies that rows with a malformed time are dropped and recorded as rejected"""
+
+    time_df.loc[2, "recording_taken"] = "not a time"
+    batch_metrics = start_batch("test_job")
+    with stage("transform"):
+        returned_data, error_data = correct_time_recorded(time_df)
+    finish_batch(batch_metrics, textfile=None, gateway_url=None)
+
+    assert returned_data.index.to_list() == [1, 3, 4, 5]
     assert error_data.shape == (1, 3)
-    assert returned_data.shape == (5, 3)
-    assert all(isinstance(returned_data["last_watered"].iloc[i], datetime) for i in range (5))
+    assert batch_metrics.stages["transform"].rejected == {"recording_taken malformed": 1}
+
+
+def test_validate_column_counts_rejected():
+    """Verifies that invalid values are removed and counted but missing values are not"""
+
+    column = pd.Series(["001.630.832.2711", "not a number", None, "001.630.832.2711"])
+    returned_data, rejected = validate_column(column, validate_phone_number)
+
+    assert returned_data.to_list() == ["001-630-832-2711", None, None, "001-630-832-2711"]
+    assert rejected == 1
+
+
+def test_validate_column_memoizes_raw_values():
+    """Verifies that each distinct raw value is only validated once"""
+
+    validated = []
+
+    def validator(raw):
+        validated.append(raw)
+        return raw
+
+    validate_column(pd.Series(["a", "b", "a", "a", "b"]), validator)
+    assert sorted(validated) == ["a", "b"]
+
+
+def test_validate_botanist_columns():
+    """Verifies that both botanist columns are checked and their rejections reported"""
+
+    plant_data = pd.DataFrame({"email": ["test.email@yahoo.com", "+++++@yahoo.com"],
+                               "phone": ["(146)994-1635x35992", "(146)994-1635x35992"]})
+    returned_data, rejected = validate_botanist_columns(plant_data)
+
+    assert returned_data["email"].to_list() == ["test.email@yahoo.com", None]
+    assert rejected == {"email": 1, "phone": 0}
+
+
+def test_build_validity_mask_counts_each_rule():
+    """Verifies that each rule reports the rows it rejected"""
+
+    plant_data = pd.DataFrame({"soil_moisture": ["50", "101", "wet", "-1"],
+                               "temperature": [12, 12, 12, 40]})
+    rules = {"soil_moisture": {"numeric": True, "min": 0, "max": 100},
+             "temperature": {"numeric": True, "min": -10, "max": 39}}
+    valid_rows, rejected = build_validity_mask(plant_data, rules)
+
+    assert valid_rows.to_list() == [True, False, False, False]
+    assert rejected == {"soil_moisture not numeric": 1, "soil_moisture below 0": 1,
+                        "soil_moisture above 100": 1, "temperature not numeric": 0,
+                        "temperature below -10": 0, "temperature above 39": 1}
+
+
+def test_removing_invalid_values(plant_batch):
+    """Verifies that readings out of range or missing a required field are removed"""
+
+    plant_data = plant_batch.iloc[1:].copy()
+    plant_data.loc[1, "temperature"] = 80
+    returned_data = removing_invalid_values(plant_data)
+
+    assert returned_data["api_id"].to_list() == [2]
+    assert returned_data["longitude"].dtype == float
+
+
+def test_transform_data_records_rejects(plant_batch):
+    """Verifies the rows dropped by each rule are recorded against the transform stage"""
+
+    plant_batch.loc[1, "temperature"] = 80
+    batch_metrics = start_batch("test_job")
+    with stage("transform"):
+        transform_data(plant_batch)
+    finish_batch(batch_metrics, textfile=None, gateway_url=None)
+
+    assert batch_metrics.stages["transform"].rejected == {"temperature above 39": 1}
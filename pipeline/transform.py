@@ -1,82 +1,123 @@
 """Modifies data from the csv file and cleans it"""
 
 from datetime import datetime
+from functools import lru_cache
 from os import remove
-from re import fullmatch
+import re
+from typing import Callable
 
+import numpy as np
 import pandas as pd
 
+from metrics import record_rejects
+
+
+LAST_WATERED_FORMAT = "%a, %d %b %Y %H:%M:%S %Z"
+RECORDING_TAKEN_FORMAT = "%Y-%m-%d %H:%M:%S"
+EMAIL_PATTERN = re.compile(
+    r"((?:(?:[a-z0-9_-]+\.)?)+[a-z0-9_-]+@[a-z0-9_-]+\.[a-z]+(?:\.[a-z]+)?)")
+PHONE_NUMBER_PATTERN = re.compile(r"(\+?\(?[0-9-\.]+\)?(?:[x0-9-\.]+)?)")
+VALIDATION_CACHE_SIZE = 4096
+VALIDITY_RULES = {
+    "plant_name": {"required": True},
+    "soil_moisture": {"numeric": True, "min": 0, "max": 100},
+    "temperature": {"numeric": True, "min": -10, "max": 39},
+    "longitude": {"numeric": True},
+    "latitude": {"numeric": True}
+}
+
 
 def remove_duplicate_plants(plant_data: pd.DataFrame) -> pd.DataFrame:
     """Returns data-frame without duplicate plants"""
 
+    rows_in = len(plant_data)
     plant_data.drop_duplicates(subset="plant_name", keep="first", inplace=True)
+    record_rejects({"duplicate plant": rows_in - len(plant_data)})
     return plant_data
 
 
-def time_format_changed(row: str) -> datetime | None:
-    """Returns datatype object from a string
-    or None if None entered"""
-
-    try:
-        format = "%a, %d %b %Y %H:%M:%S %Z"
-        return datetime.strptime(row, format)
-
-    except TypeError:
-        return None
+def parse_last_watered(column: pd.Series) -> pd.Series:
+    """Parses a whole column of last watered time-strings in one pass,
+    leaving NaT where the time is missing"""
 
+    parsed = pd.to_datetime(column, format=LAST_WATERED_FORMAT,
+                            errors="coerce", utc=True)
+    return parsed.dt.tz_localize(None)
 
-def missing_time_fixed(row: str, cache: dict) -> datetime | None:
-    """Changes recorded time to a value if None entered
-    and always returns a datatype value"""
 
-    try:
-        time = datetime.strptime(row, "%Y-%m-%d %H:%M:%S")
-        cache["last_time"] = time
-        return time
+def parse_recording_taken(column: pd.Series) -> pd.Series:
+    """Parses a whole column of recording taken time-strings in one pass
+    and carries the last good time forward over missing values only.
+    Malformed times are left as NaT rather than given another row's time"""
 
-    except TypeError:
-        if "last_time" in list(cache.keys()):
-            return cache["last_time"]
-        return None
+    parsed = pd.to_datetime(
+        column, format=RECORDING_TAKEN_FORMAT, errors="coerce")
+    return parsed.where(column.notna(), parsed.ffill())
 
 
 def correct_time_recorded(plant_data: pd.DataFrame) -> tuple[pd.DataFrame]:
     """Returns errors recorded after time-recorded is added and
     data-frame object without errors in timestamps"""
 
-    cache_dict = {}
-    plant_data["last_watered"] = plant_data["last_watered"].apply(
-        time_format_changed)
-    plant_data["recording_taken"] = plant_data["recording_taken"].apply(lambda
-                                                                        row: missing_time_fixed(row, cache_dict))
+    plant_data["last_watered"] = parse_last_watered(plant_data["last_watered"])
+    recording_taken = parse_recording_taken(plant_data["recording_taken"])
+    malformed = plant_data["recording_taken"].notna() & recording_taken.isna()
+    plant_data["recording_taken"] = recording_taken
+    plant_data = plant_data[~malformed]
+    record_rejects({"recording_taken malformed": int(malformed.sum())})
     plant_errors = plant_data[plant_data["error"].notnull()]
     plant_data = plant_data[~plant_data["error"].notnull()]
+    rows_in = len(plant_data)
     plant_data = plant_data[plant_data["recording_taken"]
                             >= plant_data["last_watered"]]
+    record_rejects({"watered after recording taken": rows_in - len(plant_data)})
     return plant_data, plant_errors
 
 
-def change_to_numeric(plant_data: pd.DataFrame, columns: str) -> pd.DataFrame:
-    """Changes entered columns to a numeric type and removes rows where data
-    cannot be numeric for specified columns"""
+def build_validity_mask(plant_data: pd.DataFrame,
+                        rules: dict[str, dict] = VALIDITY_RULES) -> tuple[pd.Series, dict[str, int]]:
+    """Coerces the numeric columns and combines every rule into one boolean mask of valid rows.
+    Returns the mask and the number of rows each rule rejected"""
 
-    for column in columns:
-        plant_data[column] = pd.to_numeric(plant_data[column], errors="coerce")
-        plant_data = plant_data.dropna(subset=[column])
-    return plant_data
+    valid_rows = pd.Series(True, index=plant_data.index)
+    rejected = {}
+
+    for column, rule in rules.items():
+        values = plant_data[column]
+        checks = {}
+        if rule.get("required"):
+            checks[f"{column} missing"] = values.notna()
+        if rule.get("numeric"):
+            values = pd.to_numeric(values, errors="coerce")
+            plant_data[column] = values
+            checks[f"{column} not numeric"] = values.notna()
+        if "min" in rule:
+            checks[f"{column} below {rule['min']}"] = ~(values < rule["min"])
+        if "max" in rule:
+            checks[f"{column} above {rule['max']}"] = ~(values > rule["max"])
+
+        for reason, check in checks.items():
+            rejected[reason] = int((~check).sum())
+            valid_rows &= check
+
+    return valid_rows, rejected
+
+
+def apply_validity_rules(plant_data: pd.DataFrame) -> tuple[pd.DataFrame, dict[str, int]]:
+    """Returns the rows that pass every validity rule and the number rejected by each rule"""
+
+    valid_rows, rejected = build_validity_mask(plant_data)
+    return plant_data[valid_rows], rejected
 
 
 def removing_invalid_values(plant_data: pd.DataFrame) -> pd.DataFrame:
     """Returns a data-frame without invalid values in columns"""
 
-    columns_to_numeric = ["soil_moisture",
-                          "temperature", "longitude", "latitude"]
-    plant_data = change_to_numeric(plant_data, columns_to_numeric)
-    plant_data["soil_moisture"] = plant_data[plant_data["soil_moisture"] <= 100 &
-                                             plant_data["soil_moisture"] >= 0]
-    plant_data["temperature"] = plant_data[plant_data["temperature"] >= -10 &
-                                           plant_data["temperature"] <= 39]
+    plant_data, rejected = apply_validity_rules(plant_data)
+    rejected = {reason: count for reason, count in rejected.items() if count}
+    record_rejects(rejected)
+    if rejected:
+        print(f"Rejected readings: {rejected}")
     return plant_data
 
 
@@ -112,28 +153,74 @@ def find_email(row: str) -> str | None:
 
     if not isinstance(row, str):
         return
-    email_expression = r"((?:(?:[a-z0-9_-]+\.)?)+[a-z0-9_-]+@[a-z0-9_-]+\.[a-z]+(?:\.[a-z]+)?)"
-    match = fullmatch(email_expression, row)
+    match = EMAIL_PATTERN.fullmatch(row)
     return match.group() if match is not None else None
 
 
 def find_phone_number(row: str) -> str | None:
     """Finds a phone number with regex from text"""
 
-    number_expression = r"(\+?\(?[0-9-\.]+\)?(?:[x0-9-\.]+)?)"
-    match = fullmatch(number_expression, row)
+    match = PHONE_NUMBER_PATTERN.fullmatch(row)
     return match.group().replace(".", "-") if match is not None else None
 
 
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def validate_email(raw: str) -> str | None:
+    """Returns the verified email for a raw value, remembering values already seen"""
+
+    return find_email(raw)
+
+
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def validate_phone_number(raw: str) -> str | None:
+    """Returns the normalised phone number for a raw value, remembering values already seen"""
+
+    return find_phone_number(raw) if isinstance(raw, str) else None
+
+
+def validate_column(column: pd.Series, validator: Callable) -> tuple[pd.Series, int]:
+    """Validates each distinct value in a column once and maps the results back
+    over every row. Returns the validated column and the number of values rejected"""
+
+    codes, uniques = pd.factorize(column)
+    validated = np.array([validator(raw) for raw in uniques] + [None], dtype=object)
+    validated_column = pd.Series(validated[codes], index=column.index, dtype=object)
+    rejected = int((validated_column.isna() & column.notna()).sum())
+    return validated_column, rejected
+
+
+def validate_botanist_columns(plant_data: pd.DataFrame) -> tuple[pd.DataFrame, dict[str, int]]:
+    """Verifies the email and phone-number columns in bulk and returns the data-frame
+    with the number of values rejected in each column"""
+
+    plant_data["email"], rejected_emails = validate_column(
+        plant_data["email"], validate_email)
+    plant_data["phone"], rejected_phones = validate_column(
+        plant_data["phone"], validate_phone_number)
+    return plant_data, {"email": rejected_emails, "phone": rejected_phones}
+
+
 def verifying_botanist_data(plant_data: pd.DataFrame) -> pd.DataFrame:
     """Verifies the email and phone-number format in the data-frame"""
 
-    plant_data["email"] = plant_data["email"].apply(find_email)
-    plant_data["phone"] = plant_data["phone"].apply(
-        lambda row: find_phone_number(row) if isinstance(row, str) else None)
+    plant_data, rejected = validate_botanist_columns(plant_data)
+    record_rejects({f"{column} invalid": count for column, count in rejected.items()})
+    if any(rejected.values()):
+        print(f"Rejected botanist values: {rejected}")
     return plant_data
 
 
+def transform_data(data: pd.DataFrame) -> pd.DataFrame:
+    """Cleans an in-memory batch and returns it with the error rows first"""
+
+    data, error_rows = correct_time_recorded(data)
+    data = removing_invalid_values(data)
+    data = renaming_values(data)
+    data = remove_duplicate_plants(data)
+    data = verifying_botanist_data(data)
+    return pd.concat([error_rows, data])
+
+
 def transform_script() -> None:
     """The main function connection all transform script"""
 
@@ -143,11 +230,7 @@ def transform_script() -> None:
     csv_filename = "data/plant_data.csv"
     data = pd.read_csv(csv_filename, index_col=[3])
 
-    data, error_rows = correct_time_recorded(data)
-    data = renaming_values(data)
-    data = remove_duplicate_plants(data)
-    data = verifying_botanist_data(data)
-    data = pd.concat([error_rows, data])
+    data = transform_data(data)
     remove(csv_filename)
     data.to_csv(csv_filename)
 
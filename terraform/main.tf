@@ -241,7 +241,12 @@ resource "aws_ecs_task_definition" "house-of-plants-short-pipeline-ecs" {
         {
           "name" : "DATABASE_PASSWORD",
           "value" : var.DATABASE_PASSWORD
+        },
+        {
+          "name" : "PIPELINE_MODE",
+          "value" : "daemon"
       }],
+      "stopTimeout" : 90,
       "logConfiguration" : {
         "logDriver" : "awslogs",
         "options" : {
@@ -428,29 +433,21 @@ resource "aws_ecs_service" "house-of-plants-long-dashboard-service" {
 }
 
 
-resource "aws_scheduler_schedule" "house-of-plants-short-schedule" {
-  name       = "house-of-plants-short-schedule"
-  group_name = "default"
-
-  flexible_time_window {
-    mode = "OFF"
-  }
+resource "aws_ecs_service" "house-of-plants-short-pipeline-service" {
+  name            = "house-of-plants-short-pipeline-service"
+  cluster         = aws_ecs_cluster.house-of-plants-cluster.id
+  task_definition = aws_ecs_task_definition.house-of-plants-short-pipeline-ecs.arn
+  desired_count   = 1
+  launch_type     = "FARGATE"
 
-  schedule_expression = "cron(* * * * ? *)"
+  # Stop the old daemon before starting the new one, the advisory lock covers any overlap
+  deployment_minimum_healthy_percent = 0
+  deployment_maximum_percent         = 100
 
-  target {
-    arn      = aws_ecs_cluster.house-of-plants-cluster.arn
-    role_arn = aws_iam_role.ecs-task-execution-role.arn
-    ecs_parameters {
-      task_definition_arn = aws_ecs_task_definition.house-of-plants-short-pipeline-ecs.arn
-      launch_type         = "FARGATE"
-      task_count          = 1
-      network_configuration {
-        assign_public_ip = true
-        subnets          = ["subnet-03b1a3e1075174995", "subnet-0667517a2a13e2a6b", "subnet-0cec5bdb9586ed3c4"]
-        security_groups  = [aws_security_group.house-of-plants-ecs-sg.id]
-      }
-    }
+  network_configuration {
+    subnets          = ["subnet-03b1a3e1075174995", "subnet-0667517a2a13e2a6b", "subnet-0cec5bdb9586ed3c4"]
+    security_groups  = [aws_security_group.house-of-plants-ecs-sg.id]
+    assign_public_ip = true
   }
 }
 